@@ -0,0 +1,39 @@
+import argparse
+import os
+import sys
+import yaml
+
+from types import SimpleNamespace
+
+#Run from the repository root so happy_circuits and its testscripts resolve the same way as a normal job
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import happy_circuits
+from mock_device import build_devices, generate_intent
+
+
+parser = argparse.ArgumentParser(description = "happy circuits benchmark job")
+parser.add_argument("--devices", type=int, default=2, help="Number of synthetic devices")
+parser.add_argument("--circuits", type=int, default=5, help="Circuits per device")
+parser.add_argument("--neighbors", type=int, default=1, help="BGP neighbors per circuit")
+parser.add_argument("--routes", type=int, default=10, help="Routes each neighbor sends and receives")
+parser.add_argument("--intent_routes", type=int, default=2, help="Routes per neighbor listed in the intent, 0 skips route collection")
+parser.add_argument("--latency", type=float, default=0.05, help="Seconds each mock CLI command takes before output")
+parser.add_argument("--ping_interval", type=float, default=0.001, help="Seconds each mock ping packet takes")
+
+
+def main(runtime) -> None:
+    """
+    pyATS job that swaps the testbed for synthetic mock devices and runs happy_circuits.main against them
+    Run with: pyats run job benchmarks/bench_job.py --devices 10 --circuits 20 ...
+    """
+    args, sys.argv[1:] = parser.parse_known_args(sys.argv[1:])
+    intent_file = os.path.join(runtime.directory, "bench_intent.yml")
+    with open(intent_file, "w") as f:
+        yaml.safe_dump(generate_intent(args.devices, args.circuits, args.neighbors, args.routes, args.intent_routes), f)
+
+    runtime.testbed = SimpleNamespace(devices=build_devices(args.devices, args.circuits, args.neighbors, args.routes,
+                                                            latency=args.latency, ping_interval=args.ping_interval))
+    sys.argv[1:] += ["--intent_file", intent_file, "--intent_cache", "none"]
+    happy_circuits.main(runtime)
@@ -0,0 +1,128 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+
+from types import SimpleNamespace
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from helpers import fast_parsers, model_collection
+from mock_device import MockDevice
+from stub_restconf import serve
+
+logging.basicConfig(level=logging.INFO)
+
+#Fields of the interface index and neighbor details the tests read
+INTERFACE_FIELDS = ('enabled', 'line_protocol', 'duplex_mode', 'txload', 'rxload', 'ipv4')
+COUNTER_FIELDS = ('in_errors', 'in_crc_errors', 'out_errors', 'out_collision')
+
+
+def compare(cli_interfaces: Dict, model_interfaces: Dict, cli_neighbors: Dict, model_neighbors: Dict) -> List:
+    """
+    Every field the tests read must hold the same value whichever backend collected it
+    """
+    differences = []
+    for name, cli_details in cli_interfaces.items():
+        model_details = model_interfaces.get(name)
+        if model_details is None:
+            differences.append(f"interface {name}: missing from the model data")
+            continue
+        for field in INTERFACE_FIELDS:
+            if cli_details.get(field) != model_details.get(field):
+                differences.append(f"interface {name} {field}: cli {cli_details.get(field)!r}, model {model_details.get(field)!r}")
+        for field in COUNTER_FIELDS:
+            cli_value, model_value = cli_details.get('counters', {}).get(field), model_details.get('counters', {}).get(field)
+            if cli_value != model_value:
+                differences.append(f"interface {name} counters {field}: cli {cli_value!r}, model {model_value!r}")
+    for vrf, vrf_values in cli_neighbors['vrf'].items():
+        for neighbor_ip, cli_details in vrf_values['neighbor'].items():
+            model_details = model_neighbors['vrf'].get(vrf, {}).get('neighbor', {}).get(neighbor_ip)
+            if model_details is None:
+                differences.append(f"neighbor {neighbor_ip}: missing from the model data")
+            elif cli_details != model_details:
+                differences.append(f"neighbor {neighbor_ip}: cli {cli_details!r}, model {model_details!r}")
+    return differences
+
+def to_xml(tag: str, value) -> ElementTree.Element:
+    """
+    Builds the NETCONF reply a device would send for the RESTCONF data, to check the XML conversion
+    """
+    element = ElementTree.Element(tag)
+    if isinstance(value, dict):
+        for key, child in value.items():
+            for item in child if isinstance(child, list) else [child]:
+                element.append(to_xml(key, item))
+    else:
+        element.text = str(value)
+    return element
+
+def timed(function, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Checks the RESTCONF backend against the CLI on a local stub and compares their cost per device")
+    parser.add_argument("--port", type=int, default=18080, help="Port for the local RESTCONF stub")
+    parser.add_argument("--circuits", type=int, default=50)
+    parser.add_argument("--neighbors", type=int, default=1)
+    parser.add_argument("--routes", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mock CLI latency per command, the stub answers without any")
+    parser.add_argument("--repeat", type=int, default=20, help="Collections timed per backend")
+    args = parser.parse_args()
+
+    server = serve(args.port, 0, args.circuits, args.neighbors, args.routes, username="bench", password="bench")
+    device = MockDevice("bench0000", 0, args.circuits, args.neighbors, args.routes, latency=args.latency, ping_interval=0)
+    device.credentials = SimpleNamespace(default=SimpleNamespace(username="bench", password="bench"))
+    device.connections = {'restconf': {'ip': "127.0.0.1", 'port': args.port, 'protocol': "http"}}
+
+    def cli_collect():
+        return (fast_parsers.parse_show_interfaces(device.execute("show interfaces")),
+                fast_parsers.parse_show_bgp_neighbors(device.execute("show ip bgp all neighbors")))
+
+    def model_collect():
+        return (model_collection.gather_interface_index(device, "restconf"),
+                model_collection.gather_bgp_neighbors(device, "restconf"))
+
+    try:
+        cli_interfaces, cli_neighbors = cli_collect()
+        model_interfaces, model_neighbors = model_collect()
+        differences = compare(cli_interfaces, model_interfaces, cli_neighbors, model_neighbors)
+        #The same data as a NETCONF reply must map to the same result
+        for model, data in (('interfaces', model_collection.restconf_get(device, model_collection.MODELS['interfaces']['restconf'], 10)),
+                            ('bgp_neighbors', model_collection.restconf_get(device, model_collection.MODELS['bgp_neighbors']['restconf'], 10))):
+            container = model_collection.MODELS[model]['container']
+            reply = to_xml("data", {container[0]: data} if len(container) == 1 else {container[0]: {container[1]: data}})
+            converted = model_collection._xml_to_dict(reply)
+            for tag in container:
+                converted = converted[tag]
+            mapper = model_collection.map_interfaces if model == "interfaces" else model_collection.map_bgp_neighbors
+            if mapper(converted) != mapper(data):
+                differences.append(f"{model}: NETCONF reply maps differently from the RESTCONF data")
+        for difference in differences:
+            logging.critical(difference)
+        outputs = (device.execute("show interfaces"), device.execute("show ip bgp all neighbors"))
+        cli_parse = lambda: (fast_parsers.parse_show_interfaces(outputs[0]), fast_parsers.parse_show_bgp_neighbors(outputs[1]))
+        #cli_ms includes the mock's transfer time for the output, cli_parse_ms is the parsing alone
+        result = {'circuits': args.circuits, 'neighbors': args.neighbors, 'differences': len(differences),
+                  'cli_bytes': sum(len(output) for output in outputs),
+                  'cli_ms': round(timed(cli_collect, args.repeat) * 1000, 3),
+                  'cli_parse_ms': round(timed(cli_parse, args.repeat) * 1000, 3),
+                  'restconf_ms': round(timed(model_collect, args.repeat) * 1000, 3)}
+    finally:
+        server.shutdown()
+    print(json.dumps(result, indent=2))
+    if differences:
+        logging.critical(f"{len(differences)} fields differ between the CLI and RESTCONF backends")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from helpers import fast_parsers
+from mock_device import MockDevice, circuit_addresses
+
+logging.basicConfig(level=logging.INFO)
+
+
+def mock_samples(circuits: int, neighbors: int, routes: int) -> List:
+    """
+    Generated IOS-XE output for every command that has a fast parser, as (command, output) pairs
+    """
+    device = MockDevice("bench0000", 0, circuits, neighbors, routes, latency=0, ping_interval=0)
+    addresses = circuit_addresses(0, 0)
+    ping = fast_parsers.ping_command(address=addresses['remote'], count=100, source="GigabitEthernet1", validate=True)
+    return [
+        ("show interfaces", device.execute("show interfaces")),
+        ("show interface GigabitEthernet1", device.execute("show interface GigabitEthernet1")),
+        ("show ip bgp all neighbors", device.execute("show ip bgp all neighbors")),
+        (ping, device.execute(ping)),
+    ]
+
+def snapshot_samples(snapshot_dir: str) -> List:
+    """
+    Recorded output of every command that has a fast parser, from a --snapshot_mode record run
+    """
+    samples = []
+    for entry_file in sorted(glob.glob(os.path.join(snapshot_dir, "devices", "*", "*.json"))):
+        with open(entry_file) as f:
+            entry = json.load(f)
+        if not fast_parsers.fast_parser(entry['command']):
+            continue
+        with open(os.path.join(snapshot_dir, "objects", entry['object'][:2], entry['object'] + ".gz"), "rb") as f:
+            samples.append((entry['command'], gzip.decompress(f.read()).decode()))
+    return samples
+
+def fast_parse(command: str, output: str):
+    if command.startswith("ping "):
+        return fast_parsers.parse_ping(output)
+    return fast_parsers.fast_parse(command, output)
+
+def compare(fast, genie, path: str = "") -> List:
+    """
+    Every field the fast parser returned must hold the same value in the Genie result
+    Interfaces and neighbors found by only one of the parsers are reported too
+    """
+    if not isinstance(fast, dict):
+        return [] if fast == genie else [f"{path}: fast {fast!r}, genie {genie!r}"]
+    if not isinstance(genie, dict):
+        return [f"{path}: missing from genie"]
+    differences = []
+    if path in ("", "/vrf") or path.endswith("/neighbor"):
+        differences.extend(f"{path}/{key}: only found by genie" for key in genie.keys() - fast.keys())
+    for key, value in fast.items():
+        differences.extend(compare(value, genie.get(key), f"{path}/{key}"))
+    return differences
+
+def throughput(parse, command: str, output: str, seconds: float) -> float:
+    """
+    Parses the output repeatedly for about the given number of seconds, returns seconds per parse
+    """
+    runs = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds or not runs:
+        parse(command, output)
+        runs += 1
+    return (time.perf_counter() - started) / runs
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Checks the fast parsers against Genie and compares their throughput")
+    parser.add_argument("--snapshot_dir", help="Use output recorded with --snapshot_mode record instead of generated output")
+    parser.add_argument("--circuits", type=int, default=50, help="Interfaces and neighbor groups in the generated output")
+    parser.add_argument("--neighbors", type=int, default=1, help="Neighbors per circuit in the generated output")
+    parser.add_argument("--routes", type=int, default=100, help="Prefix count of each generated neighbor")
+    parser.add_argument("--seconds", type=float, default=2.0, help="Time spent timing each parser on each output")
+    parser.add_argument("--os", default="iosxe", help="Genie os of the recorded output")
+    args = parser.parse_args()
+
+    from genie.conf.base import Device as GenieDevice
+    genie_device = GenieDevice("bench", os=args.os)
+    genie_parse = lambda command, output: genie_device.parse(command, output=output)
+
+    samples = snapshot_samples(args.snapshot_dir) if args.snapshot_dir else mock_samples(args.circuits, args.neighbors, args.routes)
+    if not samples:
+        logging.critical("No output to compare, record some with --snapshot_mode record first")
+        sys.exit(1)
+    results = []
+    mismatched = 0
+    for command, output in samples:
+        fast = fast_parse(command, output)
+        if fast is None:
+            logging.info(f"{command}: not recognised by the fast parser, Genie would be used")
+            continue
+        try:
+            genie = genie_parse(command, output)
+        except Exception as e:
+            logging.warning(f"{command}: Genie could not parse the output, only timing the fast parser - {type(e).__name__}")
+            genie = None
+        differences = compare(fast, genie) if genie is not None else []
+        for difference in differences:
+            logging.critical(f"{command}{difference}")
+        mismatched += bool(differences)
+        result = {'command': command, 'bytes': len(output), 'differences': len(differences),
+                  'fast_ms': round(throughput(fast_parse, command, output, args.seconds) * 1000, 3)}
+        if genie is not None:
+            result['genie_ms'] = round(throughput(genie_parse, command, output, args.seconds) * 1000, 3)
+            result['speedup'] = round(result['genie_ms'] / result['fast_ms'], 1) if result['fast_ms'] else None
+        logging.info(f"{command} ({len(output)} bytes): {result}")
+        results.append(result)
+
+    print(json.dumps(results, indent=2))
+    if mismatched:
+        logging.critical(f"{mismatched} of {len(results)} outputs parsed differently from Genie")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
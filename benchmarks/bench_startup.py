@@ -0,0 +1,105 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+
+from typing import Dict, List
+
+logging.basicConfig(level=logging.INFO)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+TESTSCRIPT_MODULES = ("testscripts.interface_tests", "testscripts.icmp_tests", "testscripts.bgp_tests", "testscripts.device_tests")
+
+#Run in a fresh interpreter, prints the seconds spent importing the testscript after the job process preloads
+WARM_IMPORT = """
+import sys, time
+sys.path.insert(0, {repo!r})
+from helpers import startup
+startup.preload_modules()
+started = time.perf_counter()
+import {module}
+print(time.perf_counter() - started)
+"""
+#Run in a fresh interpreter, prints the seconds the first and the second Genie parser lookup of each command took
+PARSER_LOOKUP = """
+import json, time
+from genie.conf.base import Device
+from genie.libs.parser.utils.common import get_parser
+device = Device("bench", os={os!r})
+timings = dict()
+for command in {commands!r}:
+    lookups = []
+    for _ in range(2):
+        started = time.perf_counter()
+        get_parser(command, device)
+        lookups.append(time.perf_counter() - started)
+    timings[command] = lookups
+print(json.dumps(timings))
+"""
+PARSER_COMMANDS = ("show interfaces", "show ip bgp all neighbors", "show ip bgp neighbor 10.0.0.1 routes")
+
+
+def python(code: List, importtime: bool = False) -> subprocess.CompletedProcess:
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + code
+    return subprocess.run(command, cwd=REPO_DIR, capture_output=True, text=True)
+
+def import_times(stderr: str) -> List:
+    """
+    Parses -X importtime output into (module, self_us, cumulative_us), in import order
+    """
+    times = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = (part.strip() for part in line[len("import time:"):].split("|"))
+        times.append((module.strip(), int(self_us), int(cumulative_us)))
+    return times
+
+def cold_import(module: str, top: int) -> Dict:
+    """
+    What a task pays importing the testscript with nothing preloaded, and the modules that cost the most
+    """
+    process = python(["-c", f"import {module}"], importtime=True)
+    if process.returncode:
+        return {'error': process.stderr.strip().splitlines()[-1]}
+    times = import_times(process.stderr)
+    own = [entry for entry in times if entry[0] == module]
+    return {'cold_ms': round(own[-1][2] / 1000, 1) if own else None,
+            'slowest': [{'module': name, 'self_ms': round(self_us / 1000, 1), 'cumulative_ms': round(cumulative_us / 1000, 1)}
+                        for name, self_us, cumulative_us in sorted(times, key=lambda entry: -entry[1])[:top]]}
+
+def warm_import(module: str) -> Dict:
+    """
+    What a task forked from a job process that preloaded the task modules pays importing the testscript
+    """
+    process = python(["-c", WARM_IMPORT.format(repo=REPO_DIR, module=module)])
+    if process.returncode:
+        return {'error': process.stderr.strip().splitlines()[-1]}
+    return {'warm_ms': round(float(process.stdout.strip().splitlines()[-1]) * 1000, 1)}
+
+def parser_lookups(os_name: str) -> Dict:
+    process = python(["-c", PARSER_LOOKUP.format(os=os_name, commands=PARSER_COMMANDS)])
+    if process.returncode:
+        return {'error': process.stderr.strip().splitlines()[-1]}
+    return {command: {'first_ms': round(first * 1000, 1), 'cached_ms': round(cached * 1000, 3)}
+            for command, (first, cached) in json.loads(process.stdout.strip().splitlines()[-1]).items()}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Measures the per task startup cost of every testscript, with and without the job process preloading")
+    parser.add_argument("--top", type=int, default=10, help="How many of the slowest imports to list per testscript")
+    parser.add_argument("--os", default="iosxe", help="Genie os used to time the parser lookups")
+    args = parser.parse_args()
+
+    results = {'testscripts': dict()}
+    for module in TESTSCRIPT_MODULES:
+        result = results['testscripts'][module] = dict(cold_import(module, args.top), **warm_import(module))
+        logging.info(f"{module}: cold {result.get('cold_ms')} ms, after preloading {result.get('warm_ms')} ms {result.get('error', '')}")
+    results['parser_lookups'] = parser_lookups(args.os)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+import ipaddress
+import time
+
+from types import SimpleNamespace
+from typing import Dict, List
+
+INTERFACE_TEMPLATE = """{name} is up, line protocol is up
+  Hardware is CSR vNIC, address is 5254.00{index:02x}.{index:04x} (bia 5254.00{index:02x}.{index:04x})
+  Internet address is {ipv4}
+  MTU 1500 bytes, BW 1000000 Kbit/sec, DLY 10 usec,
+     reliability 255/255, txload 1/255, rxload 1/255
+  Encapsulation ARPA, loopback not set
+  Keepalive set (10 sec)
+  Full Duplex, 1000Mbps, link type is auto, media type is Virtual
+  output flow-control is unsupported, input flow-control is unsupported
+  ARP type: ARPA, ARP Timeout 04:00:00
+  Last input 00:00:00, output 00:00:00, output hang never
+  Last clearing of "show interface" counters never
+  Input queue: 0/375/0/0 (size/max/drops/flushes); Total output drops: 0
+  Queueing strategy: fifo
+  Output queue: 0/40 (size/max)
+  5 minute input rate 1000 bits/sec, 1 packets/sec
+  5 minute output rate 1000 bits/sec, 1 packets/sec
+     123456 packets input, 12345678 bytes, 0 no buffer
+     Received 0 broadcasts (0 IP multicasts)
+     0 runts, 0 giants, 0 throttles
+     0 input errors, 0 CRC, 0 frame, 0 overrun, 0 ignored
+     0 watchdog, 0 multicast, 0 pause input
+     123456 packets output, 12345678 bytes, 0 underruns
+     0 output errors, 0 collisions, 0 interface resets
+     0 unknown protocol drops
+     0 babbles, 0 late collision, 0 deferred
+     0 lost carrier, 0 no carrier, 0 pause output
+     0 output buffer failures, 0 output buffers swapped out
+"""
+
+NEIGHBOR_TEMPLATE = """BGP neighbor is {neighbor_ip},  remote AS 65001, external link
+  BGP version 4, remote router ID {neighbor_ip}
+  BGP state = Established, up for 3d04h
+  Last read 00:00:21, last write 00:00:07, hold time is 180, keepalive interval is 60 seconds
+  Neighbor sessions:
+    1 active, is not multisession capable (disabled)
+  Neighbor capabilities:
+    Route refresh: advertised and received(new)
+    Four-octets ASN Capability: advertised and received
+    Address family IPv4 Unicast: advertised and received
+    Enhanced Refresh Capability: advertised and received
+    Multisession Capability:
+    Stateful switchover support enabled: NO for session 1
+  Message statistics:
+    InQ depth is 0
+    OutQ depth is 0
+
+                         Sent       Rcvd
+    Opens:                  1          1
+    Notifications:          0          0
+    Updates:                2          2
+    Keepalives:          5000       5000
+    Route Refresh:          0          0
+    Total:               5003       5003
+  Do log neighbor state changes (via global configuration)
+  Default minimum time between advertisement runs is 30 seconds
+
+ For address family: IPv4 Unicast
+  Session: {neighbor_ip}
+  BGP table version 5, neighbor version 5/0
+  Output queue size : 0
+  Index 1, Advertise bit 0
+  1 update-group member
+  Slow-peer detection is disabled
+  Slow-peer split-update-group dynamic is disabled
+                                 Sent       Rcvd
+  Prefix activity:               ----       ----
+    Prefixes Current:               {routes}          {routes} ({routes} best-paths)
+    Prefixes Total:                 {routes}          {routes}
+    Implicit Withdraw:              0          0
+    Explicit Withdraw:              0          0
+    Used as bestpath:             n/a          {routes}
+    Used as multipath:            n/a          0
+    Used as secondary:            n/a          0
+
+  Address tracking is enabled, the RIB does have a route to {neighbor_ip}
+  Route to peer address reachability Up: 1; Down: 0
+    Last notification 3d04h
+  Connections established 1; dropped 0
+  Last reset never
+  Interface associated: {interface} (peering address in same link)
+  Transport(tcp) path-mtu-discovery is enabled
+  Graceful-Restart is disabled
+  SSO is disabled
+Connection state is ESTAB, I/O status: 1, unread input bytes: 0
+Connection is ECN Disabled, Mininum incoming TTL 0, Outgoing TTL 1
+Local host: {local_ip}, Local port: 179
+Foreign host: {neighbor_ip}, Foreign port: 30000
+Connection tableid (VRF): 0
+Maximum output segment queue size: 50
+
+Enqueued packets for retransmit: 0, input: 0  mis-ordered: 0 (0 bytes)
+
+Event Timers (current time is 0x1A2B3C):
+Timer          Starts    Wakeups            Next
+Retrans          5003          0             0x0
+TimeWait            0          0             0x0
+AckHold          5003       4900             0x0
+SendWnd             0          0             0x0
+KeepAlive           0          0             0x0
+GiveUp              0          0             0x0
+PmtuAger            0          0             0x0
+DeadWait            0          0             0x0
+Linger              0          0             0x0
+ProcessQ            0          0             0x0
+
+iss:  100000000  snduna:  100100000  sndnxt:  100100000
+irs:  200000000  rcvnxt:  200100000
+
+sndwnd:  16384  scale:      0  maxrcvwnd:  16384
+rcvwnd:  16384  scale:      0  delrcvwnd:      0
+
+SRTT: 1000 ms, RTTO: 1003 ms, RTV: 3 ms, KRTT: 0 ms
+minRTT: 1 ms, maxRTT: 1000 ms, ACK hold: 200 ms
+uptime: 273600000 ms, Sent idletime: 7000 ms, Receive idletime: 7000 ms
+Status Flags: active open
+Option Flags: nagle, path mtu capable
+IP Precedence value : 6
+
+Datagrams (max data segment is 1460 bytes):
+Rcvd: 10000 (out of order: 0), with data: 5000, total data bytes: 95000
+Sent: 10000 (retransmit: 0, fastretransmit: 0, partialack: 0, Second Congestion: 0), with data: 5000, total data bytes: 95000
+
+ Packets received in fast path: 0, fast processed: 0, slow path: 0
+ fast lock acquisition failures: 0, slow path: 0
+TCP Semaphore      0x7F0000000000  FREE
+
+"""
+
+PING_TEMPLATE = """Type escape sequence to abort.
+Sending {count}, 100-byte ICMP Echos to {address}, timeout is 2 seconds:
+Packet sent with a source address of {source}
+Reply data will be validated
+{bangs}
+Success rate is 100 percent ({count}/{count}), round-trip min/avg/max = 1/2/4 ms
+"""
+
+ROUTE_TABLE_HEADER = """BGP table version is 5, local router ID is 10.0.0.1
+Status codes: s suppressed, d damped, h history, * valid, > best, i - internal,
+              r RIB-failure, S Stale, m multipath, b backup-path, f RT-Filter,
+              x best-external, a additional-path, c RIB-compressed,
+              t secondary path, L long-lived-stale,
+Origin codes: i - IGP, e - EGP, ? - incomplete
+RPKI validation codes: V valid, I invalid, N Not found
+
+     Network          Next Hop            Metric LocPrf Weight Path
+"""
+
+
+def circuit_addresses(device_index: int, circuit_index: int) -> Dict:
+    """
+    Returns a unique /30 for every circuit of every device
+    """
+    network = ipaddress.ip_network("100.64.0.0/10")[0] + (device_index * 4096 + circuit_index) * 4
+    return {'local': str(network + 1), 'remote': str(network + 2), 'prefix': f"{network + 1}/30"}
+
+def route_prefixes(circuit_index: int, neighbor_index: int, routes: int) -> List:
+    """
+    Returns routes unique /24 prefixes for a neighbor, spread over 11.0.0.0 - 221.255.255.0
+    """
+    first = (circuit_index * 16 + neighbor_index) * routes
+    return [f"{ipaddress.IPv4Address(0x0B000000 + ((first + index) % 0xD30000) * 256)}/24" for index in range(routes)]
+
+def neighbor_ips(circuit_index: int, neighbors: int) -> List:
+    base = ipaddress.ip_address("172.16.0.0") + circuit_index * 256
+    return [str(base + index + 1) for index in range(neighbors)]
+
+def generate_intent(devices: int, circuits: int, neighbors: int, routes: int, intent_routes: int = 2) -> Dict:
+    """
+    Builds an intent file covering devices x circuits, each circuit with neighbors BGP peers
+    Each peer lists intent_routes of its routes as received and advertised
+    """
+    intent_devices = dict()
+    for device_index in range(devices):
+        device_circuits = []
+        for circuit_index in range(circuits):
+            addresses = circuit_addresses(device_index, circuit_index)
+            device_circuits.append({
+                'circuit': f"CKT{device_index:04d}-{circuit_index:03d}",
+                'interface': f"GigabitEthernet{circuit_index + 1}",
+                'is_subinterface': False,
+                'tests': {
+                    'bgp': {'test_bgp': True, 'vrf': None, 'neighbors': [
+                        {'neighbor_ip': neighbor_ip, 'uptime_conform': "gt 1", 'address_families': [{
+                            'address_family': "ipv4 unicast",
+                            'received_routes': route_prefixes(circuit_index, neighbor_index, routes)[:intent_routes],
+                            'advertised_routes': route_prefixes(circuit_index, neighbor_index, routes)[:intent_routes],
+                        }]}
+                        for neighbor_index, neighbor_ip in enumerate(neighbor_ips(circuit_index, neighbors))
+                    ]},
+                    'icmp': {'test_icmp': True, 'pingable_address': addresses['remote'], 'ping_count': 5,
+                             'success_rate_percent_conform': "ge 90", 'max_ms_conform': "le 20", 'jitter_conform': "le 50", 'vrf': None},
+                    'interface': {'test_interface': True, 'ipv4': addresses['prefix'], 'in_errors_conform': "le 200",
+                                  'in_crc_errors_conform': "le 200", 'out_errors_conform': "le 200", 'out_collision_conform': "le 200",
+                                  'txload_conform': "le 128", 'rxload_conform': "le 128", 'duplex': "Full", 'line_protocol': "up", 'enabled': True},
+                },
+            })
+        intent_devices[f"bench{device_index:04d}"] = {'circuits': device_circuits}
+    return {'config': {'devices': intent_devices}}
+
+
+class MockApi:
+    def __init__(self, device):
+        self.device = device
+
+    def ping(self, address: str, count: int = 5, **kwargs) -> Dict:
+        """
+        Returns a parsed ping result after waiting as long as the pings would take
+        """
+        time.sleep(self.device.latency + count * self.device.ping_interval)
+        return {'ping': {'address': address, 'data_bytes': 100, 'repeat': count, 'timeout_secs': 2,
+                         'result_per_line': [],
+                         'statistics': {'send': count, 'received': count, 'success_rate_percent': 100.0,
+                                        'round_trip': {'min_ms': 1, 'avg_ms': 2, 'max_ms': 4}}}}
+
+
+class MockDevice:
+    """
+    Stands in for a testbed device, answering show commands with canned IOS-XE output after a configurable latency
+    Parsing goes through the real Genie parsers on that output so parser cost is part of the benchmark
+    """
+    def __init__(self, name: str, device_index: int, circuits: int, neighbors: int, routes: int,
+                 latency: float = 0.05, ping_interval: float = 0.001):
+        self.name = name
+        self.os = "iosxe"
+        self.type = "router"
+        self.latency = latency
+        self.ping_interval = ping_interval
+        self.credentials = SimpleNamespace(default=SimpleNamespace(username=None, password=None))
+        self.api = MockApi(self)
+        self.device_index = device_index
+        self.circuits = circuits
+        self.neighbors = neighbors
+        self.routes = routes
+        self._genie_device = None
+        self._interface_output = None
+        self._neighbor_output = None
+
+    def connect(self, **kwargs) -> None:
+        time.sleep(self.latency * 10)
+
+    def configure(self, config, **kwargs) -> str:
+        time.sleep(self.latency)
+        return ""
+
+    def _interfaces(self) -> Dict:
+        if self._interface_output is not None:
+            return self._interface_output
+        interfaces = self._interface_output = dict()
+        for circuit_index in range(self.circuits):
+            name = f"GigabitEthernet{circuit_index + 1}"
+            interfaces[name] = INTERFACE_TEMPLATE.format(name=name, index=circuit_index,
+                                                         ipv4=circuit_addresses(self.device_index, circuit_index)['prefix'])
+        return interfaces
+
+    def _neighbors(self) -> Dict:
+        if self._neighbor_output is not None:
+            return self._neighbor_output
+        neighbors = self._neighbor_output = dict()
+        for circuit_index in range(self.circuits):
+            addresses = circuit_addresses(self.device_index, circuit_index)
+            for neighbor_index, neighbor_ip in enumerate(neighbor_ips(circuit_index, self.neighbors)):
+                neighbors[neighbor_ip] = (circuit_index, neighbor_index, NEIGHBOR_TEMPLATE.format(
+                    neighbor_ip=neighbor_ip, routes=self.routes, local_ip=addresses['local'], interface=f"GigabitEthernet{circuit_index + 1}"))
+        return neighbors
+
+    def _route_table(self, circuit_index: int, neighbor_index: int, neighbor_ip: str, include: str = None) -> str:
+        lines = [ROUTE_TABLE_HEADER]
+        for prefix in route_prefixes(circuit_index, neighbor_index, self.routes):
+            if include and not any(part in prefix for part in include.split("|")[1:]):
+                continue
+            lines.append(f" *>   {prefix:<17}{neighbor_ip:<20}     0             0 65001 i\n")
+        lines.append(f"\nTotal number of prefixes {self.routes} \n")
+        return "".join(lines)
+
+    def execute(self, command: str, **kwargs) -> str:
+        """
+        Returns canned output for the commands happy_circuits issues
+        """
+        command, _, include = command.partition(" | include ")
+        words = command.split()
+        if command in ("show interfaces", "show interface"):
+            output = "".join(self._interfaces().values())
+        elif words[:2] == ["show", "interface"] or words[:2] == ["show", "interfaces"]:
+            output = self._interfaces().get(words[2], "")
+        elif command in ("show ip bgp all neighbors", "show bgp vpnv4 unicast all neighbors"):
+            #The all variants start every address family with a header, like IOS-XE
+            output = "For address family: IPv4 Unicast\n" + "".join(text for _, _, text in self._neighbors().values())
+        elif command == "show ip bgp neighbors":
+            output = "".join(text for _, _, text in self._neighbors().values())
+        elif words[:3] == ["show", "ip", "bgp"] and words[-1] in ("routes", "advertised-routes"):
+            neighbor_ip = words[-2]
+            circuit_index, neighbor_index, _ = self._neighbors().get(neighbor_ip, (0, 0, ""))
+            output = self._route_table(circuit_index, neighbor_index, neighbor_ip, include=include or None)
+        elif words[:3] == ["show", "ip", "bgp"] and words[-2] in ("neighbor", "neighbors"):
+            output = self._neighbors().get(words[-1], (0, 0, ""))[2]
+        elif words[0] == "ping":
+            #ping [vrf X] address repeat N source Y validate, sent by the fast ping path
+            count = int(words[words.index("repeat") + 1])
+            time.sleep(count * self.ping_interval)
+            output = PING_TEMPLATE.format(count=count, address=words[3 if words[1] == "vrf" else 1],
+                                          source=words[words.index("source") + 1], bangs="!" * count)
+        else:
+            output = ""
+        #Transfer time grows with the amount of output, roughly a 1Mbit/s session
+        time.sleep(self.latency + len(output) / 125_000)
+        return output
+
+    def parse(self, command: str, output: str = None, **kwargs) -> Dict:
+        """
+        Parses the output offline with Genie
+        """
+        if output is None:
+            output = self.execute(command)
+        if self._genie_device is None:
+            from genie.conf.base import Device as GenieDevice
+            self._genie_device = GenieDevice(self.name, os=self.os)
+        return self._genie_device.parse(command.partition(" | ")[0], output=output)
+
+
+def build_devices(devices: int, circuits: int, neighbors: int, routes: int, latency: float, ping_interval: float) -> Dict:
+    return {
+        f"bench{device_index:04d}": MockDevice(f"bench{device_index:04d}", device_index, circuits, neighbors, routes,
+                                               latency=latency, ping_interval=ping_interval)
+        for device_index in range(devices)
+    }
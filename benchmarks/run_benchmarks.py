@@ -0,0 +1,117 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Dict, List
+
+logging.basicConfig(level=logging.INFO)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+DEFAULT_SCALES = "1x10x1x10,10x10x1x10,10x50x1x10,10x10x4x10,10x10x1x500,50x10x1x10"
+
+
+def parse_scale(scale: str) -> Dict:
+    """
+    Turns devices x circuits x neighbors x routes, for example 10x20x2x100, into the job arguments
+    """
+    devices, circuits, neighbors, routes = (int(value) for value in scale.lower().split("x"))
+    return {'devices': devices, 'circuits': circuits, 'neighbors': neighbors, 'routes': routes}
+
+def git_label() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return time.strftime("%Y%m%d-%H%M%S")
+
+def run_point(point: Dict, args: argparse.Namespace) -> Dict:
+    """
+    Runs the benchmark job once for a scale point and returns wall time, peak memory and time per stage
+    """
+    timing_dir = tempfile.mkdtemp(prefix="happy_circuits_bench_")
+    command = ["pyats", "run", "job", os.path.join(BENCH_DIR, "bench_job.py"), "--no-archive",
+               "--devices", str(point['devices']), "--circuits", str(point['circuits']),
+               "--neighbors", str(point['neighbors']), "--routes", str(point['routes']),
+               "--intent_routes", str(args.intent_routes), "--latency", str(args.latency),
+               "--ping_interval", str(args.ping_interval), "--max_workers", str(args.max_workers),
+               "--timing_dir", timing_dir]
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        process = subprocess.Popen(command, cwd=REPO_DIR, stdout=devnull if not args.verbose else None, stderr=subprocess.STDOUT)
+        #wait4 reports the peak RSS of the job and every task process it forked
+        _, status, usage = os.wait4(process.pid, 0)
+    wall_s = time.perf_counter() - started
+    result = dict(point, wall_s=round(wall_s, 3), peak_rss_mb=round(usage.ru_maxrss / 1024, 1),
+                  exit_code=os.waitstatus_to_exitcode(status), stages={})
+    try:
+        with open(os.path.join(timing_dir, "timings.json")) as f:
+            summary = json.load(f)
+        result['stages'] = {stage: {'count': totals['count'], 'wall_s': round(totals['wall_s'], 3),
+                                    'parse_s': round(totals['parse_s'], 3), 'bytes': totals['bytes']}
+                            for stage, totals in summary['stages'].items()}
+    except (OSError, ValueError, KeyError):
+        logging.warning(f"No timing report found in {timing_dir}")
+    return result
+
+def compare(results: List, baseline: List, threshold: float) -> List:
+    """
+    Returns a message for every scale point whose wall time or peak memory grew by more than threshold percent
+    """
+    regressions = []
+    previous = {(point['devices'], point['circuits'], point['neighbors'], point['routes']): point for point in baseline}
+    for point in results:
+        old = previous.get((point['devices'], point['circuits'], point['neighbors'], point['routes']))
+        if not old:
+            continue
+        for metric in ("wall_s", "peak_rss_mb"):
+            if old[metric] and (point[metric] - old[metric]) / old[metric] * 100 > threshold:
+                regressions.append(f"{point['devices']}x{point['circuits']}x{point['neighbors']}x{point['routes']} "
+                                   f"{metric} {old[metric]} -> {point[metric]}")
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Runs the happy circuits benchmark job at several scale points")
+    parser.add_argument("--scales", default=DEFAULT_SCALES,
+                        help="Comma separated devices x circuits x neighbors x routes points, e.g. 1x10x1x10,10x10x1x10")
+    parser.add_argument("--intent_routes", type=int, default=2, help="Routes per neighbor listed in the intent")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds each mock CLI command takes")
+    parser.add_argument("--ping_interval", type=float, default=0.001, help="Seconds each mock ping packet takes")
+    parser.add_argument("--max_workers", type=int, default=10, help="Passed through to happy_circuits")
+    parser.add_argument("--label", default=None, help="Name of the results file, defaults to the git commit")
+    parser.add_argument("--baseline", default=None, help="Results file to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent increase that counts as a regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the pyATS job output")
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales.split(","):
+        point = parse_scale(scale)
+        logging.info(f"Running {scale}")
+        result = run_point(point, args)
+        logging.info(f"{scale}: {result['wall_s']}s wall, {result['peak_rss_mb']}MB peak RSS, exit code {result['exit_code']}")
+        results.append(result)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_file = os.path.join(RESULTS_DIR, f"{args.label or git_label()}.json")
+    with open(results_file, "w") as f:
+        json.dump(results, f, indent=2)
+    logging.info(f"Results written to {results_file}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            logging.critical(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
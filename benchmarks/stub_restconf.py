@@ -0,0 +1,102 @@
+import argparse
+import base64
+import json
+import logging
+import os
+import sys
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from mock_device import circuit_addresses, neighbor_ips
+
+logging.basicConfig(level=logging.INFO)
+
+
+def interfaces_model(device_index: int, circuits: int) -> Dict:
+    """
+    Cisco-IOS-XE-interfaces-oper data matching the show interfaces output of the mock device
+    """
+    interfaces = []
+    for circuit_index in range(circuits):
+        addresses = circuit_addresses(device_index, circuit_index)
+        interfaces.append({
+            'name': f"GigabitEthernet{circuit_index + 1}", 'admin-status': "if-state-up", 'oper-status': "if-oper-state-ready",
+            'speed': "1000000000", 'ipv4': addresses['local'], 'ipv4-subnet-mask': "255.255.255.252",
+            'statistics': {'in-unicast-pkts': "123456", 'out-unicast-pkts': "123456", 'in-errors': "0", 'in-crc-errors': "0",
+                           'out-errors': "0", 'rx-kbps': "1", 'tx-kbps': "1"},
+            'ether-state': {'negotiated-duplex-mode': "full-duplex"},
+            'ether-stats': {'dot3-counters': {'dot3-stats': {'dot3-single-collision-frames': "0", 'dot3-multiple-collision-frames': "0"}}},
+        })
+    return {'Cisco-IOS-XE-interfaces-oper:interfaces': {'interface': interfaces}}
+
+def bgp_neighbors_model(circuits: int, neighbors: int, routes: int) -> Dict:
+    """
+    Cisco-IOS-XE-bgp-oper neighbors matching the show ip bgp all neighbors output of the mock device
+    """
+    entries = []
+    for circuit_index in range(circuits):
+        for neighbor_ip in neighbor_ips(circuit_index, neighbors):
+            entries.append({
+                'afi-safi': "ipv4-unicast", 'vrf-name': "default", 'neighbor-id': neighbor_ip, 'up-time': "3d04h",
+                'session-state': "fsm-established", 'connection': {'state': "established"},
+                'prefix-activity': {'sent': {'current-prefixes': str(routes)}, 'received': {'current-prefixes': str(routes)}},
+            })
+    return {'Cisco-IOS-XE-bgp-oper:neighbors': {'neighbor': entries}}
+
+
+def serve(port: int, device_index: int, circuits: int, neighbors: int, routes: int,
+          username: str = None, password: str = None) -> ThreadingHTTPServer:
+    """
+    Starts a plain http RESTCONF stub on 127.0.0.1 in a background thread, answering the two paths happy_circuits requests
+    """
+    bodies = {
+        "/restconf/data/Cisco-IOS-XE-interfaces-oper:interfaces": json.dumps(interfaces_model(device_index, circuits)).encode(),
+        "/restconf/data/Cisco-IOS-XE-bgp-oper:bgp-state-data/neighbors": json.dumps(bgp_neighbors_model(circuits, neighbors, routes)).encode(),
+    }
+    expected_auth = "Basic " + base64.b64encode(f"{username}:{password}".encode()).decode() if username else None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if expected_auth and self.headers.get('Authorization') != expected_auth:
+                self.send_response(401)
+                self.end_headers()
+                return
+            body = bodies.get(self.path)
+            self.send_response(200 if body else 404)
+            self.send_header('Content-Type', "application/yang-data+json")
+            self.send_header('Content-Length', str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "RESTCONF stub serving the interfaces-oper and bgp-oper data of one mock device")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--device_index", type=int, default=0, help="Mock device whose addresses are served, bench0000 is 0")
+    parser.add_argument("--circuits", type=int, default=10)
+    parser.add_argument("--neighbors", type=int, default=1)
+    parser.add_argument("--routes", type=int, default=10)
+    parser.add_argument("--username", help="Require basic auth with this username and --password")
+    parser.add_argument("--password")
+    args = parser.parse_args()
+    server = serve(args.port, args.device_index, args.circuits, args.neighbors, args.routes, args.username, args.password)
+    logging.info(f"Serving RESTCONF on http://127.0.0.1:{args.port}/restconf/data, ctrl+c to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,57 @@
 import logging
-import yaml
+import os
 import sys
+import json
+import time
+import secrets
 import argparse
+import threading
+import subprocess
 
 from typing import Dict, List
-from pyats import topology, easypy
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pipe
+from multiprocessing.connection import wait
+from pyats import easypy
 from getpass import getpass
+from helpers import budget, counters, fast_parsers, history, reporting, shard, snapshot, startup, timing
+from helpers.intent import Intent, DeviceIntent, IntentError, load_intent
 
 
 parser = argparse.ArgumentParser(description = "happy circuits CLI tool")
 parser.add_argument("--username", help="Required if auth_type == token. Username to use for all devices")
 parser.add_argument("--auth_type", help="Specify 'token' to login to each device individually and reprompt for passcode", default="testbed")
-parser.add_argument("--intent_file", help="path to intent yaml file describing test parameters", required=True)
+parser.add_argument("--intent_file", help="path to intent yaml file, or a directory of per device/per site intent files, describing test parameters", required=True)
+parser.add_argument("--intent_cache", help="Directory to keep compiled intent in between runs, specify 'none' to disable", default=".intent_cache")
+parser.add_argument("--max_workers", "--max-workers", dest="max_workers", type=int, default=10, help="How many devices to connect to and test at the same time")
+parser.add_argument("--timing_dir", help="Directory for the per stage timing records and reports, defaults to timings/ in the job run directory")
+parser.add_argument("--prometheus_textfile", help="Also write the timing metrics to this Prometheus textfile, for the node exporter textfile collector")
+parser.add_argument("--snapshot_mode", help="live, record (store all device output), replay (run offline from stored output) or cache (reuse output younger than --snapshot_ttl)", default="live", choices=snapshot.SNAPSHOT_MODES)
+parser.add_argument("--snapshot_dir", help="Directory holding recorded device output", default="snapshots")
+parser.add_argument("--snapshot_ttl", help="Seconds recorded output stays usable in cache mode", type=int, default=300)
+parser.add_argument("--counter_store", help="SQLite file keeping the interface counter baselines used by counter_mode: delta", default="counters.sqlite")
+parser.add_argument("--history_db", help="SQLite file every measured value is appended to for query_history.py, 'none' turns history off", default="history.sqlite")
+parser.add_argument("--parsers", help="fast parses the show interface, bgp neighbor and ping output the tests read with targeted extractors and falls back to Genie on output they don't recognise, genie always uses Genie", default="fast", choices=fast_parsers.PARSER_MODES)
+parser.add_argument("--task_mode", help="per_script runs each testscript as its own task, per_device runs every testcase of a device in one task that shares collected output", default="per_script", choices=("per_script", "per_device"))
+parser.add_argument("--report_mode", help="full reports every check as nested steps, compact reports one summary step per test and full steps only for checks that did not pass", default="full", choices=("full", "compact"))
+parser.add_argument("--results_dir", help="Directory for the structured result of every check written in compact mode, defaults to results/ in the job run directory")
+parser.add_argument("--profile_task", help="Run cProfile in every task whose task id contains this text, ex. 'BGP Tests on device - router1'")
+parser.add_argument("--coordinate", help="host:port to listen on as a coordinator that splits the testbed devices into --shards and hands them to worker jobs", metavar="HOST:PORT")
+parser.add_argument("--shards", help="How many shards the coordinator splits the testbed devices into", type=int, default=2)
+parser.add_argument("--shard_by", help="hash spreads devices evenly by name, site keeps the devices of a site (custom: site: in the testbed) in one shard", default="hash", choices=shard.SHARD_STRATEGIES)
+parser.add_argument("--local_workers", help="Start one worker job per shard on this host, using the same options", action="store_true")
+parser.add_argument("--worker_testbed", help="Testbed file the local workers load, defaults to the coordinator's testbed file")
+parser.add_argument("--shard_timeout", help="Seconds the coordinator waits for every shard to finish", type=int, default=3600)
+parser.add_argument("--worker", help="host:port of a coordinator to take a shard of the testbed devices from", metavar="HOST:PORT")
 
-def load_yaml(file_: str) -> Dict:
-    """
-    Returns json format of provided yaml file
-    """
-    with open(file_, "r") as f:
-        yaml_data = yaml.safe_load(f)
-        return yaml_data
+#Testscripts executed against every device, in order, along with the prefix used for their task id
+TESTSCRIPTS = [
+    ("./testscripts/interface_tests.py", "Interface Tests"),
+    ("./testscripts/icmp_tests.py", "ICMP Tests"),
+    ("./testscripts/bgp_tests.py", "BGP Tests"),
+]
+#Used instead of TESTSCRIPTS in per_device task mode, runs the same testcases in a single task
+COMBINED_TESTSCRIPT = ("./testscripts/device_tests.py", "Device Tests")
 
 def get_token_passcode(device_name: str) -> str:
     """
@@ -29,25 +61,56 @@ def get_token_passcode(device_name: str) -> str:
     logging.critical(f"\nPlease enter the next unique token passcode to connect to device {device_name}\n")
     return getpass("Enter your passcode > ")
 
-def handle_device_connection(device: object, username: str, auth_type: str) -> None:
+def prompt_token_passcode(device_name: str):
+    """
+    Prompts for the passcode of the device in a thread, returns the thread and the end the passcode arrives on
+    The end can be waited on with the task sentinels, so finished tasks are reaped while the prompt is open
+    The thread only ever holds the lock of its own terminal stream, tasks are still safe to fork while it waits
+    """
+    receiver, sender = Pipe(duplex=False)
+
+    def prompt() -> None:
+        try:
+            sender.send((get_token_passcode(device_name), None))
+        except Exception as e:
+            sender.send((None, f"no passcode entered - {type(e).__name__}"))
+        sender.close()
+
+    thread = threading.Thread(target=prompt, name=f"passcode-{device_name}", daemon=True)
+    thread.start()
+    return thread, receiver
+
+def handle_device_connection(device: object, username: str, auth_type: str, pool_size: int = 1, passcode: str = None) -> None:
     """
     Connects to each device, prompting for credentials when needed
+    Token passcodes are prompted for right before the connection, so they can't expire waiting for other devices
+    Pass passcode when it was already prompted for
     """
+    if snapshot.snapshot_mode() == "replay":
+        logging.info(f"Replaying recorded output for device {device.name}, not connecting")
+        return
     if auth_type.lower() == "token":
         logging.info(f"Token authentication specified in intent_file, requesting user credentials")
         device.credentials.default.username = username
-        device.credentials.default.password = get_token_passcode(device.name)
+        device.credentials.default.password = passcode or get_token_passcode(device.name)
     else:
         logging.info(f"auth_type other than token, assuming credentials are in the testbed file")
     
     logging.info(f"Now connecting to device {device.name}")
-    device.connect(log_stdout=False)
+    with timing.measure(device.name, "connect", stage="connect"):
+        budget.check(device.name, "connect")
+        connect_args = budget.timeout_args(device.name, keyword="connection_timeout")
+        if pool_size > 1:
+            #A connection pool lets the testscripts run commands over several sessions at once
+            device.connect(log_stdout=False, pool_size=pool_size, **connect_args)
+        else:
+            device.connect(log_stdout=False, **connect_args)
 
-def get_device_values(device_name: str, intent_file: Dict) -> Dict:
+def get_device_values(device_name: str, intent_file: Intent) -> DeviceIntent:
     """
-    Gets device specific details from the input script config file
+    Gets device specific details from the compiled intent file
     """
-    device_values = intent_file.get("config").get("devices").get(device_name)
+    device_values = intent_file.devices.get(device_name)
     if not device_values:
         logging.critical(f"No device values found for {device_name}")
         logging.critical("please validate the testbed and script config files have the same hostname set")
@@ -57,13 +120,117 @@ def get_device_values(device_name: str, intent_file: Dict) -> Dict:
         return device_values
 
 
-def main(runtime) -> None:
+def connect_devices(devices: List, device_values: Dict, username: str, auth_type: str, results: Dict, passcode: str = None) -> List:
     """
-    pyATS required main function
-    Starts the test execution
+    Starts the budget of each device and connects to it, returns the devices that connected with their deadline
+    Token devices connect one after the other, each right after its passcode prompt or with the given passcode.
+    Other devices connect at the same time, the connection threads are finished before this returns so no task
+    is forked while they run
+    A failure on one device is logged in results and does not stop the others
+    """
+    def connect(device: object):
+        values = device_values[device.name]
+        #The device budget starts here and covers connecting and every testscript
+        deadline = time.time() + values.device_budget_seconds if values.device_budget_seconds else None
+        budget.set_budget(device.name, deadline=deadline, command_timeout=values.command_timeout_seconds)
+        try:
+            handle_device_connection(device=device, username=username, auth_type=auth_type, pool_size=values.session_pool_size,
+                                     passcode=passcode)
+        except Exception as e:
+            logging.critical(f"Tests against device {device.name} did not complete - {e}")
+            results[device.name] = {'error': str(e)}
+            return None
+        return device, deadline
+
+    if auth_type.lower() == "token" or len(devices) < 2:
+        connected = [connect(device) for device in devices]
+    else:
+        with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+            connected = list(executor.map(connect, devices))
+    return [entry for entry in connected if entry]
+
+def start_task(runtime, device: object, device_values: DeviceIntent, testscript: str, task_name: str, deadline: float, profile_task: str = None):
+    """
+    Starts one testscript against the device as an easypy task, forked from the job process
+    """
+    taskid = f"{task_name} on device - {device.name}"
+    profile_output = None
+    if profile_task and profile_task in taskid and timing.timing_dir():
+        profile_output = os.path.join(timing.timing_dir(), f"profile-{task_name}-{device.name}.prof".replace(" ", "_"))
+    task = easypy.Task(testscript=testscript, taskid=taskid, runtime=runtime, device=device, device_values=device_values,
+                       deadline=deadline, profile_output=profile_output)
+    task.start()
+    return task
+
+def run_all_devices(runtime, devices: List, device_values: Dict, username: str, auth_type: str, max_workers: int, profile_task: str = None, task_mode: str = "per_script") -> Dict:
+    """
+    Runs each testscript against every device, with at most max_workers devices in flight at once
+    Testscripts for the same device share a connection so they run one after the other, never at the same time
+    Tasks are started and waited on from this thread only, easypy forks them from the job process
+    Token passcodes are prompted for one device at a time while the running tasks keep being reaped and followed up
+    A failure on one device is logged and does not stop the others
+    Returns the result of every task by task name, by device name
+    """
+    #Tasks are forked from this process, anything loaded here is shared with all of them
+    startup.prewarm(devices, device_values)
+    testscripts = [COMBINED_TESTSCRIPT] if task_mode == "per_device" else TESTSCRIPTS
+    results = dict()
+    waiting = list(devices)
+    running = dict()
+    token = auth_type.lower() == "token" and snapshot.snapshot_mode() != "replay"
+    #Device, thread and passcode end of the open passcode prompt
+    prompt = None
+
+    def start_next(device: object, remaining: List, deadline: float) -> None:
+        testscript, task_name = remaining[0]
+        try:
+            task = start_task(runtime, device, device_values[device.name], testscript, task_name, deadline, profile_task=profile_task)
+        except Exception as e:
+            logging.critical(f"Tests against device {device.name} did not complete - {e}")
+            results.setdefault(device.name, dict())['error'] = str(e)
+            return
+        running[task.sentinel] = (device, task, task_name, remaining[1:], deadline)
+
+    while waiting or running or prompt:
+        if token:
+            #The device being prompted for takes up a worker slot, it starts as soon as the passcode is in
+            if prompt is None and waiting and len(running) < max_workers:
+                device = waiting.pop(0)
+                prompt = (device, *prompt_token_passcode(device.name))
+        else:
+            starting, waiting = waiting[:max_workers - len(running)], waiting[max_workers - len(running):]
+            for device, deadline in connect_devices(starting, device_values, username, auth_type, results):
+                start_next(device, testscripts, deadline)
+        if not running and prompt is None:
+            continue
+        for sentinel in wait(list(running) + ([prompt[2]] if prompt else [])):
+            if prompt and sentinel is prompt[2]:
+                device, thread, receiver = prompt
+                prompt = None
+                passcode, error = receiver.recv()
+                receiver.close()
+                thread.join()
+                if error:
+                    logging.critical(f"Tests against device {device.name} did not complete - {error}")
+                    results[device.name] = {'error': error}
+                    continue
+                for device, deadline in connect_devices([device], device_values, username, auth_type, results, passcode=passcode):
+                    start_next(device, testscripts, deadline)
+                continue
+            device, task, task_name, remaining, deadline = running.pop(sentinel)
+            task.wait()
+            results.setdefault(device.name, dict())[task_name] = str(task.result)
+            if remaining:
+                start_next(device, remaining, deadline)
+    return results
+
+
+def prepare_run(args: Dict, devices: List):
+    """
+    Validates the arguments and the intent of every device, then sets up snapshots, parsers and the stores
+    Returns the username and the intent per device name
+    Shared by the pyATS job and the monitor daemon
     """
-    args, sys.argv[1:] = parser.parse_known_args(sys.argv[1:])
-    args = vars(args)
     username = None
     if args['auth_type'].lower() == "token":
         if not args.get('username'):
@@ -71,13 +238,172 @@ def main(runtime) -> None:
             sys.exit()
         else:
             username = args['username']
-    intent_file = load_yaml(file_=args['intent_file'])
-    logging.info("User input required")
+    if args['max_workers'] < 1:
+        logging.critical("max_workers must be at least 1, exiting")
+        sys.exit()
+    #Validate and compile the intent for the testbed devices before any device is touched
+    cache_dir = None if args['intent_cache'].lower() == "none" else args['intent_cache']
+    try:
+        intent_file = load_intent(path=args['intent_file'], device_names=[device.name for device in devices], cache_dir=cache_dir)
+    except IntentError as e:
+        logging.critical(e)
+        logging.critical("exiting")
+        sys.exit()
 
-    for device in runtime.testbed.devices.values():
-        device_values = get_device_values(device_name=device.name, intent_file=intent_file)
-        handle_device_connection(device=device, username=username, auth_type=args['auth_type'])
-        easypy.run(testscript="./testscripts/interface_tests.py", taskid= f"Interface Tests on device - {device.name}", device=device, device_values=device_values, runtime = runtime)
-        easypy.run(testscript="./testscripts/icmp_tests.py", taskid= f"ICMP Tests on device - {device.name}", device=device, device_values=device_values, runtime = runtime)
-        easypy.run(testscript="./testscripts/bgp_tests.py", taskid= f"BGP Tests on device - {device.name}", device=device, device_values=device_values, runtime = runtime)
+    #Validate the intent for every device before we touch any of them
+    device_values = {device.name: get_device_values(device_name=device.name, intent_file=intent_file) for device in devices}
+    snapshot.configure_snapshots(mode=args['snapshot_mode'], directory=args['snapshot_dir'], ttl=args['snapshot_ttl'])
+    fast_parsers.configure_parsers(args['parsers'])
+    counters.configure_counter_store(args['counter_store'])
+    history.configure_history(None if args['history_db'].lower() == "none" else args['history_db'])
+    return username, device_values
 
+
+def configure_outputs(runtime, args: Dict) -> tuple:
+    """
+    Turns on timing and sets up reporting for this job and its tasks, returns the timing and results directories
+    """
+    #Every process of the job records its timings under this directory, merged into reports once all tasks are done
+    timing_dir = args['timing_dir'] or os.path.join(runtime.directory, "timings")
+    timing.enable_timing(timing_dir)
+    #Compact reports leave most checks out of the pyATS report, results_dir keeps every one of them
+    results_dir = args['results_dir']
+    if args['report_mode'] == "compact" and not results_dir:
+        results_dir = os.path.join(runtime.directory, "results")
+    reporting.configure_reporting(args['report_mode'], results_dir)
+    return timing_dir, results_dir
+
+def write_outputs(timing_dir: str, results_dir: str, prometheus_file: str = None) -> None:
+    timing.write_reports(timing_dir, prometheus_file=prometheus_file)
+    logging.info(f"Timing reports written to {timing_dir}")
+    if results_dir:
+        counts = reporting.merge_results(results_dir)
+        logging.info(f"Results of {sum(counts.values())} checks written to {os.path.join(results_dir, 'results.json')} - {counts}")
+
+
+def start_local_workers(runtime, args: Dict, job_args: List, count: int) -> List:
+    """
+    Starts count worker jobs on this host with the same job options, pointed at the coordinator
+    """
+    testbed_file = args['worker_testbed'] or getattr(runtime.testbed, 'testbed_file', None)
+    if not testbed_file:
+        logging.critical("Unable to tell which testbed file the local workers should load, pass it with --worker_testbed, exiting")
+        sys.exit()
+    pyats = os.path.join(os.path.dirname(sys.executable), "pyats")
+    command = [pyats if os.path.exists(pyats) else "pyats", "run", "job", os.path.abspath(__file__), "--testbed-file", testbed_file,
+               *job_args, "--worker", args['coordinate']]
+    logging.info(f"Starting {count} local workers - {' '.join(command)}")
+    return [subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for _ in range(count)]
+
+def run_coordinator(runtime, args: Dict, devices: List, job_args: List) -> None:
+    """
+    Splits the devices into shards, hands each to a worker job and merges what the workers send back
+    Intent is validated once here, before any worker starts. Token passcodes are entered on the worker hosts
+    """
+    if args['shards'] < 1:
+        logging.critical("shards must be at least 1, exiting")
+        sys.exit()
+    if args['local_workers'] and args['auth_type'].lower() == "token" and args['snapshot_mode'] != "replay":
+        logging.critical("Local workers can't prompt for token passcodes, start each worker with --worker from its own terminal, exiting")
+        sys.exit()
+    prepare_run(args=args, devices=devices)
+    assignment = [names for names in shard.shard_devices(devices, args['shards'], args['shard_by']) if names]
+    for number, names in enumerate(assignment):
+        logging.info(f"Shard {number}: {len(names)} devices - {', '.join(names)}")
+    if args['local_workers'] and not os.environ.get(shard.SHARD_KEY_ENV):
+        #Local workers inherit the environment, so a throwaway key is enough
+        os.environ[shard.SHARD_KEY_ENV] = secrets.token_hex(16)
+    try:
+        coordinator = shard.Coordinator(args['coordinate'], assignment)
+    except (ValueError, OSError) as e:
+        logging.critical(f"Unable to start the coordinator - {e}")
+        logging.critical("exiting")
+        sys.exit()
+    workers = start_local_workers(runtime, args, job_args, len(assignment)) if args['local_workers'] else []
+    try:
+        results = coordinator.run(timeout=args['shard_timeout'])
+    finally:
+        for worker in workers:
+            try:
+                worker.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                worker.terminate()
+
+    timing_dir, results_dir = configure_outputs(runtime, args)
+    summary = {'shards': [], 'devices': dict(), 'results': dict()}
+    for number, result in sorted(results.items()):
+        summary['shards'].append({'shard': number, 'worker': coordinator.workers.get(number), 'devices': assignment[number], 'error': result.get('error')})
+        if result.get('error'):
+            logging.critical(f"Shard {number} did not finish - {result['error']}")
+            for name in assignment[number]:
+                summary['devices'][name] = {'error': result['error']}
+        summary['devices'].update(result['devices'])
+        #Worker timing records and check results are merged as if they were written by processes of this job
+        with open(os.path.join(timing_dir, f"timings-shard{number}.jsonl"), "w") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in result.get('timings', [])))
+        if results_dir:
+            with open(os.path.join(results_dir, f"results-shard{number}.jsonl"), "w") as f:
+                f.write("".join(json.dumps(entry) + "\n" for entry in result.get('checks', [])))
+    for name, tasks in sorted(summary['devices'].items()):
+        logging.info(f"{name}: {', '.join(f'{task} {result}' for task, result in tasks.items())}")
+        for result in tasks.values():
+            summary['results'][result] = summary['results'].get(result, 0) + 1
+    with open(os.path.join(runtime.directory, "shards.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    logging.info(f"Results of {len(summary['devices'])} devices across {len(assignment)} shards written to {os.path.join(runtime.directory, 'shards.json')}")
+    write_outputs(timing_dir, results_dir, prometheus_file=args['prometheus_textfile'])
+
+def run_worker(runtime, args: Dict, devices: List) -> None:
+    """
+    Takes a shard from the coordinator, runs its devices and sends back their task results, timing records and check results
+    The worker keeps its own timing and results under its job directory, the coordinator writes the merged ones
+    """
+    try:
+        connection, assignment = shard.join(args['worker'])
+    except (ValueError, OSError) as e:
+        logging.critical(f"Unable to join the coordinator at {args['worker']} - {e}")
+        logging.critical("exiting")
+        sys.exit()
+    if assignment['shard'] is None:
+        logging.info("Every shard was already taken, nothing to do")
+        connection.close()
+        return
+    assigned = set(assignment['devices'])
+    devices = [device for device in devices if device.name in assigned]
+    results = {name: {'error': "not in the worker testbed"} for name in assigned - {device.name for device in devices}}
+    logging.info(f"Running shard {assignment['shard']} - {', '.join(sorted(assigned))}")
+    username, device_values = prepare_run(args=args, devices=devices)
+    timing_dir, results_dir = configure_outputs(runtime, dict(args, timing_dir=None, results_dir=None))
+    try:
+        results.update(run_all_devices(runtime=runtime, devices=devices, device_values=device_values, username=username,
+                                       auth_type=args['auth_type'], max_workers=args['max_workers'],
+                                       profile_task=args['profile_task'], task_mode=args['task_mode']))
+    finally:
+        write_outputs(timing_dir, results_dir)
+        shard.send_result(connection, assignment['shard'], results, timings=timing.load_records(timing_dir),
+                          checks=reporting.load_results(results_dir) if results_dir else [])
+
+
+def main(runtime) -> None:
+    """
+    pyATS required main function
+    Starts the test execution
+    """
+    job_args = sys.argv[1:]
+    args, sys.argv[1:] = parser.parse_known_args(sys.argv[1:])
+    args = vars(args)
+    devices = list(runtime.testbed.devices.values())
+    if args['worker']:
+        run_worker(runtime, args, devices)
+        return
+    if args['coordinate']:
+        run_coordinator(runtime, args, devices, job_args)
+        return
+    username, device_values = prepare_run(args=args, devices=devices)
+    timing_dir, results_dir = configure_outputs(runtime, args)
+    try:
+        run_all_devices(runtime=runtime, devices=devices, device_values=device_values, username=username,
+                        auth_type=args['auth_type'], max_workers=args['max_workers'],
+                        profile_task=args['profile_task'], task_mode=args['task_mode'])
+    finally:
+        write_outputs(timing_dir, results_dir, prometheus_file=args['prometheus_textfile'])
@@ -0,0 +1,109 @@
+import logging
+import math
+
+from typing import Dict, List, Optional
+from helpers import cli
+from helpers.helpers import Predicate
+from helpers.intent import IcmpIntent
+
+#Half width, in success rate percent, of the indifference zone around the success_rate_percent_conform threshold
+#Circuits within this distance of the threshold take the most pings to decide
+ADAPTIVE_MARGIN_PERCENT = 5
+#Hypothesised success rates are kept off 0 and 1 so the likelihood ratio stays finite
+SUCCESS_RATE_FLOOR = 0.001
+
+
+def _clamp_rate(rate: float) -> float:
+    return min(max(rate, SUCCESS_RATE_FLOOR), 1 - SUCCESS_RATE_FLOOR)
+
+def sprt_hypotheses(predicate: Predicate) -> Optional[tuple]:
+    """
+    Returns the (pass, fail) success rates tested against each other for a success_rate_percent_conform predicate
+    eq predicates can't be decided early and return None
+    """
+    threshold = predicate.threshold / 100
+    margin = ADAPTIVE_MARGIN_PERCENT / 100
+    if predicate.oper in ("ge", "gt"):
+        return _clamp_rate(threshold + margin), _clamp_rate(threshold - margin)
+    if predicate.oper in ("le", "lt"):
+        return _clamp_rate(threshold - margin), _clamp_rate(threshold + margin)
+    return None
+
+def loss_decision(received: int, sent: int, predicate: Predicate, confidence: int) -> Optional[bool]:
+    """
+    Wald's sequential probability ratio test of the replies seen so far against the success rate predicate
+    Returns True or False once the pass or fail hypothesis is accepted at the confidence percent, None while undecided
+    """
+    hypotheses = sprt_hypotheses(predicate)
+    if not hypotheses or not sent or hypotheses[0] == hypotheses[1]:
+        return None
+    p_pass, p_fail = hypotheses
+    error = 1 - confidence / 100
+    log_ratio = received * math.log(p_pass / p_fail) + (sent - received) * math.log((1 - p_pass) / (1 - p_fail))
+    if log_ratio >= math.log((1 - error) / error):
+        return True
+    if log_ratio <= math.log(error / (1 - error)):
+        return False
+    return None
+
+def breached(predicate: Predicate, running_max) -> bool:
+    """
+    True when a value that only grows with more samples, like max_ms, already fails an upper bound predicate
+    """
+    return bool(predicate) and running_max is not None and predicate.oper in ("le", "lt") and not predicate(running_max)
+
+def merge_ping_results(results: List) -> Dict:
+    """
+    Combines the parsed results of several ping batches into a single result of the same shape
+    """
+    send = received = 0
+    min_ms = max_ms = None
+    total_ms = 0
+    for result in results:
+        statistics = result.get('ping', {}).get('statistics', {})
+        send += int(statistics.get('send', 0))
+        batch_received = int(statistics.get('received', 0))
+        received += batch_received
+        round_trip = statistics.get('round_trip')
+        if round_trip and batch_received:
+            min_ms = round_trip['min_ms'] if min_ms is None else min(min_ms, round_trip['min_ms'])
+            max_ms = round_trip['max_ms'] if max_ms is None else max(max_ms, round_trip['max_ms'])
+            total_ms += round_trip['avg_ms'] * batch_received
+    statistics = {'send': send, 'received': received, 'success_rate_percent': round(received / send * 100, 1) if send else 0.0}
+    if received:
+        statistics['round_trip'] = {'min_ms': min_ms, 'avg_ms': round(total_ms / received), 'max_ms': max_ms}
+    last_ping = results[-1].get('ping', {}) if results else {}
+    return {'ping': dict(last_ping, repeat=send, statistics=statistics)}
+
+def stop_reason(statistics: Dict, icmp_test: IcmpIntent) -> Optional[str]:
+    """
+    Returns why probing can stop given the statistics so far, or None when more pings are needed
+    """
+    round_trip = statistics.get('round_trip')
+    if round_trip and breached(icmp_test.max_ms_conform, round_trip['max_ms']):
+        return "max_ms_conform breached"
+    if round_trip and breached(icmp_test.jitter_conform, round_trip['max_ms'] - round_trip['min_ms']):
+        return "jitter_conform breached"
+    if icmp_test.success_rate_percent_conform:
+        decision = loss_decision(statistics['received'], statistics['send'], icmp_test.success_rate_percent_conform, icmp_test.confidence)
+        if decision is not None:
+            return f"success_rate_percent_conform decided {'pass' if decision else 'fail'}"
+    return None
+
+def adaptive_ping(device: object, icmp_test: IcmpIntent, interface: str, ping_args: Dict) -> Dict:
+    """
+    Pings in batches of batch_size, up to ping_count, stopping as soon as stop_reason has an answer
+    The merged result carries the samples used under statistics.adaptive
+    """
+    results = []
+    sent = 0
+    reason = None
+    while sent < icmp_test.ping_count and not reason:
+        count = min(icmp_test.batch_size, icmp_test.ping_count - sent)
+        results.append(cli.ping(device, circuit=interface, count=count, **ping_args))
+        sent += count
+        reason = stop_reason(merge_ping_results(results)['ping']['statistics'], icmp_test)
+    merged = merge_ping_results(results)
+    merged['ping']['statistics']['adaptive'] = {'samples': sent, 'batches': len(results), 'stopped': reason or "ping_count reached"}
+    logging.info(f"Adaptive ping to {icmp_test.pingable_address} over {interface} used {sent} of {icmp_test.ping_count} pings - {reason or 'ping_count reached'}")
+    return merged
@@ -0,0 +1,54 @@
+import math
+import time
+
+from typing import Dict, Optional
+
+#Deadline (epoch seconds) and per command timeout of every device this process talks to
+#connect_devices sets them in the main process, the collection context of each task sets them again from its deadline parameter
+_budgets = dict()
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised instead of running a command once the time budget of its device is spent
+    """
+
+
+def set_budget(device_name: str, deadline: float = None, command_timeout: int = None) -> None:
+    _budgets[device_name] = (deadline, command_timeout)
+
+def remaining(device_name: str) -> Optional[float]:
+    """
+    Seconds left in the device budget, or None when the device has no budget
+    """
+    deadline = _budgets.get(device_name, (None, None))[0]
+    return None if deadline is None else deadline - time.time()
+
+def expired(device_name: str) -> Optional[str]:
+    """
+    Returns why the device can no longer be used, or None while its budget has time left
+    """
+    left = remaining(device_name)
+    if left is not None and left <= 0:
+        return f"Timed out - the time budget for {device_name} is spent"
+    return None
+
+def check(device_name: str, command: str) -> None:
+    reason = expired(device_name)
+    if reason:
+        raise DeadlineExceeded(f"{reason}, abandoned '{command}'")
+
+def command_timeout(device_name: str, within_budget: bool = True) -> Optional[int]:
+    """
+    Timeout for the next command, the per command timeout cut down to whatever is left of the budget
+    """
+    timeout = _budgets.get(device_name, (None, None))[1]
+    limits = [limit for limit in (timeout, remaining(device_name) if within_budget else None) if limit is not None]
+    return max(1, math.ceil(min(limits))) if limits else None
+
+def timeout_args(device_name: str, keyword: str = "timeout", within_budget: bool = True) -> Dict:
+    """
+    Keyword arguments passing the command timeout to a Unicon call, empty when there is no limit
+    """
+    timeout = command_timeout(device_name, within_budget)
+    return {keyword: timeout} if timeout else {}
@@ -0,0 +1,133 @@
+import copy
+import hashlib
+import json
+import math
+import time
+
+from typing import Dict, List
+from helpers import budget, fast_parsers, snapshot, timing
+
+#Parsed output by device name then command, with the digest of the raw output it was parsed from
+#Only kept for devices that reuse_parses was called for, the monitor keeps it from one check to the next
+_parses = dict()
+#Commands parsed again in this process because their output changed, and commands answered from the kept parse, by device name
+_reparsed = dict()
+_reused = dict()
+
+
+def reuse_parses(device_name: str, parses: Dict = None) -> None:
+    """
+    Keeps the parsed output of the device, output with the same digest as last time is not parsed again
+    """
+    _parses.setdefault(device_name, dict()).update(parses or {})
+
+def reparsed(device_name: str) -> Dict:
+    """
+    Digest and parsed output of every command of the device parsed again in this process
+    """
+    return {command: _parses[device_name][command] for command in _reparsed.get(device_name, ())}
+
+def reused(device_name: str) -> List:
+    """
+    Commands of the device answered from the kept parse in this process
+    """
+    return sorted(_reused.get(device_name, ()))
+
+def output_digest(output: str) -> str:
+    return hashlib.sha256(output.encode()).hexdigest()
+
+def _collect(device: object, command: str) -> str:
+    budget.check(device.name, command)
+    return snapshot.cached(device.name, command, lambda: device.execute(command, **budget.timeout_args(device.name)))
+
+def execute(device: object, command: str, circuit: str = None) -> str:
+    """
+    Runs a show command and returns the raw output
+    """
+    with timing.measure(device.name, command, stage="execute", circuit=circuit) as entry:
+        raw_output = _collect(device, command)
+        entry['bytes'] = len(raw_output)
+    return raw_output
+
+def empty_parser_error() -> type:
+    """
+    Genie's SchemaEmptyParserError, imported on first use so tasks that never parse with Genie don't load the metaparser
+    """
+    from genie.metaparser.util.exceptions import SchemaEmptyParserError
+    return SchemaEmptyParserError
+
+def parse(device: object, command: str, output: str = None, circuit: str = None) -> Dict:
+    """
+    Runs a show command and parses it, timing the CLI and the parser separately
+    Commands with a fast parser only go through Genie when the fast parser doesn't recognise the output
+    For devices set up with reuse_parses, output identical to the previous parse is answered from it
+    Pass output to parse text that was already collected
+    """
+    with timing.measure(device.name, command, stage="parse", circuit=circuit) as entry:
+        if output is None:
+            output = _collect(device, command)
+        entry['bytes'] = len(output)
+        parse_started = time.perf_counter()
+        try:
+            parses = _parses.get(device.name)
+            if parses is None:
+                return _parse(device, command, output, entry)
+            digest = output_digest(output)
+            if command in parses and parses[command][0] == digest:
+                entry['parser'] = "unchanged"
+                _reused.setdefault(device.name, set()).add(command)
+                return copy.deepcopy(parses[command][1])
+            parsed = _parse(device, command, output, entry)
+            parses[command] = (digest, copy.deepcopy(parsed))
+            _reparsed.setdefault(device.name, set()).add(command)
+            return parsed
+        finally:
+            entry['parse_s'] = time.perf_counter() - parse_started
+
+def _parse(device: object, command: str, output: str, entry: Dict) -> Dict:
+    parsed = fast_parsers.fast_parse(command, output)
+    if parsed is not None:
+        entry['parser'] = "fast"
+        return parsed
+    entry['parser'] = "genie"
+    return device.parse(command, output=output)
+
+def _ping(device: object, ping_args: Dict) -> Dict:
+    """
+    Sends the ping as a CLI command and parses it with the fast parser, or through the ping api when that isn't possible
+    Output the fast parser doesn't recognise, such as a rejected command, goes through the ping api so it is validated and raised there
+    """
+    command = fast_parsers.ping_command(**ping_args) if fast_parsers.parser_mode() == "fast" else None
+    if command:
+        #Every packet can take the 2 second default timeout, so the per command timeout doesn't apply, only what is left of the budget
+        timeout = ping_args.get('count', 5) * 2 + 10
+        left = budget.remaining(device.name)
+        if left is not None:
+            timeout = max(1, min(timeout, math.ceil(left)))
+        output = device.execute(command, timeout=timeout)
+        parsed = fast_parsers.parse_ping(output, validate=ping_args.get('validate', False))
+        if parsed is not None:
+            return parsed
+        budget.check(device.name, command)
+    return device.api.ping(**ping_args)
+
+def ping(device: object, circuit: str = None, **ping_args) -> Dict:
+    """
+    Runs the ping api, the parsed result is what gets recorded and replayed
+    """
+    command = "ping " + " ".join(f"{key}={value}" for key, value in sorted(ping_args.items()))
+    with timing.measure(device.name, command, stage="ping", circuit=circuit):
+        budget.check(device.name, command)
+        if snapshot.snapshot_mode() == "live":
+            return _ping(device, ping_args)
+        return json.loads(snapshot.cached(device.name, command, lambda: json.dumps(_ping(device, ping_args))))
+
+def configure(device: object, config: List) -> None:
+    """
+    Pushes configuration to the device, there is nothing to push to when replaying snapshots
+    Not held to the device budget, removing temporary configuration has to happen even after it is spent
+    """
+    if snapshot.snapshot_mode() == "replay":
+        return
+    with timing.measure(device.name, f"configure {len(config)} lines", stage="configure"):
+        device.configure(config, **budget.timeout_args(device.name, within_budget=False))
@@ -0,0 +1,362 @@
+import logging
+import re
+import time
+
+from typing import Callable, Dict, List, Optional
+from helpers import budget, cli, counters, fast_parsers, model_collection, snapshot
+from helpers.adaptive_ping import adaptive_ping
+from helpers.helpers import split_subintf
+from helpers.intent import CircuitIntent, DeviceIntent, IcmpIntent, NeighborIntent
+
+#Largest "show interfaces" output we are willing to hand to the Genie parser in one go
+INTERFACE_BULK_MAX_BYTES = 2_000_000
+
+#One command per address family returns the neighbor state for every peer in every VRF
+BGP_NEIGHBOR_COMMANDS = {
+    "ipv4 unicast": "show ip bgp all neighbors",
+    "vpnv4 unicast": "show bgp vpnv4 unicast all neighbors",
+}
+
+#Parsed bulk neighbor output, keyed by device name then command
+bgp_neighbor_cache = dict()
+
+#Rough cost of one filtered route lookup, measured in route table lines we could have pulled instead
+BGP_TARGETED_ROUTE_COST = 50
+#How many prefixes are folded into a single "| include" filter
+BGP_TARGETED_CHUNK_SIZE = 20
+#Genie keys for the route tables, and the direction used for the neighbor prefix counters
+BGP_ROUTE_TABLES = {
+    "advertised-routes": ("advertised", "sent"),
+    "routes": ("routes", "received"),
+}
+
+#A route table row, the network is the first address after the status, path selection and RPKI codes
+#Continuation rows only carry a next hop, indented past the codes, so they never match
+route_network_regex = re.compile(r"^[\sA-Za-z*>=]{0,8}?(?P<network>\d{1,3}(?:\.\d{1,3}){3}(?:/\d{1,2})?)(?=\s|$)", re.M)
+
+#Checks whose failure makes collecting for a dependent check pointless
+#A down interface can't pass pings and an unreachable peer won't exchange routes
+CHECK_DEPENDENCIES = {
+    "icmp": ("interface",),
+    "bgp_routes": ("interface", "icmp"),
+}
+
+
+def required_interfaces(circuits: List) -> List:
+    """
+    Returns every unique interface the circuits need counters for, including subinterface parents
+    """
+    interfaces = []
+    for circuit in circuits:
+        names = [circuit.interface]
+        if circuit.is_subinterface:
+            names.append(split_subintf(circuit.interface))
+        for name in names:
+            if name not in interfaces:
+                interfaces.append(name)
+    return interfaces
+
+def slice_interface_output(raw_output: str, interfaces: List) -> str:
+    """
+    Cuts the blocks of the given interfaces out of bulk show interfaces output
+    """
+    starts = [(match.group('name'), match.start()) for match in fast_parsers.interface_regex.finditer(raw_output)]
+    ends = [start for _, start in starts[1:]] + [len(raw_output)]
+    return "".join(raw_output[start:end] for (name, start), end in zip(starts, ends) if name in interfaces)
+
+def gather_interface_index(device: object, interfaces: List, mode: str = "bulk", max_bytes: int = INTERFACE_BULK_MAX_BYTES) -> Dict:
+    """
+    Builds a dictionary of parsed show interface output keyed by interface name
+    bulk mode pulls "show interfaces" once, an oversized bulk output only has the blocks of the given interfaces parsed
+    per_interface mode issues one "show interface X" per unique interface
+    Interfaces the device doesn't have are left out of the index
+    """
+    if mode == "bulk":
+        raw_output = cli.execute(device, "show interfaces")
+        if len(raw_output) > max_bytes:
+            raw_output = slice_interface_output(raw_output, interfaces)
+            logging.warning(f"show interfaces output on {device.name} is over {max_bytes} bytes, only parsing the {len(interfaces)} interfaces in use")
+        else:
+            logging.info(f"Parsing bulk show interfaces output ({len(raw_output)} bytes) on {device.name}")
+        if not raw_output:
+            return {}
+        try:
+            return cli.parse(device, "show interfaces", output=raw_output)
+        except cli.empty_parser_error():
+            logging.info(f"No output from parser for show interfaces on {device.name}")
+            return {}
+    elif mode != "per_interface":
+        raise ValueError(f"Unknown interface collection mode {mode}")
+
+    interface_index = dict()
+    for interface in interfaces:
+        try:
+            interface_index.update(cli.parse(device, f"show interface {interface}", circuit=interface))
+        except cli.empty_parser_error():
+            logging.info(f"No output from parser for show interface {interface} on {device.name}")
+    return interface_index
+
+def bgp_neighbor_commands(circuits: List) -> List:
+    """
+    Returns the bulk neighbor commands needed to cover every address family in the bgp intent
+    Circuits in a VRF always need the vpnv4 view, everything else defaults to ipv4 unicast
+    """
+    commands = []
+    for circuit in circuits:
+        bgp_test = circuit.tests.bgp
+        if not bgp_test.test_bgp:
+            continue
+        for neighbor in bgp_test.neighbors:
+            address_families = [af.address_family for af in neighbor.address_families]
+            if bgp_test.vrf:
+                address_families.append("vpnv4 unicast")
+            for af_name in address_families or ["ipv4 unicast"]:
+                command = BGP_NEIGHBOR_COMMANDS.get(af_name, BGP_NEIGHBOR_COMMANDS["ipv4 unicast"])
+                if command not in commands:
+                    commands.append(command)
+    return commands
+
+def gather_bgp_neighbors(device: object, commands: List) -> Dict:
+    """
+    Returns neighbor details for every peer on the device keyed by vrf then neighbor ip
+    Each bulk command is only parsed once per device, later calls are answered from bgp_neighbor_cache
+    """
+    device_cache = bgp_neighbor_cache.setdefault(device.name, dict())
+    neighbors = dict()
+    for command in commands:
+        if command not in device_cache:
+            try:
+                device_cache[command] = cli.parse(device, command)
+            except cli.empty_parser_error():
+                logging.info(f"No output from parser for {command} on {device.name}")
+                device_cache[command] = {}
+        for vrf, vrf_values in device_cache[command].get('vrf', {}).items():
+            for neighbor_ip, neighbor_details in vrf_values.get('neighbor', {}).items():
+                neighbors.setdefault(vrf, dict()).setdefault(neighbor_ip, neighbor_details)
+    return neighbors
+
+def neighbor_wants_routes(neighbor: NeighborIntent, route_key: str) -> bool:
+    """
+    True when any address family of the neighbor intent lists routes under route_key
+    route_key is either received_routes or advertised_routes
+    """
+    return any(getattr(af, route_key) for af in neighbor.address_families)
+
+def neighbor_prefix_count(neighbor_details: Dict, af_name: str, table: str):
+    """
+    Returns the current prefix count for the neighbor in the direction of table, or None if unknown
+    """
+    direction = BGP_ROUTE_TABLES[table][1]
+    af_details = neighbor_details.get('address_family', {}).get(af_name or "ipv4 unicast", {})
+    return af_details.get('prefix_activity_counters', {}).get(direction, {}).get('prefixes_current')
+
+def neighbor_route_match(neighbor: NeighborIntent) -> str:
+    """
+    covered when any address family of the neighbor intent accepts a covering aggregate, otherwise exact
+    """
+    return "covered" if any(af.route_match == "covered" for af in neighbor.address_families) else "exact"
+
+def choose_route_lookup(mode: str, route_count: int, prefix_count, route_match: str = "exact") -> str:
+    """
+    Decides between a targeted lookup of the intent prefixes and pulling the full route table
+    auto picks targeted only when the neighbor's table is clearly bigger than the lookups would cost
+    covered matching always pulls the full table, the aggregate covering a route isn't found by filtering on the route
+    """
+    if mode not in ("auto", "targeted", "full"):
+        raise ValueError(f"Unknown route lookup mode {mode}")
+    if route_match == "covered":
+        return "full"
+    if mode in ("targeted", "full"):
+        return mode
+    if prefix_count is None:
+        return "full"
+    return "targeted" if route_count * BGP_TARGETED_ROUTE_COST < prefix_count else "full"
+
+def parse_route_networks(raw_output: str) -> List:
+    """
+    Pulls the network of every row out of show ip bgp route table output
+    Rows are matched on their own, the data rows don't line up with the Network header
+    """
+    return [match.group('network') for match in route_network_regex.finditer(raw_output)]
+
+def gather_targeted_routes(device: object, neighbor_ip: str, vrf: str, table: str, prefixes: List) -> Dict:
+    """
+    Looks up only the given prefixes in the neighbor route table using filtered output
+    Returns a dictionary shaped like the Genie neighbor routes parsers
+    """
+    if vrf and vrf != "default":
+        base_command = f"show ip bgp vpnv4 vrf {vrf} neighbors {neighbor_ip} {table}"
+    else:
+        base_command = f"show ip bgp neighbors {neighbor_ip} {table}"
+    wanted = {prefix.split('/')[0] for prefix in prefixes}
+    found = dict()
+    for index in range(0, len(prefixes), BGP_TARGETED_CHUNK_SIZE):
+        chunk = prefixes[index:index + BGP_TARGETED_CHUNK_SIZE]
+        include_filter = "|".join(["Network"] + [prefix.split('/')[0] for prefix in chunk])
+        raw_output = cli.execute(device, f"{base_command} | include {include_filter}")
+        for network in parse_route_networks(raw_output):
+            if network.split('/')[0] in wanted:
+                found[network] = dict()
+    #The tests read the ipv4 unicast table from the "" address family, as the Genie parsers do
+    return {'address_family': {'': {BGP_ROUTE_TABLES[table][0]: found}}}
+
+def gather_neighbor_routes(device: object, neighbor_ip: str, vrf: str, table: str, prefixes: List, mode: str = "auto", prefix_count=None,
+                           route_match: str = "exact") -> Dict:
+    """
+    Returns the neighbor advertised-routes or routes table, either in full or only the intent prefixes
+    """
+    lookup = choose_route_lookup(mode=mode, route_count=len(prefixes), prefix_count=prefix_count, route_match=route_match)
+    logging.info(f"Using {lookup} route lookup for {len(prefixes)} prefixes on neighbor {neighbor_ip} {table} (table size {prefix_count})")
+    if lookup == "targeted":
+        return gather_targeted_routes(device=device, neighbor_ip=neighbor_ip, vrf=vrf, table=table, prefixes=prefixes)
+    try:
+        routes = cli.parse(device, f"show ip bgp neighbor {neighbor_ip} {table}")
+    except cli.empty_parser_error():
+        logging.info(f"No output from parser for neighbor {neighbor_ip} {table}")
+        return {}
+    return routes.get("vrf", {}).get(vrf, {}).get('neighbor', {}).get(neighbor_ip, {})
+
+def ping_circuit(device: object, icmp_test: IcmpIntent, interface: str) -> Dict:
+    """
+    Sends the warm up ping and then the real ping for a single circuit, returning the parsed ping result
+    In adaptive probe mode the real ping is sent in batches until the conform tests are decided
+    """
+    ping_args = dict(address=icmp_test.pingable_address, source=interface, validate=True)
+    #Any VRF input provided when the global vrf should be used results in "Invalid command has been executed"
+    if icmp_test.vrf:
+        ping_args['vrf'] = icmp_test.vrf
+    #Wake on LAN behavior, ensure arp entry exists
+    cli.ping(device, circuit=interface, count=1, **ping_args)
+    #Actual test
+    if icmp_test.probe_mode == "adaptive":
+        return adaptive_ping(device=device, icmp_test=icmp_test, interface=interface, ping_args=ping_args)
+    return cli.ping(device, circuit=interface, count=icmp_test.ping_count, **ping_args)
+
+
+class CollectionContext:
+    """
+    Everything collected from one device during a task
+    Testcases running in the same task share one context, so data one of them collected is reused by the others
+    """
+    def __init__(self, device: object, device_values: DeviceIntent, deadline: float = None):
+        self.device = device
+        self.device_values = device_values
+        #Task processes hold their own copy of the device budget
+        budget.set_budget(device.name, deadline=deadline, command_timeout=device_values.command_timeout_seconds)
+        self._interface_index = None
+        #Result of each upstream check, keyed by (interface, check). True passed, False failed
+        self.outcomes = dict()
+        #Previous and current counter readings per interface, the stored baseline only moves once per task
+        self._counter_readings = dict()
+        #restconf/netconf backends that failed once in this task, the CLI is used from then on
+        self._failed_backends = set()
+
+    def _model_backend(self, collect: Callable[[object, str], Dict]) -> Optional[Dict]:
+        """
+        Collects through the restconf/netconf backend of the device, None when it is cli or the request failed
+        A failed request is logged and the caller falls back to the CLI
+        """
+        backend = self.device_values.collection_backend
+        if backend == "cli" or backend in self._failed_backends:
+            return None
+        try:
+            return collect(self.device, backend)
+        except (budget.DeadlineExceeded, snapshot.SnapshotMissError):
+            raise
+        except Exception as e:
+            logging.warning(f"{backend} collection failed on {self.device.name}, falling back to the CLI - {type(e).__name__}: {e}")
+            self._failed_backends.add(backend)
+            return None
+
+    def interface_index(self) -> Dict:
+        """
+        Parsed show interface output for every interface the circuits use, collected on first use
+        """
+        if self._interface_index is None:
+            self._interface_index = self._model_backend(model_collection.gather_interface_index)
+        if self._interface_index is None:
+            self._interface_index = gather_interface_index(device=self.device,
+                                                           interfaces=required_interfaces(self.device_values.circuits),
+                                                           mode=self.device_values.interface_collection,
+                                                           max_bytes=self.device_values.interface_bulk_max_bytes)
+        return self._interface_index
+
+    def interface_address(self, interface: str) -> str:
+        """
+        First ipv4 address found on the interface, without its mask, or None
+        From the interface index when this task already collected it, otherwise only the address lines of the interface are asked for
+        """
+        if self._interface_index is not None:
+            for address in self._interface_index.get(interface, {}).get('ipv4', {}):
+                return address.split('/')[0]
+            return None
+        match = fast_parsers.ipv4_regex.search(cli.execute(self.device, f"show interfaces {interface} | include Internet address", circuit=interface))
+        return match.group('ip') if match else None
+
+    def counter_rates(self, interface: str, rate: str) -> Optional[Dict]:
+        """
+        Error counter rates of the interface since the baseline stored by the previous run
+        None when there was no baseline yet, this run's counters become the baseline either way
+        """
+        if interface not in self._counter_readings:
+            current = self.interface_index().get(interface, {}).get('counters', {})
+            timestamp = time.time()
+            previous = counters.swap_baseline(self.device.name, interface, current, timestamp) if current else None
+            self._counter_readings[interface] = (previous, current, timestamp)
+        previous, current, timestamp = self._counter_readings[interface]
+        if previous is None:
+            return None
+        return counters.counter_rates(previous, current, elapsed=timestamp - previous['timestamp'], rate=rate)
+
+    def bgp_neighbors(self) -> Dict:
+        """
+        Neighbor details for every peer the circuits test, keyed by vrf then neighbor ip
+        """
+        backend = self.device_values.collection_backend
+        device_cache = bgp_neighbor_cache.setdefault(self.device.name, dict())
+        if backend not in device_cache:
+            parsed = self._model_backend(model_collection.gather_bgp_neighbors)
+            if parsed is not None:
+                device_cache[backend] = parsed
+        if backend in device_cache:
+            return {vrf: dict(vrf_values.get('neighbor', {})) for vrf, vrf_values in device_cache[backend].get('vrf', {}).items()}
+        return gather_bgp_neighbors(device=self.device, commands=bgp_neighbor_commands(self.device_values.circuits))
+
+    def record_outcome(self, interface: str, check: str, passed: bool) -> None:
+        self.outcomes[(interface, check)] = passed
+
+    def line_protocol(self, interface: str) -> Optional[str]:
+        """
+        Line protocol of the interface, from the interface index when this task already collected it
+        Otherwise only the status line of that interface is asked for, a gate is not worth a full interface collection
+        """
+        if self._interface_index is not None:
+            return self._interface_index.get(interface, {}).get('line_protocol')
+        match = fast_parsers.interface_regex.search(cli.execute(self.device, f"show interfaces {interface} | include line protocol", circuit=interface))
+        return match.group('protocol') if match else None
+
+    def outcome(self, interface: str, check: str) -> Optional[bool]:
+        """
+        Whether the check passed for the interface, or None when it is unknown
+        The interface check is the line protocol, read the first time it is asked for
+        """
+        if check == "interface" and (interface, check) not in self.outcomes:
+            try:
+                line_protocol = self.line_protocol(interface)
+            except Exception as e:
+                logging.warning(f"Unable to read the interface state of {interface} on {self.device.name}, not gating on it - {e}")
+                return None
+            self.outcomes[(interface, check)] = line_protocol.lower() == "up" if line_protocol else None
+        return self.outcomes.get((interface, check))
+
+    def blocked_by(self, circuit: CircuitIntent, check: str) -> Optional[str]:
+        """
+        Returns the first upstream check that failed for the circuit, or None when collecting for check is worthwhile
+        Circuits with force_collection set are never blocked
+        """
+        if circuit.force_collection:
+            return None
+        for upstream in CHECK_DEPENDENCIES[check]:
+            if self.outcome(circuit.interface, upstream) is False:
+                return upstream
+        return None
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+
+from contextlib import closing
+from typing import Dict, Optional
+
+#The counter store is shared with every easypy task process through the environment
+COUNTER_STORE_ENV = "HAPPY_CIRCUITS_COUNTER_STORE"
+
+#Error counters tested in delta mode, along with the packet counter they are a fraction of
+ERROR_COUNTERS = {
+    "in_errors": "in_pkts",
+    "in_crc_errors": "in_pkts",
+    "out_errors": "out_pkts",
+    "out_collision": "out_pkts",
+}
+COUNTERS = ("in_pkts", "out_pkts", "in_errors", "in_crc_errors", "out_errors", "out_collision")
+#A counter that went backwards from the top quarter of its range wrapped, anything lower was cleared
+COUNTER_WIDTHS = (32, 64)
+WRAP_FRACTION = 0.75
+
+
+def configure_counter_store(path: str) -> None:
+    """
+    Sets the baseline store for this process and every task process started after it
+    """
+    os.environ[COUNTER_STORE_ENV] = path
+
+def counter_store_path() -> str:
+    return os.environ.get(COUNTER_STORE_ENV, "counters.sqlite")
+
+def _connect() -> sqlite3.Connection:
+    #Autocommit mode, transactions are started explicitly so concurrent tasks queue on the write lock
+    connection = sqlite3.connect(counter_store_path(), timeout=30, isolation_level=None)
+    columns = ", ".join(f"{counter} INTEGER" for counter in COUNTERS)
+    connection.execute(f"CREATE TABLE IF NOT EXISTS counters (device TEXT, interface TEXT, timestamp REAL, {columns}, "
+                       "PRIMARY KEY (device, interface))")
+    return connection
+
+def swap_baseline(device_name: str, interface: str, counters: Dict, timestamp: float) -> Optional[Dict]:
+    """
+    Stores the counters as the new baseline of the interface and returns the previous baseline, None the first time
+    """
+    with closing(_connect()) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(f"SELECT timestamp, {', '.join(COUNTERS)} FROM counters WHERE device = ? AND interface = ?",
+                                     (device_name, interface)).fetchone()
+            connection.execute(f"INSERT OR REPLACE INTO counters VALUES (?, ?, ?, {', '.join('?' for _ in COUNTERS)})",
+                               (device_name, interface, timestamp, *(counters.get(counter) for counter in COUNTERS)))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+    return dict(zip(("timestamp",) + COUNTERS, row)) if row else None
+
+def _wrapped(previous: int, current: int) -> bool:
+    """
+    True when a counter that went backwards did so by running past the top of its range
+    """
+    for bits in COUNTER_WIDTHS:
+        if previous < 2 ** bits:
+            return current < previous and previous >= 2 ** bits * WRAP_FRACTION
+    return False
+
+def was_cleared(previous: Dict, current: Dict) -> bool:
+    """
+    Clearing counters resets all of them at once, so any counter that went backwards without wrapping means a clear
+    """
+    return any(current.get(counter) is not None and previous.get(counter) is not None
+               and current[counter] < previous[counter] and not _wrapped(previous[counter], current[counter])
+               for counter in COUNTERS)
+
+def counter_delta(previous: int, current: int, cleared: bool = False) -> int:
+    """
+    How much a counter grew between two readings, allowing for the counter wrapping or being cleared
+    """
+    if cleared:
+        #Cleared counters restart from zero, so everything counted since the clear is the delta
+        return current
+    if _wrapped(previous, current):
+        for bits in COUNTER_WIDTHS:
+            if previous < 2 ** bits:
+                return current + 2 ** bits - previous
+    return max(current - previous, 0)
+
+def counter_rates(previous: Dict, current: Dict, elapsed: float, rate: str = "per_million_packets") -> Dict:
+    """
+    Rate of each error counter between two readings, either per_second or per_million_packets
+    Errors counted without any packets moving give an infinite per packet rate
+    """
+    rates = dict()
+    cleared = was_cleared(previous, current)
+    for counter, packet_counter in ERROR_COUNTERS.items():
+        if current.get(counter) is None or previous.get(counter) is None:
+            continue
+        errors = counter_delta(previous[counter], current[counter], cleared)
+        if rate == "per_second":
+            rates[counter] = round(errors / max(elapsed, 1.0), 3)
+            continue
+        packets = 0
+        if current.get(packet_counter) is not None and previous.get(packet_counter) is not None:
+            packets = counter_delta(previous[packet_counter], current[packet_counter], cleared)
+        if packets:
+            rates[counter] = round(errors / packets * 1_000_000, 3)
+        else:
+            rates[counter] = float("inf") if errors else 0.0
+    return rates
@@ -0,0 +1,169 @@
+import os
+import re
+
+from typing import Callable, Dict, Optional
+
+#Parser settings are shared with every easypy task process through the environment
+PARSER_MODE_ENV = "HAPPY_CIRCUITS_PARSERS"
+#fast - use the extractors below and fall back to Genie on output they don't recognise, genie - always use Genie
+PARSER_MODES = ("fast", "genie")
+
+#show interface(s), only the fields the interface tests and counter baselines read
+interface_regex = re.compile(r"^(?P<name>\S+) is (?P<status>administratively down|up|down|deleted)(?: \(.*\))?, line protocol is (?P<protocol>\w+)", re.M)
+ipv4_regex = re.compile(r"^\s+(?P<kind>Internet address is|Secondary address) (?P<ip>[\d.]+)/(?P<prefix_length>\d+)", re.M)
+load_regex = re.compile(r"txload (?P<txload>\d+/\d+), rxload (?P<rxload>\d+/\d+)")
+duplex_regex = re.compile(r"^\s+(?P<duplex>\w+)[-\s]+[dD]uplex,", re.M)
+in_pkts_regex = re.compile(r"^\s+(?P<count>\d+) packets input,", re.M)
+out_pkts_regex = re.compile(r"^\s+(?P<count>\d+) packets output,", re.M)
+in_errors_regex = re.compile(r"^\s+(?P<errors>\d+) input errors, (?P<crc>\d+) CRC,", re.M)
+out_errors_regex = re.compile(r"^\s+(?P<errors>\d+) output errors,(?: (?P<collisions>\d+) collisions,)?", re.M)
+
+#show ip bgp all neighbors, only the uptime and prefix counters
+#The all variants list the neighbors once under each address family header, a neighbor in several address families appears under each
+bgp_all_header_regex = re.compile(r"^For address family: .*\n?", re.M)
+neighbor_regex = re.compile(r"^BGP neighbor is (?P<ip>[^,\s]+),\s+(?:vrf (?P<vrf>[^,\s]+),\s+)?remote AS", re.M)
+address_family_regex = re.compile(r"^ For address family: (?P<af>.+?)\s*$", re.M)
+prefixes_current_regex = re.compile(r"^\s+Prefixes Current:\s+(?P<sent>\d+)\s+(?P<received>\d+)", re.M)
+transport_uptime_regex = re.compile(r"^uptime: (?P<uptime>\d+) ms", re.M)
+
+#ping, the same fields the ping api returns
+ping_sending_regex = re.compile(r"Sending (?P<repeat>\d+), (?P<data_bytes>\d+)-byte ICMP Echos to (?P<address>\S+), timeout is (?P<timeout>\d+) seconds")
+ping_success_regex = re.compile(r"Success rate is (?P<percent>\d+) percent \((?P<received>\d+)/(?P<send>\d+)\)"
+                                r"(?:, round-trip min/avg/max = (?P<min>\d+)/(?P<avg>\d+)/(?P<max>\d+) ms)?")
+ping_validate_regex = re.compile(r"^Reply data will be validated", re.M)
+
+
+def configure_parsers(mode: str) -> None:
+    """
+    Sets the parser mode for this process and every task process started after it
+    """
+    if mode not in PARSER_MODES:
+        raise ValueError(f"Unknown parser mode {mode}, expected one of {', '.join(PARSER_MODES)}")
+    os.environ[PARSER_MODE_ENV] = mode
+
+def parser_mode() -> str:
+    return os.environ.get(PARSER_MODE_ENV, "fast")
+
+def _blocks(regex: re.Pattern, output: str):
+    """
+    Splits output into one block per match of regex, None when there is text before the first match
+    """
+    matches = list(regex.finditer(output))
+    if not matches or output[:matches[0].start()].strip():
+        return None
+    return [(match, output[match.start():next_match.start() if next_match else len(output)])
+            for match, next_match in zip(matches, matches[1:] + [None])]
+
+def parse_show_interfaces(output: str) -> Optional[Dict]:
+    """
+    Extracts line protocol, enabled, duplex, load, error and packet counters and ipv4 addresses per interface
+    Returns None for output that doesn't look like IOS show interface output
+    """
+    blocks = _blocks(interface_regex, output)
+    if not blocks:
+        return None
+    interfaces = dict()
+    for match, block in blocks:
+        interface = interfaces[match.group('name')] = {
+            'enabled': match.group('status') != "administratively down",
+            'oper_status': "down" if match.group('status') == "administratively down" else match.group('status'),
+            'line_protocol': match.group('protocol'),
+        }
+        for address in ipv4_regex.finditer(block):
+            ipv4 = interface.setdefault('ipv4', dict())[f"{address.group('ip')}/{address.group('prefix_length')}"] = {
+                'ip': address.group('ip'), 'prefix_length': address.group('prefix_length')}
+            if address.group('kind') == "Secondary address":
+                ipv4['secondary'] = True
+        load = load_regex.search(block)
+        if load:
+            interface['txload'] = load.group('txload')
+            interface['rxload'] = load.group('rxload')
+        duplex = duplex_regex.search(block)
+        if duplex:
+            interface['duplex_mode'] = duplex.group('duplex').lower()
+        counters = dict()
+        for regex, counter in ((in_pkts_regex, 'in_pkts'), (out_pkts_regex, 'out_pkts')):
+            count = regex.search(block)
+            if count:
+                counters[counter] = int(count.group('count'))
+        in_errors = in_errors_regex.search(block)
+        if in_errors:
+            counters['in_errors'] = int(in_errors.group('errors'))
+            counters['in_crc_errors'] = int(in_errors.group('crc'))
+        out_errors = out_errors_regex.search(block)
+        if out_errors:
+            counters['out_errors'] = int(out_errors.group('errors'))
+            if out_errors.group('collisions') is not None:
+                counters['out_collision'] = int(out_errors.group('collisions'))
+        if counters:
+            interface['counters'] = counters
+    return interfaces
+
+def parse_show_bgp_neighbors(output: str) -> Optional[Dict]:
+    """
+    Extracts the session uptime and current prefix counts per address family of every neighbor, keyed by vrf then neighbor
+    Returns None for output that doesn't look like IOS show bgp neighbors output
+    """
+    blocks = _blocks(neighbor_regex, bgp_all_header_regex.sub("", output))
+    if not blocks:
+        return None
+    vrfs = dict()
+    for match, block in blocks:
+        neighbor = vrfs.setdefault(match.group('vrf') or "default", {'neighbor': dict()})['neighbor'].setdefault(match.group('ip'), dict())
+        uptime = transport_uptime_regex.search(block)
+        if uptime:
+            neighbor['bgp_session_transport'] = {'uptime': int(uptime.group('uptime'))}
+        for address_family, af_block in _blocks(address_family_regex, block[block.find("\n For address family:"):]) or []:
+            prefixes = prefixes_current_regex.search(af_block)
+            af_details = neighbor.setdefault('address_family', dict())[address_family.group('af').lower()] = dict()
+            if prefixes:
+                af_details['prefix_activity_counters'] = {'sent': {'prefixes_current': int(prefixes.group('sent'))},
+                                                          'received': {'prefixes_current': int(prefixes.group('received'))}}
+    return {'vrf': vrfs}
+
+def parse_ping(output: str, validate: bool = False) -> Optional[Dict]:
+    """
+    Extracts the ping statistics in the same shape as the ping api result
+    Returns None for output without a success rate line, or without the reply data check when validate is set
+    """
+    sending = ping_sending_regex.search(output)
+    success = ping_success_regex.search(output)
+    if not sending or not success or (validate and not ping_validate_regex.search(output)):
+        return None
+    statistics = {'send': int(success.group('send')), 'received': int(success.group('received')),
+                  'success_rate_percent': float(success.group('percent'))}
+    if success.group('min') is not None:
+        statistics['round_trip'] = {'min_ms': int(success.group('min')), 'avg_ms': int(success.group('avg')), 'max_ms': int(success.group('max'))}
+    return {'ping': {'address': sending.group('address'), 'data_bytes': int(sending.group('data_bytes')),
+                     'repeat': int(sending.group('repeat')), 'timeout_secs': int(sending.group('timeout')), 'statistics': statistics}}
+
+def ping_command(address: str, count: int = 5, source: str = None, vrf: str = None, validate: bool = False, **kwargs) -> Optional[str]:
+    """
+    Builds the CLI ping the ping api would send, None when it was asked for options only the api understands
+    """
+    if kwargs:
+        return None
+    return " ".join(filter(None, ("ping", f"vrf {vrf}" if vrf else None, address, f"repeat {count}",
+                                  f"source {source}" if source else None, "validate" if validate else None)))
+
+#Show commands with a fast parser, matched on the command with any interface or neighbor argument removed
+FAST_PARSERS = {
+    "show interfaces": parse_show_interfaces,
+    "show interface": parse_show_interfaces,
+    "show ip bgp all neighbors": parse_show_bgp_neighbors,
+    "show bgp vpnv4 unicast all neighbors": parse_show_bgp_neighbors,
+}
+
+def fast_parser(command: str) -> Optional[Callable]:
+    if parser_mode() != "fast":
+        return None
+    if command.startswith("show interface ") and " | " not in command:
+        return parse_show_interfaces
+    return FAST_PARSERS.get(command)
+
+def fast_parse(command: str, output: str) -> Optional[Dict]:
+    """
+    Parses output with the fast parser of the command, None when there is none or the output wasn't recognised
+    """
+    parser = fast_parser(command)
+    return parser(output) if parser else None
@@ -8,11 +8,38 @@ comparison_functions = {
     "eq": operator.eq
 }
 
-def compare_values(value:int, oper:str) -> bool:
+class Predicate:
     """
-    Compares the given value against the condition defined in 'oper'.
+    Precompiled form of a "_conform" operation such as "le 200"
+    Calling it with a value performs the comparison
+    """
+    __slots__ = ("oper", "function", "threshold")
+
+    def __init__(self, oper: str, function, threshold: int):
+        self.oper = oper
+        self.function = function
+        self.threshold = threshold
+
+    def __call__(self, value) -> bool:
+        return self.function(value, self.threshold)
+
+    def __str__(self) -> str:
+        return f"{self.oper} {self.threshold}"
+
+    def __repr__(self) -> str:
+        return f"Predicate({self})"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Predicate) and (self.oper, self.threshold) == (other.oper, other.threshold)
+
+    def __hash__(self) -> int:
+        return hash((self.oper, self.threshold))
+
+def compile_predicate(oper: str) -> Predicate:
     """
-    oper_list = oper.split(" ")
+    Parses the condition defined in 'oper' once, returning a Predicate to evaluate against values
+    """
+    oper_list = str(oper).split(" ")
     
     # Check the operation structure
     if len(oper_list) != 2:
@@ -29,8 +56,16 @@ def compare_values(value:int, oper:str) -> bool:
     except ValueError:
         raise ValueError(f"Failed to convert the second item in the operation to an integer. Malformed operation {oper}")
 
-    # Perform the actual comparison
-    return comparison_func(value, real_int)
+    return Predicate(oper_list[0], comparison_func, real_int)
+
+def compare_values(value:int, oper) -> bool:
+    """
+    Compares the given value against the condition defined in 'oper'.
+    'oper' may be a "le 200" style string or an already compiled Predicate
+    """
+    if not isinstance(oper, Predicate):
+        oper = compile_predicate(oper)
+    return oper(value)
 
 
 def split_load(loadstr):
@@ -0,0 +1,136 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from contextlib import closing
+from typing import Dict, List, Optional
+
+#The history database is shared with every easypy task process through the environment
+HISTORY_DB_ENV = "HAPPY_CIRCUITS_HISTORY_DB"
+
+#Measurements waiting to be written by flush, as (timestamp, device, circuit, target, metric, value)
+_pending = []
+_pending_lock = threading.Lock()
+
+
+def configure_history(path: Optional[str]) -> None:
+    """
+    Sets the history database for this process and every task process started after it, None turns history off
+    """
+    if path:
+        os.environ[HISTORY_DB_ENV] = path
+    else:
+        os.environ.pop(HISTORY_DB_ENV, None)
+
+def history_path() -> Optional[str]:
+    return os.environ.get(HISTORY_DB_ENV)
+
+def _connect(path: str) -> sqlite3.Connection:
+    #Each series (device, circuit, target, metric) gets a small integer id, its points are stored clustered by
+    #series then time, so a circuit's history is one contiguous range and time ranges are index range scans
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS series (id INTEGER PRIMARY KEY, device TEXT, circuit TEXT, target TEXT, metric TEXT, "
+                       "UNIQUE (device, circuit, target, metric))")
+    connection.execute("CREATE INDEX IF NOT EXISTS series_metric ON series (metric, device, circuit)")
+    connection.execute("CREATE TABLE IF NOT EXISTS points (series INTEGER, timestamp REAL, value REAL, "
+                       "PRIMARY KEY (series, timestamp)) WITHOUT ROWID")
+    return connection
+
+def record(device: str, circuit: str, target: str, metric: str, value) -> None:
+    """
+    Queues a measured value for the history, values that aren't numbers are ignored
+    target is the interface for interface and ICMP values, or the neighbor for BGP values
+    """
+    if not history_path() or value is None:
+        return
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return
+    with _pending_lock:
+        _pending.append((time.time(), device, circuit, target, metric, value))
+
+def flush() -> int:
+    """
+    Appends every queued measurement to the history in one transaction, returns how many were written
+    """
+    with _pending_lock:
+        measurements = list(_pending)
+        _pending.clear()
+    if not measurements or not history_path():
+        return 0
+    with closing(_connect(history_path())) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            series_ids = dict()
+            for key in {measurement[1:5] for measurement in measurements}:
+                connection.execute("INSERT OR IGNORE INTO series (device, circuit, target, metric) VALUES (?, ?, ?, ?)", key)
+                series_ids[key] = connection.execute("SELECT id FROM series WHERE device = ? AND circuit = ? AND target = ? AND metric = ?",
+                                                     key).fetchone()[0]
+            connection.executemany("INSERT OR IGNORE INTO points VALUES (?, ?, ?)",
+                                   [(series_ids[measurement[1:5]], measurement[0], measurement[5]) for measurement in measurements])
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+    return len(measurements)
+
+def series_points(path: str, metric: str, since: float, until: float = None, device: str = None, circuit: str = None) -> Dict:
+    """
+    Returns the points of every matching series in the time range, keyed by (device, circuit, target)
+    """
+    query = ("SELECT series.device, series.circuit, series.target, points.timestamp, points.value FROM series "
+             "JOIN points ON points.series = series.id WHERE series.metric = ? AND points.timestamp >= ? AND points.timestamp < ?")
+    arguments = [metric, since, until or time.time() + 1]
+    for column, value in (("device", device), ("circuit", circuit)):
+        if value:
+            query += f" AND series.{column} = ?"
+            arguments.append(value)
+    points = dict()
+    with closing(_connect(path)) as connection:
+        for series_device, series_circuit, target, timestamp, value in connection.execute(query + " ORDER BY series.id, points.timestamp", arguments):
+            points.setdefault((series_device, series_circuit, target), []).append((timestamp, value))
+    return points
+
+def percentile(values: List, percent: float) -> float:
+    """
+    Nearest rank percentile of already sorted values
+    """
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+def percentiles(path: str, metric: str, since: float, until: float = None, device: str = None, circuit: str = None,
+                percents: tuple = (50, 95, 99)) -> Dict:
+    """
+    Returns the sample count and each percentile of the metric per (device, circuit, target)
+    """
+    summary = dict()
+    for key, rows in series_points(path, metric, since, until, device, circuit).items():
+        values = sorted(value for _, value in rows)
+        summary[key] = dict(count=len(values), **{f"p{percent}": percentile(values, percent) for percent in percents})
+    return summary
+
+def trend(path: str, metric: str, window: float, now: float = None, device: str = None, circuit: str = None,
+          min_change_percent: float = 0.0) -> List:
+    """
+    Compares the average of the metric over the last window with the window before it, per (device, circuit, target)
+    Returns (key, previous average, current average, change percent) for every series that rose by at least min_change_percent,
+    or fell by at least that much when it is negative, biggest change first
+    """
+    now = now or time.time()
+    changes = []
+    for key, rows in series_points(path, metric, now - 2 * window, now, device, circuit).items():
+        previous = [value for timestamp, value in rows if timestamp < now - window]
+        current = [value for timestamp, value in rows if timestamp >= now - window]
+        if not previous or not current:
+            continue
+        previous_average = sum(previous) / len(previous)
+        current_average = sum(current) / len(current)
+        if previous_average == 0:
+            continue
+        change = (current_average - previous_average) / abs(previous_average) * 100
+        if (min_change_percent >= 0 and change >= min_change_percent) or (min_change_percent < 0 and change <= min_change_percent):
+            changes.append((key, previous_average, current_average, change))
+    return sorted(changes, key=lambda change: abs(change[3]), reverse=True)
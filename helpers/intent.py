@@ -0,0 +1,415 @@
+import glob
+import hashlib
+import ipaddress
+import os
+import pickle
+import sys
+
+from dataclasses import MISSING, dataclass, field, fields
+from typing import Dict, List, Optional
+from helpers.helpers import Predicate, compile_predicate
+
+INTENT_SUFFIXES = (".yml", ".yaml")
+
+#Intent records are created once per circuit and read many times, keep them compact where the interpreter allows
+record = dataclass(slots=True) if sys.version_info >= (3, 10) else dataclass
+
+
+class IntentError(ValueError):
+    """
+    Raised when the intent file does not match the expected schema
+    Holds every problem found so they can all be fixed in one go
+    """
+    def __init__(self, errors: List):
+        self.errors = errors
+        super().__init__("Invalid intent file:\n  " + "\n  ".join(errors))
+
+    def __reduce__(self):
+        return (IntentError, (self.errors,))
+
+
+@record
+class InterfaceIntent:
+    test_interface: bool = False
+    ipv4: Optional[str] = None
+    in_errors_conform: Optional[Predicate] = None
+    in_crc_errors_conform: Optional[Predicate] = None
+    out_errors_conform: Optional[Predicate] = None
+    out_collision_conform: Optional[Predicate] = None
+    txload_conform: Optional[Predicate] = None
+    rxload_conform: Optional[Predicate] = None
+    duplex: Optional[str] = None
+    line_protocol: Optional[str] = None
+    enabled: Optional[bool] = None
+    counter_mode: str = "absolute"
+    counter_rate: str = "per_million_packets"
+
+@record
+class IcmpIntent:
+    test_icmp: bool = False
+    pingable_address: Optional[str] = None
+    ping_count: int = 5
+    probe_mode: str = "fixed"
+    batch_size: int = 10
+    confidence: int = 95
+    success_rate_percent_conform: Optional[Predicate] = None
+    max_ms_conform: Optional[Predicate] = None
+    jitter_conform: Optional[Predicate] = None
+    vrf: Optional[str] = None
+
+@record
+class AddressFamilyIntent:
+    address_family: str = "ipv4 unicast"
+    route_match: str = "exact"
+    received_routes: List = field(default_factory=list)
+    advertised_routes: List = field(default_factory=list)
+
+@record
+class NeighborIntent:
+    neighbor_ip: str = None
+    uptime_conform: Optional[Predicate] = None
+    route_lookup: str = "auto"
+    address_families: List = field(default_factory=list)
+
+@record
+class BgpIntent:
+    test_bgp: bool = False
+    vrf: Optional[str] = None
+    neighbors: List = field(default_factory=list)
+
+@record
+class TestsIntent:
+    interface: InterfaceIntent = field(default_factory=InterfaceIntent)
+    icmp: IcmpIntent = field(default_factory=IcmpIntent)
+    bgp: BgpIntent = field(default_factory=BgpIntent)
+
+@record
+class CircuitIntent:
+    circuit: str = None
+    interface: str = None
+    is_subinterface: bool = False
+    force_collection: bool = False
+    tests: TestsIntent = field(default_factory=TestsIntent)
+
+@record
+class DeviceIntent:
+    name: str = None
+    circuits: List = field(default_factory=list)
+    interface_collection: str = "bulk"
+    interface_bulk_max_bytes: int = 2_000_000
+    session_pool_size: int = 1
+    collection_backend: str = "cli"
+    icmp_probe_backend: str = "ping"
+    ip_sla_operation: str = "icmp-jitter"
+    ip_sla_port: int = 16384
+    device_budget_seconds: Optional[int] = None
+    command_timeout_seconds: Optional[int] = None
+
+@record
+class Intent:
+    devices: Dict = field(default_factory=dict)
+
+
+def _is_bool(value) -> bool:
+    return isinstance(value, bool)
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _is_positive_int(value) -> bool:
+    return _is_int(value) and value > 0
+
+def _is_port(value) -> bool:
+    return _is_int(value) and 0 < value < 65536
+
+def _is_confidence(value) -> bool:
+    return _is_int(value) and 50 <= value < 100
+
+def _is_str(value) -> bool:
+    return isinstance(value, str)
+
+def _is_address(value) -> bool:
+    ipaddress.ip_address(value)
+    return True
+
+def _is_prefix(value) -> bool:
+    ipaddress.ip_network(value, strict=False)
+    return True
+
+def _is_interface_address(value) -> bool:
+    ipaddress.ip_interface(value)
+    return "/" in value
+
+def _choice(*choices):
+    return lambda value: value in choices
+
+#Schema for every section, field name -> check. Predicates are compiled rather than checked
+PREDICATE = "predicate"
+INTERFACE_SCHEMA = {
+    'test_interface': _is_bool, 'ipv4': _is_interface_address,
+    'in_errors_conform': PREDICATE, 'in_crc_errors_conform': PREDICATE, 'out_errors_conform': PREDICATE,
+    'out_collision_conform': PREDICATE, 'txload_conform': PREDICATE, 'rxload_conform': PREDICATE,
+    'duplex': _choice("Full", "Half", "full", "half"), 'line_protocol': _choice("up", "down", "Up", "Down"), 'enabled': _is_bool,
+    'counter_mode': _choice("absolute", "delta"), 'counter_rate': _choice("per_second", "per_million_packets"),
+}
+ICMP_SCHEMA = {
+    'test_icmp': _is_bool, 'pingable_address': _is_address, 'ping_count': _is_positive_int,
+    'probe_mode': _choice("fixed", "adaptive"), 'batch_size': _is_positive_int, 'confidence': _is_confidence,
+    'success_rate_percent_conform': PREDICATE, 'max_ms_conform': PREDICATE, 'jitter_conform': PREDICATE, 'vrf': _is_str,
+}
+ADDRESS_FAMILY_SCHEMA = {
+    'address_family': _choice("ipv4 unicast", "vpnv4 unicast"), 'route_match': _choice("exact", "covered"),
+    'received_routes': [_is_prefix], 'advertised_routes': [_is_prefix],
+}
+NEIGHBOR_SCHEMA = {
+    'neighbor_ip': _is_address, 'uptime_conform': PREDICATE, 'route_lookup': _choice("auto", "targeted", "full"),
+    'address_families': [ADDRESS_FAMILY_SCHEMA],
+}
+BGP_SCHEMA = {'test_bgp': _is_bool, 'vrf': _is_str, 'neighbors': [NEIGHBOR_SCHEMA]}
+TESTS_SCHEMA = {'interface': INTERFACE_SCHEMA, 'icmp': ICMP_SCHEMA, 'bgp': BGP_SCHEMA}
+CIRCUIT_SCHEMA = {'circuit': _is_str, 'interface': _is_str, 'is_subinterface': _is_bool, 'force_collection': _is_bool, 'tests': TESTS_SCHEMA}
+DEVICE_SCHEMA = {
+    'circuits': [CIRCUIT_SCHEMA], 'interface_collection': _choice("bulk", "per_interface"),
+    'interface_bulk_max_bytes': _is_positive_int, 'session_pool_size': _is_positive_int,
+    'collection_backend': _choice("cli", "restconf", "netconf"), 'icmp_probe_backend': _choice("ping", "ip_sla"),
+    'ip_sla_operation': _choice("icmp-jitter", "udp-jitter"), 'ip_sla_port': _is_port,
+    'device_budget_seconds': _is_positive_int, 'command_timeout_seconds': _is_positive_int,
+}
+
+#Record built from each section schema, and the keys that must be present
+RECORDS = {
+    id(INTERFACE_SCHEMA): (InterfaceIntent, ()),
+    id(ICMP_SCHEMA): (IcmpIntent, ()),
+    id(ADDRESS_FAMILY_SCHEMA): (AddressFamilyIntent, ()),
+    id(NEIGHBOR_SCHEMA): (NeighborIntent, ('neighbor_ip',)),
+    id(BGP_SCHEMA): (BgpIntent, ()),
+    id(TESTS_SCHEMA): (TestsIntent, ()),
+    id(CIRCUIT_SCHEMA): (CircuitIntent, ('circuit', 'interface')),
+    id(DEVICE_SCHEMA): (DeviceIntent, ('circuits',)),
+}
+
+
+def _schema_signature(check) -> str:
+    """
+    Stable description of a schema entry, checks are described by their name and the choices they close over
+    """
+    if isinstance(check, dict):
+        return "{" + ",".join(f"{key}:{_schema_signature(value)}" for key, value in check.items()) + "}"
+    if isinstance(check, list):
+        return "[" + ",".join(_schema_signature(value) for value in check) + "]"
+    if callable(check):
+        return f"{check.__qualname__}{tuple(cell.cell_contents for cell in check.__closure__ or ())!r}"
+    return repr(check)
+
+def _record_signature(record_class: type) -> str:
+    """
+    Stable description of a record, the name, type and default of every field
+    """
+    described = []
+    for record_field in fields(record_class):
+        default = repr(record_field.default) if record_field.default is not MISSING else ""
+        factory = getattr(record_field.default_factory, '__qualname__', "") if record_field.default_factory is not MISSING else ""
+        described.append(f"{record_field.name}:{record_field.type}={default}{factory}")
+    return f"{record_class.__qualname__}({','.join(described)})"
+
+#Compiled intent caches are only reused while the records, predicates and schemas they were built with are unchanged
+INTENT_CACHE_KEY = hashlib.sha1("\n".join(
+    [_schema_signature(DEVICE_SCHEMA), f"Predicate{Predicate.__slots__}"] +
+    [_record_signature(record_class) for record_class, _ in RECORDS.values()]).encode()).hexdigest()
+
+
+def _compile_value(check, value, path: str, errors: List):
+    """
+    Validates a single value against its schema entry, returning the compiled value
+    """
+    if check == PREDICATE:
+        try:
+            return compile_predicate(value)
+        except ValueError as e:
+            errors.append(f"{path}: {e}")
+            return None
+    if isinstance(check, dict):
+        return _compile_section(check, value, path, errors)
+    if isinstance(check, list):
+        if not isinstance(value, list):
+            errors.append(f"{path}: expected a list, found {value!r}")
+            return []
+        return [_compile_value(check[0], item, f"{path}[{index}]", errors) for index, item in enumerate(value)]
+    try:
+        valid = check(value)
+    except (ValueError, TypeError):
+        valid = False
+    if not valid:
+        errors.append(f"{path}: invalid value {value!r}")
+    return value
+
+def _compile_section(schema: Dict, values, path: str, errors: List):
+    """
+    Validates a mapping against its schema and builds the matching record
+    null values are left at the record default, which means the specific test is skipped
+    """
+    record_cls, required = RECORDS[id(schema)]
+    if not isinstance(values, dict):
+        errors.append(f"{path}: expected a mapping, found {values!r}")
+        return record_cls()
+    for key in values:
+        if key not in schema:
+            errors.append(f"{path}.{key}: unknown key")
+    for key in required:
+        if values.get(key) is None:
+            errors.append(f"{path}.{key}: required key is missing")
+    compiled = {key: _compile_value(schema[key], value, f"{path}.{key}", errors)
+                for key, value in values.items() if key in schema and value is not None}
+    return record_cls(**compiled)
+
+def compile_device(device_name: str, device_values: Dict) -> DeviceIntent:
+    """
+    Validates and compiles the intent of a single device
+    Raises IntentError listing every problem found
+    """
+    errors = []
+    device = _compile_section(DEVICE_SCHEMA, device_values, f"config.devices.{device_name}", errors)
+    device.name = device_name
+    for index, circuit in enumerate(device.circuits):
+        path = f"config.devices.{device_name}.circuits[{index}].tests"
+        if circuit.tests.icmp.test_icmp and not circuit.tests.icmp.pingable_address:
+            errors.append(f"{path}.icmp.pingable_address: required when test_icmp is True")
+    if errors:
+        raise IntentError(errors)
+    return device
+
+def compile_devices(intent_file: Dict) -> Dict:
+    """
+    Compiles every device of an intent file, keyed by device name
+    Devices that fail validation map to their IntentError so callers can decide whether they matter
+    """
+    devices = intent_file.get("config", {}).get("devices") if isinstance(intent_file, dict) else None
+    if not isinstance(devices, dict):
+        raise IntentError(["config.devices: expected a mapping of device hostnames"])
+    compiled = dict()
+    for device_name, device_values in devices.items():
+        try:
+            compiled[device_name] = compile_device(device_name, device_values)
+        except IntentError as e:
+            compiled[device_name] = e
+    return compiled
+
+def compile_intent(intent_file: Dict) -> Intent:
+    """
+    Validates the whole intent file and compiles it into Intent records with precompiled predicates
+    Raises IntentError listing every problem found
+    """
+    compiled = compile_devices(intent_file)
+    errors = [error for device in compiled.values() if isinstance(device, IntentError) for error in device.errors]
+    if errors:
+        raise IntentError(errors)
+    return Intent(devices=compiled)
+
+
+def load_yaml(file_: str) -> Dict:
+    """
+    Returns json format of provided yaml file, raises IntentError when it isn't valid yaml
+    yaml is imported here, task processes only need the intent records and never load it
+    """
+    import yaml
+    #The C loader is several times faster on large intent files, fall back to pure python when libyaml is missing
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with open(file_, "r") as f:
+        try:
+            return yaml.load(f, Loader=loader)
+        except yaml.YAMLError as e:
+            raise IntentError([f"not valid yaml - {e}"])
+
+def _cache_file(cache_dir: str, file_: str) -> str:
+    return os.path.join(cache_dir, hashlib.sha1(os.path.abspath(file_).encode()).hexdigest() + ".pickle")
+
+def load_intent_fragment(file_: str, cache_dir: str = None) -> Dict:
+    """
+    Loads and compiles a single intent file, returning compile_devices output
+    When cache_dir is set the compiled result is stored there and reused until the file's mtime or size, or INTENT_CACHE_KEY, changes
+    """
+    try:
+        stat = os.stat(file_)
+    except OSError as e:
+        raise IntentError([f"unable to read the intent - {e.strerror}"])
+    stamp = (INTENT_CACHE_KEY, stat.st_mtime_ns, stat.st_size)
+    if cache_dir:
+        try:
+            with open(_cache_file(cache_dir, file_), "rb") as f:
+                cached_stamp, cached_devices = pickle.load(f)
+            if cached_stamp == stamp:
+                return cached_devices
+        except (OSError, EOFError, ValueError, AttributeError, pickle.UnpicklingError):
+            pass
+
+    try:
+        devices = compile_devices(load_yaml(file_))
+    except OSError as e:
+        raise IntentError([f"unable to read the intent - {e.strerror}"])
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        #Write then rename so a concurrent run never reads a half written cache
+        temp_file = f"{_cache_file(cache_dir, file_)}.{os.getpid()}"
+        with open(temp_file, "wb") as f:
+            pickle.dump((stamp, devices), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, _cache_file(cache_dir, file_))
+    return devices
+
+def load_intent(path: str, device_names: List, cache_dir: str = None) -> Intent:
+    """
+    Loads the intent for the given devices from a single file or a directory of fragments
+    Only problems in the intent of the given devices are raised
+    In a directory, <device>.yml files (at any depth) are loaded for the given devices first. The other
+    fragments, such as per site files, are only read while some device is still missing, so when every
+    device has its own file nothing outside the testbed is parsed. Two <device>.yml files for the same device are an error
+    """
+    if not os.path.exists(path):
+        raise IntentError([f"{path}: no such intent file or directory"])
+    if os.path.isdir(path):
+        fragments = sorted(file_ for file_ in glob.glob(os.path.join(path, "**", "*"), recursive=True)
+                           if file_.endswith(INTENT_SUFFIXES) and os.path.isfile(file_))
+    else:
+        fragments = [path]
+    wanted = set(device_names)
+    intent = Intent()
+    errors = []
+    by_device = dict()
+    for file_ in fragments:
+        name = os.path.splitext(os.path.basename(file_))[0]
+        if name in by_device and name in wanted:
+            errors.append(f"{file_}: config.devices.{name}: device file is already found at {by_device[name]}")
+        by_device.setdefault(name, file_)
+    if errors:
+        raise IntentError(errors)
+    loaded = set()
+    found = set()
+
+    def merge(file_: str) -> None:
+        loaded.add(file_)
+        try:
+            fragment = load_intent_fragment(file_, cache_dir=cache_dir)
+        except IntentError as e:
+            errors.extend(f"{file_}: {error}" for error in e.errors)
+            return
+        for device_name, device in fragment.items():
+            if device_name not in wanted:
+                continue
+            if isinstance(device, IntentError):
+                errors.extend(f"{file_}: {error}" for error in device.errors)
+            elif device_name in found:
+                errors.append(f"{file_}: config.devices.{device_name}: device is already defined in another fragment")
+            else:
+                intent.devices[device_name] = device
+            found.add(device_name)
+
+    for device_name in device_names:
+        if device_name in by_device:
+            merge(by_device[device_name])
+    for file_ in fragments:
+        if wanted.issubset(found):
+            break
+        if file_ not in loaded:
+            merge(file_)
+    if errors:
+        raise IntentError(errors)
+    return intent
@@ -0,0 +1,128 @@
+import logging
+import re
+import time
+
+from typing import Dict, List
+from helpers import cli
+
+#Operation ids used for the temporary probes, picked high to stay clear of operator configured SLAs
+IP_SLA_BASE_ID = 61000
+#Ids from IP_SLA_BASE_ID up the probes may take, any id already configured on the device is skipped
+IP_SLA_ID_RANGE = 4000
+#Gap between packets of a jitter operation, in milliseconds
+IP_SLA_INTERVAL_MS = 20
+#How often to re-read the statistics while waiting for the probes to finish, in seconds
+IP_SLA_POLL_SECONDS = 5
+#Extra time allowed on top of the expected probe duration before we give up on a probe, in seconds
+IP_SLA_GRACE_SECONDS = 30
+
+operation_regex = re.compile(r"IPSLA operation id:\s*(?P<id>\d+)")
+rtt_regex = re.compile(r"Number Of RTT:\s*(?P<count>\d+)\s+RTT Min/Avg/Max:\s*(?P<min>\d+)/(?P<avg>\d+)/(?P<max>\d+)")
+jitter_regex = re.compile(r"(?P<direction>Source to Destination|Destination to Source) Jitter Min/Avg/Max:\s*(?P<min>\d+)/(?P<avg>\d+)/(?P<max>\d+)")
+loss_regex = re.compile(r"Loss (?P<direction>Source to Destination|Destination to Source):\s*(?P<loss>\d+)")
+return_code_regex = re.compile(r"Latest operation return code:\s*(?P<code>\S+)")
+configured_id_regex = re.compile(r"^ip sla (?P<id>\d+)\s*$", re.M)
+
+
+def build_ip_sla_config(probes: Dict, operation: str = "icmp-jitter", port: int = 16384) -> List:
+    """
+    Returns the configuration lines for every probe, probes is keyed by operation id
+    Each probe needs pingable_address, source_ip, ping_count and optionally vrf
+    """
+    config = []
+    for sla_id, probe in probes.items():
+        if operation == "udp-jitter":
+            config.append(f"ip sla {sla_id}")
+            config.append(f" udp-jitter {probe['pingable_address']} {port} source-ip {probe['source_ip']} num-packets {probe['ping_count']} interval {IP_SLA_INTERVAL_MS}")
+        elif operation == "icmp-jitter":
+            config.append(f"ip sla {sla_id}")
+            config.append(f" icmp-jitter {probe['pingable_address']} source-ip {probe['source_ip']} num-packets {probe['ping_count']} interval {IP_SLA_INTERVAL_MS}")
+        else:
+            raise ValueError(f"Unsupported ip sla operation {operation}")
+        if probe.get('vrf'):
+            config.append(f"  vrf {probe['vrf']}")
+        config.append(f"ip sla schedule {sla_id} life {probe_duration(probe) + IP_SLA_GRACE_SECONDS} start-time now")
+    return config
+
+def probe_duration(probe: Dict) -> int:
+    """
+    Rough number of seconds a single probe takes to send all its packets
+    """
+    return int(probe['ping_count'] * IP_SLA_INTERVAL_MS / 1000) + 1
+
+def parse_ip_sla_statistics(raw_output: str) -> Dict:
+    """
+    Parses show ip sla statistics into the same shape as the ping api results, keyed by operation id
+    Jitter and per direction loss are added under ping.statistics when the operation reports them
+    Jitter min_ms and max_ms cover both directions, the average is kept per direction
+    """
+    results = dict()
+    #Each operation starts with its id line, split the output into one block per operation
+    blocks = operation_regex.split(raw_output)[1:]
+    for sla_id, block in zip(blocks[0::2], blocks[1::2]):
+        statistics = {'return_code': None}
+        return_code = return_code_regex.search(block)
+        if return_code:
+            statistics['return_code'] = return_code.group('code')
+        rtt = rtt_regex.search(block)
+        if rtt:
+            statistics['received'] = int(rtt.group('count'))
+            statistics['round_trip'] = {'min_ms': int(rtt.group('min')), 'avg_ms': int(rtt.group('avg')), 'max_ms': int(rtt.group('max'))}
+        jitter = {match.group('direction'): match for match in jitter_regex.finditer(block)}
+        if jitter:
+            statistics['jitter'] = {
+                'min_ms': min(int(match.group('min')) for match in jitter.values()),
+                'max_ms': max(int(match.group('max')) for match in jitter.values()),
+            }
+            for direction, match in jitter.items():
+                statistics['jitter'][f"{direction.lower().replace(' ', '_')}_avg_ms"] = int(match.group('avg'))
+        losses = [int(match.group('loss')) for match in loss_regex.finditer(block)]
+        if losses:
+            statistics['lost'] = sum(losses)
+        results[int(sla_id)] = {'ping': {'statistics': statistics}}
+    return results
+
+def free_ip_sla_ids(device: object, count: int) -> List:
+    """
+    Returns the lowest count operation ids from IP_SLA_BASE_ID that nothing on the device is configured with
+    Probes of another job or monitor running against the device, or left behind by a run that never cleaned up, keep their ids
+    """
+    in_use = {int(match.group('id')) for match in configured_id_regex.finditer(cli.execute(device, "show running-config | include ^ip sla [0-9]"))}
+    free = [sla_id for sla_id in range(IP_SLA_BASE_ID, IP_SLA_BASE_ID + IP_SLA_ID_RANGE) if sla_id not in in_use][:count]
+    if len(free) < count:
+        raise ValueError(f"Only {len(free)} of the {count} ip sla ids needed are free on {device.name}")
+    return free
+
+def start_ip_sla_probes(device: object, probes: Dict, operation: str = "icmp-jitter", port: int = 16384) -> None:
+    """
+    Configures and schedules every probe at once, they then run in parallel on the device
+    """
+    logging.info(f"Starting {len(probes)} ip sla {operation} probes on {device.name}")
+    cli.configure(device, build_ip_sla_config(probes=probes, operation=operation, port=port))
+
+def collect_ip_sla_probes(device: object, probes: Dict) -> Dict:
+    """
+    Waits for the probes to finish and returns their results keyed by operation id
+    Probes still running when the longest probe plus the grace period has passed are returned as they are
+    """
+    deadline = time.monotonic() + max(probe_duration(probe) for probe in probes.values()) + IP_SLA_GRACE_SECONDS
+    while True:
+        results = parse_ip_sla_statistics(cli.execute(device, "show ip sla statistics"))
+        #The return code stays Unknown until the operation has sent all of its packets
+        finished = [sla_id for sla_id in probes if results.get(sla_id, {}).get('ping', {}).get('statistics', {}).get('return_code') not in (None, "Unknown")]
+        if len(finished) == len(probes) or time.monotonic() > deadline:
+            break
+        time.sleep(IP_SLA_POLL_SECONDS)
+
+    for sla_id, probe in probes.items():
+        statistics = results.setdefault(sla_id, {'ping': {'statistics': {}}})['ping']['statistics']
+        received = statistics.get('received', 0)
+        statistics['send'] = probe['ping_count']
+        statistics['success_rate_percent'] = round(received / probe['ping_count'] * 100, 1) if probe['ping_count'] else 0
+    return results
+
+def remove_ip_sla_probes(device: object, probes: Dict) -> None:
+    """
+    Removes the temporary probe configuration from the device
+    """
+    cli.configure(device, [f"no ip sla {sla_id}" for sla_id in probes])
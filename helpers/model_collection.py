@@ -0,0 +1,227 @@
+import base64
+import json
+import re
+import time
+
+from typing import Dict, Optional
+from helpers import budget, snapshot, timing
+
+#cli - scrape and parse show commands, restconf/netconf - fetch the operational models of every circuit in one request
+COLLECTION_BACKENDS = ("cli", "restconf", "netconf")
+#Used when the testbed has no restconf/netconf connection for the device
+DEFAULT_PORTS = {'restconf': 443, 'netconf': 830}
+#Used when neither the intent nor the budget limits the request
+DEFAULT_TIMEOUT = 60
+
+#Operational data fetched per device, as a RESTCONF data path and a NETCONF subtree filter
+#IOS-XE interfaces-oper carries the ietf-interfaces statistics along with CRC errors, rates and duplex, which ietf-interfaces lacks
+MODELS = {
+    'interfaces': {
+        'restconf': "Cisco-IOS-XE-interfaces-oper:interfaces",
+        'netconf': '<interfaces xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-interfaces-oper"/>',
+        'container': ("interfaces",),
+    },
+    'bgp_neighbors': {
+        'restconf': "Cisco-IOS-XE-bgp-oper:bgp-state-data/neighbors",
+        'netconf': '<bgp-state-data xmlns="http://cisco.com/ns/yang/Cisco-IOS-XE-bgp-oper"><neighbors/></bgp-state-data>',
+        'container': ("bgp-state-data", "neighbors"),
+    },
+}
+#YANG lists in the models above, kept as lists even when NETCONF returns a single entry
+LIST_NODES = ("interface", "neighbor")
+
+AFI_SAFI_NAMES = {"ipv4-unicast": "ipv4 unicast", "vpnv4-unicast": "vpnv4 unicast"}
+DUPLEX_NAMES = {"full-duplex": "full", "half-duplex": "half", "auto-duplex": "auto"}
+
+#BGP up-time as IOS prints it, ex. 00:12:34, 3d04h, 2w1d, 1y2w
+clock_regex = re.compile(r"^(?P<h>\d+):(?P<m>\d+):(?P<s>\d+)$")
+uptime_regex = re.compile(r"(?P<value>\d+)(?P<unit>[ywdhms])")
+UPTIME_UNITS_MS = {'y': 31_536_000_000, 'w': 604_800_000, 'd': 86_400_000, 'h': 3_600_000, 'm': 60_000, 's': 1000}
+
+
+class ModelCollectionError(RuntimeError):
+    """
+    Raised when the device did not answer a RESTCONF or NETCONF request with usable data
+    """
+
+
+def _connection(device: object, backend: str) -> Dict:
+    """
+    Host, port and credentials of the restconf/netconf connection in the testbed,
+    falling back to the address of the CLI connection and the default credentials
+    """
+    connections = getattr(device, 'connections', None) or {}
+    connection = dict(connections.get(backend) or {})
+    if not connection.get('ip'):
+        for other in connections.values():
+            if isinstance(other, dict) and other.get('ip'):
+                connection['ip'] = other['ip']
+                break
+    if not connection.get('ip'):
+        raise ModelCollectionError(f"No address for {backend} found in the testbed connections of {device.name}")
+    credentials = getattr(device.credentials, backend, None) or device.credentials.default
+    password = credentials.password
+    return {'host': str(connection['ip']), 'port': int(connection.get('port') or DEFAULT_PORTS[backend]),
+            'protocol': connection.get('protocol', "https"), 'verify': connection.get('verify', True),
+            'username': credentials.username, 'password': getattr(password, 'plaintext', password)}
+
+#urllib, ssl and ElementTree are only imported once a device uses restconf or netconf, most runs never need them
+def restconf_get(device: object, path: str, timeout: int) -> Dict:
+    import ssl
+    import urllib.request
+    connection = _connection(device, "restconf")
+    request = urllib.request.Request(f"{connection['protocol']}://{connection['host']}:{connection['port']}/restconf/data/{path}",
+                                     headers={'Accept': "application/yang-data+json"})
+    if connection['username']:
+        token = base64.b64encode(f"{connection['username']}:{connection['password']}".encode()).decode()
+        request.add_header('Authorization', f"Basic {token}")
+    context = None
+    if connection['protocol'] == "https" and not connection['verify']:
+        context = ssl._create_unverified_context()
+    with urllib.request.urlopen(request, timeout=timeout, context=context) as response:
+        body = response.read()
+    #RESTCONF answers with the requested container under its module qualified name
+    return next(iter(json.loads(body).values()), {}) if body else {}
+
+def _xml_to_dict(element: object):
+    children = list(element)
+    if not children:
+        return element.text
+    values = dict()
+    for child in children:
+        tag = child.tag.rpartition("}")[2]
+        if tag in LIST_NODES:
+            values.setdefault(tag, []).append(_xml_to_dict(child))
+        else:
+            values[tag] = _xml_to_dict(child)
+    return values
+
+def netconf_get(device: object, subtree: str, container: tuple, timeout: int) -> Dict:
+    try:
+        from ncclient import manager
+    except ImportError:
+        raise ModelCollectionError("collection_backend netconf needs the ncclient package, pip install ncclient")
+    import xml.etree.ElementTree as ElementTree
+    connection = _connection(device, "netconf")
+    with manager.connect(host=connection['host'], port=connection['port'], username=connection['username'],
+                         password=connection['password'], hostkey_verify=False, timeout=timeout) as session:
+        reply = session.get(filter=("subtree", subtree))
+    data = _xml_to_dict(ElementTree.fromstring(reply.data_xml)) or {}
+    for tag in container:
+        data = data.get(tag) or {}
+    return data
+
+def fetch(device: object, backend: str, model: str) -> Dict:
+    """
+    Fetches one operational model from the device, timed and stored like a show command so snapshots cover it
+    """
+    command = f"{backend} get {MODELS[model]['restconf']}"
+    with timing.measure(device.name, command, stage="model") as entry:
+        budget.check(device.name, command)
+        timeout = budget.command_timeout(device.name) or DEFAULT_TIMEOUT
+
+        def collect() -> str:
+            if backend == "restconf":
+                return json.dumps(restconf_get(device, MODELS[model]['restconf'], timeout))
+            return json.dumps(netconf_get(device, MODELS[model]['netconf'], MODELS[model]['container'], timeout))
+
+        output = snapshot.cached(device.name, command, collect)
+        entry['bytes'] = len(output)
+        entry['parser'] = backend
+        parse_started = time.perf_counter()
+        data = json.loads(output)
+        entry['parse_s'] = time.perf_counter() - parse_started
+    return data
+
+def _int(value) -> Optional[int]:
+    #RFC 7951 encodes 64 bit counters as strings, NETCONF everything
+    return int(value) if value is not None else None
+
+def uptime_ms(value) -> Optional[int]:
+    """
+    Converts an IOS style up-time, ex. "3d04h" or "00:12:34", to milliseconds, None when it isn't one
+    """
+    if value is None or str(value).lower() in ("", "never"):
+        return None
+    value = str(value)
+    clock = clock_regex.match(value)
+    if clock:
+        return (int(clock.group('h')) * 3600 + int(clock.group('m')) * 60 + int(clock.group('s'))) * 1000
+    parts = uptime_regex.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+    return sum(int(number) * UPTIME_UNITS_MS[unit] for number, unit in parts)
+
+def _load(rate_kbps, speed_bps) -> Optional[str]:
+    """
+    Rate as a fraction of 255 of the interface speed, the way IOS reports txload and rxload
+    """
+    if rate_kbps is None or not speed_bps:
+        return None
+    return f"{min(255, max(1, round(int(rate_kbps) * 1000 * 255 / int(speed_bps))))}/255"
+
+def map_interfaces(data: Dict) -> Dict:
+    """
+    Maps Cisco-IOS-XE-interfaces-oper interfaces into the parsed show interfaces shape the tests read
+    """
+    interfaces = dict()
+    for interface in data.get('interface', []):
+        statistics = interface.get('statistics') or {}
+        dot3 = ((interface.get('ether-stats') or {}).get('dot3-counters') or {}).get('dot3-stats') or {}
+        details = interfaces[interface['name']] = {
+            'enabled': interface.get('admin-status') == "if-state-up",
+            'line_protocol': "up" if interface.get('oper-status') == "if-oper-state-ready" else "down",
+        }
+        details['oper_status'] = details['line_protocol'] if details['enabled'] else "down"
+        address, mask = interface.get('ipv4'), interface.get('ipv4-subnet-mask')
+        if address and address != "0.0.0.0" and mask:
+            prefix_length = str(sum(bin(int(octet)).count("1") for octet in mask.split(".")))
+            details['ipv4'] = {f"{address}/{prefix_length}": {'ip': address, 'prefix_length': prefix_length}}
+        for key, rate in (('txload', 'tx-kbps'), ('rxload', 'rx-kbps')):
+            load = _load(statistics.get(rate), interface.get('speed'))
+            if load:
+                details[key] = load
+        duplex = (interface.get('ether-state') or {}).get('negotiated-duplex-mode')
+        if duplex in DUPLEX_NAMES:
+            details['duplex_mode'] = DUPLEX_NAMES[duplex]
+        counters = {counter: _int(statistics[leaf]) for counter, leaf in
+                    (('in_pkts', 'in-unicast-pkts'), ('out_pkts', 'out-unicast-pkts'), ('in_errors', 'in-errors'),
+                     ('in_crc_errors', 'in-crc-errors'), ('out_errors', 'out-errors')) if statistics.get(leaf) is not None}
+        collisions = [dot3[leaf] for leaf in ('dot3-single-collision-frames', 'dot3-multiple-collision-frames') if dot3.get(leaf) is not None]
+        if collisions:
+            counters['out_collision'] = sum(int(value) for value in collisions)
+        if counters:
+            details['counters'] = counters
+    return interfaces
+
+def map_bgp_neighbors(data: Dict) -> Dict:
+    """
+    Maps Cisco-IOS-XE-bgp-oper neighbors into the parsed show bgp neighbors shape, keyed by vrf then neighbor
+    The model has one entry per address family of a neighbor, they are merged into one neighbor like the CLI shows it
+    """
+    vrfs = dict()
+    for entry in data.get('neighbor', []):
+        neighbor = vrfs.setdefault(entry.get('vrf-name') or "default", {'neighbor': dict()})['neighbor'].setdefault(entry['neighbor-id'], dict())
+        uptime = uptime_ms(entry.get('up-time'))
+        if uptime is not None:
+            neighbor['bgp_session_transport'] = {'uptime': uptime}
+        prefixes = entry.get('prefix-activity') or {}
+        af_name = AFI_SAFI_NAMES.get(entry.get('afi-safi'), str(entry.get('afi-safi')).replace("-", " "))
+        af_details = neighbor.setdefault('address_family', dict())[af_name] = dict()
+        if prefixes:
+            af_details['prefix_activity_counters'] = {
+                direction: {'prefixes_current': _int((prefixes.get(direction) or {}).get('current-prefixes'))}
+                for direction in ("sent", "received")}
+    return {'vrf': vrfs}
+
+def gather_interface_index(device: object, backend: str) -> Dict:
+    """
+    Interface details of every interface on the device from one request, keyed by interface name
+    """
+    return map_interfaces(fetch(device, backend, "interfaces"))
+
+def gather_bgp_neighbors(device: object, backend: str) -> Dict:
+    """
+    Neighbor details of every peer on the device from one request, in the parsed show bgp neighbors shape
+    """
+    return map_bgp_neighbors(fetch(device, backend, "bgp_neighbors"))
@@ -0,0 +1,241 @@
+import functools
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from typing import Callable, Dict, List
+
+#Report settings are shared with every easypy task process through the environment
+REPORT_MODE_ENV = "HAPPY_CIRCUITS_REPORT_MODE"
+RESULTS_DIR_ENV = "HAPPY_CIRCUITS_RESULTS_DIR"
+
+#Worst first, a step with several results reports the worst of them like pyATS rolls up step results
+RESULT_ORDER = ("errored", "aborted", "failed", "blocked", "passx", "passed", "skipped")
+#Results written out as full nested steps in compact mode
+REPORTED_RESULTS = ("errored", "aborted", "failed", "blocked")
+
+_write_lock = threading.Lock()
+
+
+def configure_reporting(mode: str, results_dir: str = None) -> None:
+    """
+    Sets the report mode for this process and every task process started after it
+    """
+    os.environ[REPORT_MODE_ENV] = mode
+    if results_dir:
+        os.makedirs(results_dir, exist_ok=True)
+        os.environ[RESULTS_DIR_ENV] = results_dir
+
+def report_mode() -> str:
+    return os.environ.get(REPORT_MODE_ENV, "full")
+
+def results_dir() -> str:
+    return os.environ.get(RESULTS_DIR_ENV)
+
+def worst(results: List) -> str:
+    return min(results, key=RESULT_ORDER.index) if results else "passed"
+
+
+class _StepResult(Exception):
+    """
+    Ends a recorded step early, the way calling failed() or skipped() on a pyATS step does
+    """
+    def __init__(self, result: str, reason: str = None, propagated: bool = False):
+        super().__init__(reason)
+        self.result = result
+        self.reason = reason
+        #Raised on from a substep, the parent's result already rolls it up
+        self.propagated = propagated
+
+
+class RecordedStep:
+    """
+    Stands in for a pyATS step in compact mode. It has the same start/passed/failed/skipped/blocked calls,
+    but only keeps the results and the log lines of the step in memory
+    """
+    def __init__(self, recorder: "StepRecorder", name: str, continue_: bool = False):
+        self.recorder = recorder
+        self.name = name
+        self.continue_ = continue_
+        self.children = []
+        self.records = []
+        self.own_result = None
+        self.reason = None
+
+    @property
+    def result(self) -> str:
+        return worst([result for result in [self.own_result] + [child.result for child in self.children] if result])
+
+    def start(self, name: str, continue_: bool = False, **kwargs) -> "RecordedStep":
+        step = RecordedStep(self.recorder, name, continue_)
+        self.children.append(step)
+        return step
+
+    def _end(self, result: str, reason: str = None):
+        raise _StepResult(result, reason)
+
+    def passed(self, reason: str = None, **kwargs):
+        self._end("passed", reason)
+
+    def passx(self, reason: str = None, **kwargs):
+        self._end("passx", reason)
+
+    def failed(self, reason: str = None, **kwargs):
+        self._end("failed", reason)
+
+    def errored(self, reason: str = None, **kwargs):
+        self._end("errored", reason)
+
+    def skipped(self, reason: str = None, **kwargs):
+        self._end("skipped", reason)
+
+    def blocked(self, reason: str = None, **kwargs):
+        self._end("blocked", reason)
+
+    def aborted(self, reason: str = None, **kwargs):
+        self._end("aborted", reason)
+
+    def __enter__(self) -> "RecordedStep":
+        self.recorder.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        self.recorder.stack.pop()
+        if exc_type is None:
+            return False
+        if issubclass(exc_type, _StepResult):
+            if exc.propagated:
+                if not self.continue_:
+                    raise exc
+                return True
+            self.own_result, self.reason = exc.result, exc.reason
+        elif issubclass(exc_type, AssertionError):
+            self.own_result, self.reason = "failed", str(exc) or "assertion failed"
+        elif issubclass(exc_type, Exception):
+            self.own_result, self.reason = "errored", f"{exc_type.__name__}: {exc}"
+        else:
+            return False
+        #Like pyATS, a failing step without continue_ stops the rest of its parent
+        if self.own_result in REPORTED_RESULTS and not self.continue_:
+            raise _StepResult(self.own_result, self.reason, propagated=True)
+        return True
+
+
+class StepRecorder(logging.Filter):
+    """
+    Records the steps of one test section, holding back the log lines written inside them
+    Log lines are only written out again for the steps that end up reported
+    """
+    def __init__(self):
+        super().__init__()
+        self.root = RecordedStep(self, "root", continue_=True)
+        self.stack = []
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.stack:
+            self.stack[-1].records.append(record)
+            return False
+        return True
+
+    def leaves(self, step: RecordedStep = None, path: tuple = ()) -> List:
+        """
+        Every step without substeps, along with the names of the steps above it
+        """
+        leaves = []
+        for child in (step or self.root).children:
+            if child.children:
+                if child.own_result:
+                    leaves.append((path + (child.name,), child))
+                leaves.extend(self.leaves(child, path + (child.name,)))
+            else:
+                leaves.append((path + (child.name,), child))
+        return leaves
+
+
+def _replay(steps, recorded: RecordedStep) -> None:
+    """
+    Writes a recorded step out as a real pyATS step, with its substeps and held back log lines
+    """
+    with steps.start(recorded.name, continue_=True) as step:
+        for record in recorded.records:
+            logging.getLogger(record.name).handle(record)
+        for child in recorded.children:
+            _replay(step, child)
+        if recorded.own_result and recorded.own_result != "passed":
+            getattr(step, recorded.own_result)(recorded.reason)
+
+def write_results(section: object, test_name: str, recorder: StepRecorder) -> None:
+    """
+    Appends the result of every recorded step for this process, does nothing without a results directory
+    """
+    directory = results_dir()
+    if not directory:
+        return
+    device = section.parameters.get('device')
+    timestamp = time.time()
+    lines = [json.dumps({'device': getattr(device, 'name', None), 'testcase': section.uid, 'section': test_name,
+                         'step': " / ".join(path), 'result': step.result, 'reason': step.reason, 'timestamp': timestamp})
+             for path, step in recorder.leaves()]
+    with _write_lock:
+        with open(os.path.join(directory, f"results-{os.getpid()}.jsonl"), "a") as f:
+            f.write("".join(line + "\n" for line in lines))
+
+def report_recorded(section: object, steps, test_name: str, recorder: StepRecorder) -> None:
+    """
+    One summary step with the count of each result, then the full nested steps of everything that didn't pass
+    """
+    counts = dict()
+    for _, step in recorder.leaves():
+        counts[step.result] = counts.get(step.result, 0) + 1
+    summary = ", ".join(f"{counts[result]} {result}" for result in RESULT_ORDER if result in counts) or "nothing to check"
+    with steps.start(f"{test_name} - {summary}", continue_=True):
+        pass
+    for recorded in recorder.root.children:
+        if recorded.result in REPORTED_RESULTS:
+            _replay(steps, recorded)
+    write_results(section, test_name, recorder)
+
+def compact_steps(function: Callable) -> Callable:
+    """
+    Decorates a testcase section that reports through steps. In compact mode the section runs against recorded steps,
+    then reports one summary step with the count of each result, and the full nested steps only for the
+    failed, errored and blocked ones
+    """
+    @functools.wraps(function)
+    def wrapper(self, steps, *args, **kwargs):
+        if report_mode() != "compact":
+            return function(self, steps, *args, **kwargs)
+        recorder = StepRecorder()
+        root_logger = logging.getLogger()
+        root_logger.addFilter(recorder)
+        try:
+            function(self, recorder.root, *args, **kwargs)
+        except _StepResult:
+            pass
+        finally:
+            root_logger.removeFilter(recorder)
+            report_recorded(self, steps, function.__name__, recorder)
+    return wrapper
+
+def load_results(directory: str) -> List:
+    results = []
+    for file_ in sorted(glob.glob(os.path.join(directory, "results-*.jsonl"))):
+        with open(file_) as f:
+            results.extend(json.loads(line) for line in f if line.strip())
+    return results
+
+def merge_results(directory: str) -> Dict:
+    """
+    Merges every process' results into results.json in the results directory, returns the count of each result
+    """
+    results = load_results(directory)
+    results.sort(key=lambda result: (str(result['device']), result['testcase'], result['timestamp']))
+    with open(os.path.join(directory, "results.json"), "w") as f:
+        json.dump(results, f, indent=2)
+    counts = dict()
+    for result in results:
+        counts[result['result']] = counts.get(result['result'], 0) + 1
+    return counts
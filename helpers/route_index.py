@@ -0,0 +1,96 @@
+import ipaddress
+
+from typing import Iterable
+
+
+def natural_prefix_length(address: ipaddress.IPv4Address) -> int:
+    """
+    Returns the classful prefix length IOS assumes when it prints a network without a mask
+    ex.  natural_prefix_length(IPv4Address("172.16.0.0")) | returns 16
+    """
+    first_octet = int(address) >> 24
+    if first_octet < 128:
+        return 8
+    if first_octet < 192:
+        return 16
+    if first_octet < 224:
+        return 24
+    return 32
+
+
+class RouteIndex:
+    """
+    Prefix index for BGP route tables
+    Prefixes are stored as integers, one set per (ip version, prefix length), which behaves like a
+    flattened binary trie - every lookup walks at most one level per prefix bit
+    """
+    __slots__ = ("_levels", "_unknown_length")
+
+    def __init__(self, routes: Iterable = ()):
+        self._levels = {4: [set() for _ in range(33)], 6: [set() for _ in range(129)]}
+        #Networks printed without a mask that don't fit their classful length, we only know the address
+        self._unknown_length = set()
+        for route in routes:
+            self.add(route)
+
+    def __len__(self) -> int:
+        return sum(len(level) for levels in self._levels.values() for level in levels) + len(self._unknown_length)
+
+    @staticmethod
+    def _key(network: ipaddress._BaseNetwork, prefixlen: int) -> int:
+        return int(network.network_address) >> (network.max_prefixlen - prefixlen)
+
+    def add(self, route: str) -> None:
+        """
+        Adds a route to the index, routes without a prefix length get their classful length
+        """
+        if "/" not in route:
+            address = ipaddress.ip_address(route)
+            if address.version == 4:
+                network = ipaddress.ip_network(f"{route}/{natural_prefix_length(address)}", strict=False)
+                if network.network_address == address:
+                    self._levels[4][network.prefixlen].add(self._key(network, network.prefixlen))
+                    return
+            self._unknown_length.add((address.version, int(address)))
+            return
+        network = ipaddress.ip_network(route, strict=False)
+        self._levels[network.version][network.prefixlen].add(self._key(network, network.prefixlen))
+
+    def exact(self, route: str) -> bool:
+        """
+        True when the route is in the index with the same prefix length
+        Falls back to an address match for routes the table listed without a usable mask
+        """
+        network = ipaddress.ip_network(route, strict=False)
+        if self._key(network, network.prefixlen) in self._levels[network.version][network.prefixlen]:
+            return True
+        return (network.version, int(network.network_address)) in self._unknown_length
+
+    def longest_match(self, route: str):
+        """
+        Returns the most specific indexed prefix containing the route, or None
+        """
+        network = ipaddress.ip_network(route, strict=False)
+        levels = self._levels[network.version]
+        for prefixlen in range(network.prefixlen, -1, -1):
+            key = self._key(network, prefixlen)
+            if key in levels[prefixlen]:
+                return ipaddress.ip_network((key << (network.max_prefixlen - prefixlen), prefixlen))
+        return None
+
+    def covered(self, route: str) -> bool:
+        """
+        True when the route, or an aggregate covering it, is in the index
+        """
+        return self.longest_match(route) is not None or self.exact(route)
+
+    def contains(self, route: str, match: str = "exact") -> bool:
+        """
+        Checks a route against the index
+        exact needs the same prefix and length, covered also accepts an aggregate covering the route
+        """
+        if match == "exact":
+            return self.exact(route)
+        if match == "covered":
+            return self.covered(route)
+        raise ValueError(f"Unknown route match type {match}")
@@ -0,0 +1,182 @@
+import hashlib
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Dict, List, Optional
+
+#Both sides of a sharded run authenticate with this key, read from the environment so it never shows in a process list
+SHARD_KEY_ENV = "HAPPY_CIRCUITS_SHARD_KEY"
+SHARD_STRATEGIES = ("hash", "site")
+#A shard whose worker disconnects without a result is handed to the next worker this many times
+SHARD_RETRIES = 1
+
+
+def shard_key() -> bytes:
+    key = os.environ.get(SHARD_KEY_ENV)
+    if not key:
+        raise ValueError(f"Set {SHARD_KEY_ENV} to the same secret on the coordinator and every worker")
+    return key.encode()
+
+def parse_address(address: str) -> tuple:
+    """
+    Splits host:port, ex. parse_address("10.0.0.5:7001") | returns ("10.0.0.5", 7001)
+    """
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Expected host:port, got {address}")
+    return host, int(port)
+
+def device_site(device: object) -> Optional[str]:
+    """
+    Site of a testbed device, taken from custom: site: in the testbed file
+    """
+    custom = getattr(device, 'custom', None) or {}
+    return custom.get('site')
+
+def shard_devices(devices: List, shards: int, strategy: str = "hash") -> List:
+    """
+    Splits the device names into shards lists
+    hash spreads devices by a stable hash of their name, site keeps every device of a site in the same shard
+    and balances whole sites across the shards, largest first. Devices without a site are spread by hash
+    """
+    if strategy not in SHARD_STRATEGIES:
+        raise ValueError(f"Unknown shard strategy {strategy}, expected one of {', '.join(SHARD_STRATEGIES)}")
+    assignment = [[] for _ in range(shards)]
+    groups = dict()
+    for device in devices:
+        site = device_site(device) if strategy == "site" else None
+        if site:
+            groups.setdefault(site, []).append(device.name)
+        else:
+            assignment[int(hashlib.sha1(device.name.encode()).hexdigest(), 16) % shards].append(device.name)
+    for site in sorted(groups, key=lambda site: (-len(groups[site]), site)):
+        min(assignment, key=len).extend(groups[site])
+    return assignment
+
+
+class Coordinator:
+    """
+    Hands one shard to every worker that connects and collects what each sends back
+    A worker that disconnects before sending its result has its shard handed to the next worker
+    The shard key authenticates workers but does not encrypt the connection, so no credentials are sent over it
+    """
+    def __init__(self, address: str, assignment: List):
+        self.listener = Listener(parse_address(address), authkey=shard_key())
+        self.stopped = threading.Event()
+        self.acceptor = None
+        self.assignment = assignment
+        self.pending = queue.Queue()
+        for shard in range(len(assignment)):
+            self.pending.put(shard)
+        self.attempts = {shard: 0 for shard in range(len(assignment))}
+        self.results = dict()
+        self.workers = dict()
+        self.lock = threading.Lock()
+
+    def _finished(self) -> bool:
+        with self.lock:
+            return all(shard in self.results for shard in range(len(self.assignment)))
+
+    def _accept_workers(self) -> None:
+        """
+        Accepts workers until the coordinator stops, the listener authenticates each one before it is served in its own thread
+        """
+        while not self.stopped.is_set():
+            try:
+                connection = self.listener.accept()
+            except (AuthenticationError, EOFError, OSError) as e:
+                if not self.stopped.is_set():
+                    logging.warning(f"Rejected a worker connection - {e}")
+                continue
+            if self.stopped.is_set():
+                connection.close()
+                return
+            threading.Thread(target=self._serve_worker, args=(connection,), daemon=True).start()
+
+    def _serve_worker(self, connection: Connection) -> None:
+        try:
+            worker = connection.recv().get('worker', "unknown")
+            shard = self.pending.get_nowait()
+        except (EOFError, OSError):
+            connection.close()
+            return
+        except queue.Empty:
+            connection.send({'type': 'assignment', 'shard': None, 'devices': []})
+            connection.close()
+            return
+        devices = self.assignment[shard]
+        with self.lock:
+            self.attempts[shard] += 1
+            self.workers[shard] = worker
+        logging.info(f"Shard {shard} ({len(devices)} devices) assigned to worker {worker}")
+        try:
+            connection.send({'type': 'assignment', 'shard': shard, 'devices': devices})
+            result = connection.recv()
+        except (EOFError, OSError) as e:
+            with self.lock:
+                retry = self.attempts[shard] <= SHARD_RETRIES
+                if not retry:
+                    self.results[shard] = {'type': 'result', 'shard': shard, 'error': f"worker {worker} disconnected - {e}", 'devices': {}}
+            if retry:
+                logging.critical(f"Worker {worker} disconnected before finishing shard {shard}, handing it to the next worker")
+                self.pending.put(shard)
+            else:
+                logging.critical(f"Worker {worker} disconnected before finishing shard {shard}, giving up on it")
+            return
+        finally:
+            connection.close()
+        with self.lock:
+            self.results[shard] = result
+        logging.info(f"Shard {shard} finished on worker {worker}")
+
+    def run(self, timeout: float) -> Dict:
+        """
+        Serves workers until every shard has a result or timeout seconds have passed, returns the results by shard
+        """
+        started = time.time()
+        self.acceptor = threading.Thread(target=self._accept_workers, daemon=True)
+        self.acceptor.start()
+        try:
+            #Wake up regularly so the timeout and completion are noticed
+            while not self._finished() and time.time() - started < timeout:
+                time.sleep(0.1)
+        finally:
+            self.close()
+        for shard in range(len(self.assignment)):
+            if shard not in self.results:
+                self.results[shard] = {'type': 'result', 'shard': shard, 'error': "timed out waiting for a worker", 'devices': {}}
+        return self.results
+
+    def close(self) -> None:
+        """
+        Stops accepting workers, a bare connection wakes the accept that is waiting for the next worker
+        """
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        try:
+            socket.create_connection(self.listener.address, timeout=1).close()
+        except OSError:
+            pass
+        if self.acceptor:
+            self.acceptor.join(timeout=5)
+        self.listener.close()
+
+
+def join(address: str) -> tuple:
+    """
+    Worker side, connects to the coordinator and returns the connection along with the assigned shard
+    """
+    connection = Client(parse_address(address), authkey=shard_key())
+    connection.send({'type': 'hello', 'worker': f"{socket.gethostname()}:{os.getpid()}"})
+    return connection, connection.recv()
+
+def send_result(connection, shard: int, devices: Dict, timings: List = None, checks: List = None) -> None:
+    connection.send({'type': 'result', 'shard': shard, 'devices': devices, 'timings': timings or [], 'checks': checks or []})
+    connection.close()
@@ -0,0 +1,97 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from typing import Callable, Optional
+
+#Snapshot settings are shared with every easypy task process through the environment
+SNAPSHOT_MODE_ENV = "HAPPY_CIRCUITS_SNAPSHOT_MODE"
+SNAPSHOT_DIR_ENV = "HAPPY_CIRCUITS_SNAPSHOT_DIR"
+SNAPSHOT_TTL_ENV = "HAPPY_CIRCUITS_SNAPSHOT_TTL"
+
+#live - always run the command, record - run and store it, replay - only read stored output,
+#cache - reuse stored output younger than the ttl and record anything else
+SNAPSHOT_MODES = ("live", "record", "replay", "cache")
+
+
+class SnapshotMissError(LookupError):
+    """
+    Raised in replay mode when no output was recorded for a device and command
+    """
+
+
+def configure_snapshots(mode: str, directory: str = "snapshots", ttl: int = 300) -> None:
+    """
+    Sets the snapshot mode for this process and every task process started after it
+    """
+    if mode not in SNAPSHOT_MODES:
+        raise ValueError(f"Unknown snapshot mode {mode}, expected one of {', '.join(SNAPSHOT_MODES)}")
+    os.environ[SNAPSHOT_MODE_ENV] = mode
+    os.environ[SNAPSHOT_DIR_ENV] = directory
+    os.environ[SNAPSHOT_TTL_ENV] = str(ttl)
+
+def snapshot_mode() -> str:
+    return os.environ.get(SNAPSHOT_MODE_ENV, "live")
+
+def _snapshot_dir() -> str:
+    return os.environ.get(SNAPSHOT_DIR_ENV, "snapshots")
+
+def _entry_file(device_name: str, command: str) -> str:
+    return os.path.join(_snapshot_dir(), "devices", device_name, hashlib.sha1(command.encode()).hexdigest() + ".json")
+
+def _object_file(digest: str) -> str:
+    return os.path.join(_snapshot_dir(), "objects", digest[:2], digest + ".gz")
+
+def _write_atomic(file_: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(file_), exist_ok=True)
+    temp_file = f"{file_}.{os.getpid()}.tmp"
+    with open(temp_file, "wb") as f:
+        f.write(data)
+    os.replace(temp_file, file_)
+
+def store(device_name: str, command: str, output: str) -> None:
+    """
+    Stores the output compressed and content addressed, identical outputs across devices share one object
+    """
+    data = output.encode()
+    digest = hashlib.sha256(data).hexdigest()
+    if not os.path.exists(_object_file(digest)):
+        _write_atomic(_object_file(digest), gzip.compress(data))
+    entry = {'device': device_name, 'command': command, 'object': digest, 'timestamp': time.time()}
+    _write_atomic(_entry_file(device_name, command), json.dumps(entry).encode())
+
+def load(device_name: str, command: str, max_age: float = None) -> Optional[str]:
+    """
+    Returns the stored output for the device and command, or None when missing or older than max_age seconds
+    """
+    try:
+        with open(_entry_file(device_name, command)) as f:
+            entry = json.load(f)
+        if max_age is not None and time.time() - entry['timestamp'] > max_age:
+            return None
+        with open(_object_file(entry['object']), "rb") as f:
+            return gzip.decompress(f.read()).decode()
+    except (OSError, ValueError, KeyError):
+        return None
+
+def cached(device_name: str, command: str, collect: Callable[[], str]) -> str:
+    """
+    Returns the output of command on the device according to the snapshot mode
+    collect is only called when the output has to come from the live device
+    """
+    mode = snapshot_mode()
+    if mode == "replay":
+        output = load(device_name, command)
+        if output is None:
+            raise SnapshotMissError(f"No recorded output for '{command}' on {device_name} in {_snapshot_dir()}")
+        return output
+    if mode == "cache":
+        output = load(device_name, command, max_age=float(os.environ.get(SNAPSHOT_TTL_ENV, 300)))
+        if output is not None:
+            return output
+    output = collect()
+    if mode in ("record", "cache"):
+        store(device_name, command, output)
+    return output
@@ -0,0 +1,83 @@
+import importlib
+import logging
+import time
+
+from typing import Dict, List
+from helpers import fast_parsers
+from helpers.collection import bgp_neighbor_commands, neighbor_route_match, neighbor_wants_routes
+
+#Modules the testscripts import in every task. Easypy tasks and monitor checks are forked,
+#so once the job process has loaded these, every task inherits them instead of importing them again
+TASK_MODULES = (
+    "pyats.aetest",
+    "genie.metaparser.util.exceptions",
+    "helpers.collection",
+    "helpers.history",
+    "helpers.ip_sla",
+    "helpers.reporting",
+    "helpers.route_index",
+)
+
+
+def preload_modules(modules: tuple = TASK_MODULES) -> None:
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logging.warning(f"Unable to preload {module}, tasks will import it themselves - {e}")
+
+def genie_commands(device_values: object) -> Dict:
+    """
+    One command of each kind the device's tasks will hand to the Genie parsers, keyed by kind
+    In fast parser mode that is only the full route tables, the rest is parsed without Genie
+    """
+    commands = dict()
+    if fast_parsers.parser_mode() == "genie" and device_values.collection_backend == "cli":
+        if device_values.interface_collection == "bulk":
+            commands["show interfaces"] = "show interfaces"
+        elif device_values.circuits:
+            commands["show interface"] = f"show interface {device_values.circuits[0].interface}"
+        commands.update((command, command) for command in bgp_neighbor_commands(device_values.circuits))
+    for circuit in device_values.circuits:
+        if not circuit.tests.bgp.test_bgp:
+            continue
+        for neighbor in circuit.tests.bgp.neighbors:
+            if neighbor.route_lookup == "targeted" and neighbor_route_match(neighbor) == "exact":
+                continue
+            for table, route_key in (("advertised-routes", "advertised_routes"), ("routes", "received_routes")):
+                if neighbor_wants_routes(neighbor, route_key):
+                    commands.setdefault(table, f"show ip bgp neighbor {neighbor.neighbor_ip} {table}")
+    return commands
+
+def prewarm_parsers(devices: List, device_values: Dict) -> int:
+    """
+    Looks up the Genie parser of every kind of command the tasks will parse with Genie, once per device os
+    This loads the parser index and imports the parser modules in the job process, so the forked tasks share them
+    Returns how many parsers were looked up
+    """
+    from genie.libs.parser.utils.common import get_parser
+    warmed = set()
+    for device in devices:
+        for kind, command in genie_commands(device_values[device.name]).items():
+            key = (getattr(device, 'os', None), getattr(device, 'platform', None), kind)
+            if key in warmed:
+                continue
+            warmed.add(key)
+            try:
+                get_parser(command, device)
+            except Exception as e:
+                logging.warning(f"Unable to preload the parser for {command} on {device.name}, it will be loaded in the task - {e}")
+    return len(warmed)
+
+def prewarm(devices: List, device_values: Dict) -> None:
+    """
+    Loads the task modules and Genie parsers once, before any task is started
+    """
+    started = time.perf_counter()
+    preload_modules()
+    try:
+        parsers = prewarm_parsers(devices, device_values)
+    except ImportError as e:
+        logging.warning(f"Unable to preload Genie parsers, tasks will load them themselves - {e}")
+        parsers = 0
+    logging.info(f"Preloaded the task modules and {parsers} Genie parsers in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,137 @@
+import cProfile
+import glob
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Dict, List
+
+#Every process of the job (main and each easypy task) appends its records to its own file in this directory
+TIMING_DIR_ENV = "HAPPY_CIRCUITS_TIMING_DIR"
+
+_write_lock = threading.Lock()
+_profiler = None
+
+
+def timing_dir() -> str:
+    return os.environ.get(TIMING_DIR_ENV)
+
+def enable_timing(directory: str) -> None:
+    """
+    Turns on timing for this process and every task process started after it
+    """
+    os.makedirs(directory, exist_ok=True)
+    os.environ[TIMING_DIR_ENV] = directory
+
+def record(entry: Dict) -> None:
+    """
+    Appends a single timing record for this process, does nothing when timing is disabled
+    """
+    directory = timing_dir()
+    if not directory:
+        return
+    line = json.dumps(entry)
+    with _write_lock:
+        with open(os.path.join(directory, f"timings-{os.getpid()}.jsonl"), "a") as f:
+            f.write(line + "\n")
+
+@contextmanager
+def measure(device: str, command: str, stage: str, circuit: str = None):
+    """
+    Times the enclosed block and records it. The yielded dict can be filled in with
+    bytes (CLI output size) and parse_s (time spent in the parser)
+    """
+    entry = {'device': device, 'circuit': circuit, 'stage': stage, 'command': command, 'bytes': 0, 'parse_s': 0.0, 'error': None}
+    started = time.perf_counter()
+    try:
+        yield entry
+    except Exception as e:
+        entry['error'] = type(e).__name__
+        raise
+    finally:
+        entry['wall_s'] = time.perf_counter() - started
+        entry['timestamp'] = time.time()
+        record(entry)
+
+def start_profile(profile_output: str) -> None:
+    """
+    Starts cProfile for the current task when a profile output path was given to it
+    """
+    global _profiler
+    if profile_output:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+def stop_profile(profile_output: str) -> None:
+    """
+    Stops cProfile and writes the stats file, readable with pstats or snakeviz
+    """
+    global _profiler
+    if _profiler and profile_output:
+        _profiler.disable()
+        _profiler.dump_stats(profile_output)
+        _profiler = None
+
+def load_records(directory: str) -> List:
+    records = []
+    for file_ in sorted(glob.glob(os.path.join(directory, "timings-*.jsonl"))):
+        with open(file_) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+def summarize(records: List) -> Dict:
+    """
+    Aggregates the records per device, per stage and per command
+    """
+    summary = {'devices': {}, 'stages': {}, 'commands': {}, 'slowest': []}
+    for entry in records:
+        for group, key in (('devices', entry['device']), ('stages', entry['stage']), ('commands', f"{entry['device']}|{entry['command']}")):
+            totals = summary[group].setdefault(key, {'count': 0, 'wall_s': 0.0, 'parse_s': 0.0, 'bytes': 0, 'errors': 0})
+            totals['count'] += 1
+            totals['wall_s'] += entry['wall_s']
+            totals['parse_s'] += entry.get('parse_s', 0.0)
+            totals['bytes'] += entry.get('bytes', 0)
+            totals['errors'] += 1 if entry.get('error') else 0
+    summary['slowest'] = sorted(records, key=lambda entry: entry['wall_s'], reverse=True)[:25]
+    return summary
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+def prometheus_text(summary: Dict) -> str:
+    """
+    Renders the summary in the Prometheus textfile collector format
+    """
+    lines = []
+    metrics = (
+        ('happy_circuits_device_seconds', "Wall time spent on device operations", 'devices', ('device',), 'wall_s'),
+        ('happy_circuits_stage_seconds', "Wall time spent per stage across all devices", 'stages', ('stage',), 'wall_s'),
+        ('happy_circuits_command_seconds', "Wall time spent per device and command", 'commands', ('device', 'command'), 'wall_s'),
+        ('happy_circuits_command_parse_seconds', "Parser time per device and command", 'commands', ('device', 'command'), 'parse_s'),
+        ('happy_circuits_command_bytes', "CLI output bytes per device and command", 'commands', ('device', 'command'), 'bytes'),
+        ('happy_circuits_command_count', "Executions per device and command", 'commands', ('device', 'command'), 'count'),
+    )
+    for name, help_text, group, label_names, field in metrics:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for key, totals in sorted(summary[group].items()):
+            labels = ",".join(f'{label}="{_label(value)}"' for label, value in zip(label_names, key.split("|", 1)))
+            lines.append(f"{name}{{{labels}}} {totals[field]}")
+    return "\n".join(lines) + "\n"
+
+def write_reports(directory: str, prometheus_file: str = None) -> Dict:
+    """
+    Merges every process' records into timings.json and timings.prom in the timing directory
+    The Prometheus file is also written to prometheus_file, if given, for the node exporter textfile collector
+    """
+    summary = summarize(load_records(directory))
+    with open(os.path.join(directory, "timings.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    for file_ in filter(None, (os.path.join(directory, "timings.prom"), prometheus_file)):
+        #Write then rename so the textfile collector never reads a partial file
+        with open(f"{file_}.tmp", "w") as f:
+            f.write(prometheus_text(summary))
+        os.replace(f"{file_}.tmp", file_)
+    return summary
@@ -0,0 +1,208 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import wait
+from pyats import aetest, topology
+from happy_circuits import TESTSCRIPTS, handle_device_connection, prepare_run, parser as job_parser
+from helpers import budget, cli, reporting, snapshot, startup, timing
+
+logging.basicConfig(level=logging.INFO)
+
+parser = argparse.ArgumentParser(description = "happy circuits monitor daemon", parents=[job_parser], conflict_handler="resolve")
+parser.add_argument("--testbed", help="pyATS testbed file", required=True)
+parser.add_argument("--interface_interval", type=int, default=60, help="Seconds between interface checks of each device, 0 disables them")
+parser.add_argument("--icmp_interval", type=int, default=300, help="Seconds between ICMP checks of each device, 0 disables them")
+parser.add_argument("--bgp_interval", type=int, default=300, help="Seconds between BGP checks of each device, 0 disables them")
+parser.add_argument("--status_file", help="JSON file holding the latest result of every check, rewritten after each sweep")
+parser.add_argument("--sweeps", type=int, default=0, help="Stop after this many sweeps, 0 runs until interrupted")
+
+#Interval argument of each testscript, in TESTSCRIPTS order
+INTERVAL_ARGS = ("interface_interval", "icmp_interval", "bgp_interval")
+
+#Checks run in a forked child that inherits the open connection and everything already imported.
+#They are only forked from the main thread while no other thread runs, so no lock is inherited held
+FORK = multiprocessing.get_context("fork")
+
+
+def ensure_connected(device: object, device_values, username: str, auth_type: str) -> None:
+    """
+    Health check run before every device's checks, reconnects when the session was lost
+    Raises ConnectionError for token authentication, nobody is there to enter a new passcode
+    """
+    if snapshot.snapshot_mode() == "replay":
+        return
+    try:
+        if device.is_connected():
+            return
+    except Exception as e:
+        logging.warning(f"Health check of {device.name} failed - {e}")
+    if auth_type.lower() == "token":
+        raise ConnectionError("the connection dropped and token passcodes are single use, restart the monitor to enter a new one")
+    logging.warning(f"Connection to {device.name} is down, reconnecting")
+    try:
+        device.disconnect()
+    except Exception:
+        pass
+    handle_device_connection(device=device, username=username, auth_type=auth_type, pool_size=device_values.session_pool_size)
+
+def _run_testscript(connection, testscript: str, device: object, device_values, deadline: float) -> None:
+    """
+    Child side of start_check. Runs the testscript standalone and sends back its result and the output it parsed again
+    The parses inherited from the monitor answer every command whose output hasn't changed since it was last parsed
+    """
+    try:
+        result = str(aetest.main(testable=testscript, device=device, device_values=device_values, deadline=deadline))
+    except Exception as e:
+        result = f"errored - {e}"
+    connection.send((result, cli.reparsed(device.name), cli.reused(device.name)))
+    connection.close()
+
+def start_check(device: object, device_values, testscript: str, deadline: float) -> tuple:
+    """
+    Forks a child running the testscript against the device, returns the end its result arrives on and the child
+    """
+    receiver, sender = FORK.Pipe(duplex=False)
+    process = FORK.Process(target=_run_testscript, args=(sender, testscript, device, device_values, deadline))
+    process.start()
+    sender.close()
+    return receiver, process
+
+def finish_check(device: object, receiver, process) -> Dict:
+    """
+    Collects the result of a check and keeps the output it parsed again for the next checks of the device
+    A check is unchanged when every output it parsed was the same as last time
+    """
+    try:
+        result, parses, reused = receiver.recv()
+    except EOFError:
+        result, parses, reused = "errored - testscript process exited without a result", dict(), []
+    receiver.close()
+    process.join()
+    cli.reuse_parses(device.name, parses)
+    return {'result': result, 'checked_at': time.time(), 'unchanged': bool(reused) and not parses}
+
+def run_sweep(devices: List, device_values: Dict, due: Dict, username: str, auth_type: str, max_workers: int, state: Dict) -> None:
+    """
+    Runs every due check, with at most max_workers devices in flight at once
+    The checks of a device run one after the other over its one connection, the device budget covers them all
+    Everything happens on the main thread, the checks are waited on with multiprocessing.connection.wait
+    """
+    waiting = [device for device in devices if due[device.name]]
+    running = dict()
+    while waiting or running:
+        while waiting and len(running) < max_workers:
+            device = waiting.pop(0)
+            values = device_values[device.name]
+            deadline = time.time() + values.device_budget_seconds if values.device_budget_seconds else None
+            budget.set_budget(device.name, deadline=deadline, command_timeout=values.command_timeout_seconds)
+            try:
+                ensure_connected(device=device, device_values=values, username=username, auth_type=auth_type)
+            except Exception as e:
+                logging.critical(f"Unable to connect to {device.name}, its checks are skipped this sweep - {e}")
+                for _, task_name in due[device.name]:
+                    state[(device.name, task_name)] = {'result': f"errored - {e}", 'checked_at': time.time(), 'unchanged': False}
+                continue
+            checks = list(due[device.name])
+            testscript, task_name = checks.pop(0)
+            receiver, process = start_check(device, values, testscript, deadline)
+            running[receiver] = (device, process, task_name, checks, deadline)
+        for receiver in wait(list(running)):
+            device, process, task_name, checks, deadline = running.pop(receiver)
+            state[(device.name, task_name)] = check = finish_check(device, receiver, process)
+            logging.info(f"{task_name} on {device.name} - {check['result']}{' (output unchanged, parses reused)' if check['unchanged'] else ''}")
+            if checks:
+                testscript, task_name = checks.pop(0)
+                receiver, process = start_check(device, device_values[device.name], testscript, deadline)
+                running[receiver] = (device, process, task_name, checks, deadline)
+
+def write_status(status_file: str, state: Dict) -> None:
+    status = dict()
+    for (device_name, task_name), check in sorted(state.items()):
+        status.setdefault(device_name, dict())[task_name] = {key: check.get(key) for key in ('result', 'checked_at', 'unchanged')}
+    #Write then rename so readers never see a partial file
+    with open(f"{status_file}.tmp", "w") as f:
+        json.dump(status, f, indent=2)
+    os.replace(f"{status_file}.tmp", status_file)
+
+def monitor(devices: List, device_values: Dict, username: str, args: Dict) -> None:
+    """
+    Runs each testscript against each device on its own interval until interrupted or --sweeps is reached
+    A sweep is every check that was due at the same moment
+    """
+    intervals = {task_name: args[interval_arg] for (_, task_name), interval_arg in zip(TESTSCRIPTS, INTERVAL_ARGS)}
+    next_due = {(device.name, task_name): 0.0 if intervals[task_name] > 0 else float("inf")
+                for device in devices for _, task_name in TESTSCRIPTS}
+    state = dict()
+    sweeps = 0
+    for device in devices:
+        cli.reuse_parses(device.name)
+    while min(next_due.values()) != float("inf"):
+        sweep_started = time.time()
+        due = {device.name: [(testscript, task_name) for testscript, task_name in TESTSCRIPTS
+                             if next_due[(device.name, task_name)] <= sweep_started] for device in devices}
+        run_sweep(devices=devices, device_values=device_values, due=due, username=username, auth_type=args['auth_type'],
+                  max_workers=args['max_workers'], state=state)
+        for device in devices:
+            for _, task_name in due[device.name]:
+                next_due[(device.name, task_name)] = sweep_started + intervals[task_name]
+        sweeps += 1
+        logging.info(f"Sweep {sweeps} finished in {time.time() - sweep_started:.1f}s")
+        if args['status_file']:
+            write_status(args['status_file'], state)
+        if args['timing_dir']:
+            timing.write_reports(args['timing_dir'], prometheus_file=args['prometheus_textfile'])
+        if args['results_dir']:
+            reporting.merge_results(args['results_dir'])
+        if args['sweeps'] and sweeps >= args['sweeps']:
+            break
+        time.sleep(max(0.0, min(next_due.values()) - time.time()))
+
+def main() -> None:
+    """
+    Connects to every testbed device once and keeps running the checks over those connections
+    Run with: python monitor.py --testbed testbed.yml --intent_file intent_file.yml
+    """
+    args = vars(parser.parse_args())
+    devices = list(topology.loader.load(args['testbed']).devices.values())
+    username, device_values = prepare_run(args=args, devices=devices)
+    #Timing records keep growing in a daemon, so they are only written when asked for
+    if args['timing_dir']:
+        timing.enable_timing(args['timing_dir'])
+    reporting.configure_reporting(args['report_mode'], args['results_dir'])
+    #Every check is forked from this process, anything loaded here is shared with all of them
+    startup.prewarm(devices, device_values)
+
+    def connect(device: object) -> None:
+        try:
+            handle_device_connection(device=device, username=username, auth_type=args['auth_type'],
+                                     pool_size=device_values[device.name].session_pool_size)
+        except Exception as e:
+            logging.critical(f"Unable to connect to {device.name}, retrying on its first sweep - {e}")
+
+    if args['auth_type'].lower() == "token":
+        for device in devices:
+            connect(device)
+    else:
+        #The connection threads are all finished before the first check is forked
+        with ThreadPoolExecutor(max_workers=args['max_workers']) as executor:
+            list(executor.map(connect, devices))
+    try:
+        monitor(devices=devices, device_values=device_values, username=username, args=args)
+    except KeyboardInterrupt:
+        logging.info("Stopping the monitor")
+    finally:
+        for device in devices:
+            try:
+                device.disconnect()
+            except Exception:
+                pass
+
+
+if __name__ == "__main__":
+    main()
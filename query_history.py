@@ -0,0 +1,85 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from helpers import history
+
+logging.basicConfig(level=logging.INFO)
+
+DAY_SECONDS = 86400
+
+
+def key_dict(key: tuple) -> dict:
+    device, circuit, target = key
+    return {'device': device, 'circuit': circuit, 'target': target}
+
+def run_trend(args: argparse.Namespace) -> list:
+    """
+    Series whose average over the last --days moved by at least --min_change percent against the --days before
+    """
+    changes = history.trend(args.history_db, args.metric, window=args.days * DAY_SECONDS, device=args.device,
+                            circuit=args.circuit, min_change_percent=args.min_change)
+    return [dict(key_dict(key), previous=round(previous, 3), current=round(current, 3), change_percent=round(change, 1))
+            for key, previous, current, change in changes]
+
+def run_percentiles(args: argparse.Namespace) -> list:
+    """
+    Percentiles of each series over the last --days
+    """
+    percents = tuple(float(percent) if "." in percent else int(percent) for percent in args.percentiles.split(","))
+    summary = history.percentiles(args.history_db, args.metric, since=time.time() - args.days * DAY_SECONDS,
+                                  device=args.device, circuit=args.circuit, percents=percents)
+    return [dict(key_dict(key), **values) for key, values in sorted(summary.items())]
+
+def run_series(args: argparse.Namespace) -> list:
+    """
+    Every point of each series over the last --days
+    """
+    points = history.series_points(args.history_db, args.metric, since=time.time() - args.days * DAY_SECONDS,
+                                   device=args.device, circuit=args.circuit)
+    return [dict(key_dict(key), time=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)), value=value)
+            for key, rows in sorted(points.items()) for timestamp, value in rows]
+
+def print_table(rows: list) -> None:
+    if not rows:
+        print("No matching history")
+        return
+    columns = list(rows[0])
+    widths = [max(len(column), *(len(str(row[column])) for row in rows)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+def main() -> None:
+    """
+    Queries the history database written by happy_circuits
+    ex. python query_history.py trend --metric rtt_avg_ms --days 7 --min_change 20
+    """
+    parser = argparse.ArgumentParser(description = "Trend and percentile queries over the happy circuits history")
+    parser.add_argument("query", choices=("trend", "percentiles", "series"),
+                        help="trend compares the last --days with the --days before, percentiles and series cover the last --days")
+    parser.add_argument("--metric", required=True, help="Measured value, ex. rtt_avg_ms, success_rate_percent, in_crc_errors, txload, bgp_uptime_days")
+    parser.add_argument("--days", type=float, default=7, help="Length of the window queried (default 7)")
+    parser.add_argument("--min_change", type=float, default=10.0, help="trend only: percent change to report, negative finds drops (default 10)")
+    parser.add_argument("--percentiles", default="50,95,99", help="percentiles only: comma separated percentiles (default 50,95,99)")
+    parser.add_argument("--device", help="Only this device")
+    parser.add_argument("--circuit", help="Only this circuit")
+    parser.add_argument("--history_db", default="history.sqlite", help="History database written by the job (default history.sqlite)")
+    parser.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.history_db):
+        logging.critical(f"No history database at {args.history_db}")
+        sys.exit()
+    rows = {'trend': run_trend, 'percentiles': run_percentiles, 'series': run_series}[args.query](args)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import pytest
+
+from helpers import adaptive_ping, fast_parsers
+from helpers.helpers import compile_predicate
+from helpers.intent import IcmpIntent
+from mock_device import MockDevice, circuit_addresses
+
+
+@pytest.mark.parametrize("received, sent, decision", [
+    (26, 26, None), (27, 27, True),
+    (0, 2, None), (0, 3, False),
+    (45, 50, None),
+])
+def test_loss_decision_stop_points(received, sent, decision):
+    #ge 90 tests a 95 percent pass rate against an 85 percent fail rate
+    assert adaptive_ping.loss_decision(received, sent, compile_predicate("ge 90"), confidence=95) is decision
+
+def test_loss_decision_needs_more_samples_for_higher_confidence():
+    predicate = compile_predicate("ge 90")
+    assert adaptive_ping.loss_decision(27, 27, predicate, confidence=99) is None
+    assert adaptive_ping.loss_decision(42, 42, predicate, confidence=99) is True
+
+def test_eq_predicate_never_decided_early():
+    assert adaptive_ping.loss_decision(100, 100, compile_predicate("eq 100"), confidence=95) is None
+
+def test_upper_bounds_stop_once_breached():
+    icmp_test = IcmpIntent(max_ms_conform=compile_predicate("le 20"), jitter_conform=compile_predicate("le 5"))
+    assert adaptive_ping.stop_reason({'send': 5, 'received': 5, 'round_trip': {'min_ms': 1, 'avg_ms': 9, 'max_ms': 25}}, icmp_test) == "max_ms_conform breached"
+    assert adaptive_ping.stop_reason({'send': 5, 'received': 5, 'round_trip': {'min_ms': 1, 'avg_ms': 4, 'max_ms': 10}}, icmp_test) == "jitter_conform breached"
+    assert adaptive_ping.stop_reason({'send': 5, 'received': 5, 'round_trip': {'min_ms': 1, 'avg_ms': 2, 'max_ms': 4}}, icmp_test) is None
+
+def test_adaptive_ping_stops_at_decision_batch(monkeypatch):
+    monkeypatch.setenv(fast_parsers.PARSER_MODE_ENV, "fast")
+    device = MockDevice("test0000", 0, circuits=1, neighbors=1, routes=1, latency=0, ping_interval=0)
+    address = circuit_addresses(0, 0)['remote']
+    icmp_test = IcmpIntent(pingable_address=address, ping_count=100, probe_mode="adaptive", batch_size=10,
+                           success_rate_percent_conform=compile_predicate("ge 90"))
+    result = adaptive_ping.adaptive_ping(device, icmp_test, "GigabitEthernet1", dict(address=address, source="GigabitEthernet1", validate=True))
+    statistics = result['ping']['statistics']
+    #27 straight replies decide a ge 90 predicate, so the third batch is the last
+    assert statistics['adaptive'] == {'samples': 30, 'batches': 3, 'stopped': "success_rate_percent_conform decided pass"}
+    assert (statistics['send'], statistics['received']) == (30, 30)
@@ -0,0 +1,36 @@
+import time
+
+import pytest
+
+from helpers import budget
+
+
+@pytest.fixture
+def device_name():
+    yield "test0000"
+    budget.set_budget("test0000")
+
+def test_no_budget_has_no_limit(device_name):
+    budget.set_budget(device_name)
+    budget.check(device_name, "show version")
+    assert budget.remaining(device_name) is None
+    assert budget.timeout_args(device_name) == {}
+
+def test_spent_budget_raises(device_name):
+    budget.set_budget(device_name, deadline=time.time() - 1, command_timeout=30)
+    with pytest.raises(budget.DeadlineExceeded, match="abandoned 'show version'"):
+        budget.check(device_name, "show version")
+    assert isinstance(budget.DeadlineExceeded("x"), TimeoutError)
+
+def test_timeout_cut_down_to_budget(device_name):
+    budget.set_budget(device_name, deadline=time.time() + 1000, command_timeout=30)
+    assert budget.timeout_args(device_name) == {'timeout': 30}
+    budget.set_budget(device_name, deadline=time.time() + 4.2, command_timeout=30)
+    assert budget.timeout_args(device_name) == {'timeout': 5}
+    assert budget.timeout_args(device_name, keyword="connection_timeout") == {'connection_timeout': 5}
+    #Cleanup configuration isn't held to the budget, only to the per command timeout
+    assert budget.timeout_args(device_name, within_budget=False) == {'timeout': 30}
+
+def test_timeout_never_below_one_second(device_name):
+    budget.set_budget(device_name, deadline=time.time() + 0.01)
+    assert budget.timeout_args(device_name) == {'timeout': 1}
@@ -0,0 +1,28 @@
+from helpers import cli
+
+
+class CountingParser:
+    name = "test0000"
+
+    def __init__(self):
+        self.parses = 0
+
+    def parse(self, command: str, output: str = None):
+        self.parses += 1
+        return {'output': output}
+
+def test_unchanged_output_reuses_parse(monkeypatch):
+    monkeypatch.setattr(cli, "_parses", dict())
+    monkeypatch.setattr(cli, "_reparsed", dict())
+    monkeypatch.setattr(cli, "_reused", dict())
+    device = CountingParser()
+    cli.parse(device, "show version", output="one")
+    assert device.parses == 1 and cli.reparsed(device.name) == {}
+    cli.reuse_parses(device.name)
+    first = cli.parse(device, "show version", output="one")
+    first['output'] = "changed by a caller"
+    assert cli.parse(device, "show version", output="one") == {'output': "one"}
+    assert device.parses == 2 and cli.reused(device.name) == ["show version"]
+    cli.parse(device, "show version", output="two")
+    assert device.parses == 3
+    assert cli.reparsed(device.name) == {"show version": (cli.output_digest("two"), {'output': "two"})}
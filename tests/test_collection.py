@@ -0,0 +1,104 @@
+from helpers import collection
+from helpers.intent import AddressFamilyIntent, CircuitIntent, DeviceIntent, NeighborIntent
+from helpers.route_index import RouteIndex
+from mock_device import MockDevice, circuit_addresses, neighbor_ips, route_prefixes
+
+
+def mock_device(routes: int = 30) -> MockDevice:
+    return MockDevice("test0000", 0, circuits=2, neighbors=1, routes=routes, latency=0, ping_interval=0)
+
+def test_parse_route_networks_mock_table():
+    device = mock_device()
+    neighbor_ip = neighbor_ips(1, 1)[0]
+    networks = collection.parse_route_networks(device.execute(f"show ip bgp neighbors {neighbor_ip} routes"))
+    assert networks == route_prefixes(1, 0, 30)
+
+def test_parse_route_networks_continuation_lines():
+    output = "\n".join([
+        "     Network          Next Hop            Metric LocPrf Weight Path",
+        " *>   10.1.0.0/16      192.168.1.1              0             0 65001 i",
+        " *m   10.2.0.0/24      192.168.1.1              0             0 65001 i",
+        " *>                    192.168.1.2              0             0 65001 i",
+        " *>i  192.168.100.128/25",
+        "                       192.168.1.3              0    100      0 i",
+        " r>   10.3.0.0         192.168.1.1              0             0 65001 ?",
+        "",
+        "Total number of prefixes 4 ",
+    ])
+    assert collection.parse_route_networks(output) == ["10.1.0.0/16", "10.2.0.0/24", "192.168.100.128/25", "10.3.0.0"]
+
+def test_gather_targeted_routes_mock_device():
+    device = mock_device()
+    neighbor_ip = neighbor_ips(0, 1)[0]
+    prefixes = route_prefixes(0, 0, 30)
+    wanted = [prefixes[0], prefixes[17], prefixes[29]]
+    routes = collection.gather_targeted_routes(device, neighbor_ip, vrf="default", table="routes", prefixes=wanted)
+    assert set(routes['address_family']['']['routes']) == set(wanted)
+    advertised = collection.gather_targeted_routes(device, neighbor_ip, vrf="default", table="advertised-routes", prefixes=wanted[:1])
+    assert set(advertised['address_family']['']['advertised']) == {wanted[0]}
+
+class ParsingMockDevice(MockDevice):
+    """
+    Parses the full route tables with parse_route_networks, in the shape of the Genie neighbor routes parsers
+    """
+    def parse(self, command: str, output: str = None, **kwargs):
+        words = command.split()
+        networks = collection.parse_route_networks(output if output is not None else self.execute(command))
+        return {'vrf': {'default': {'neighbor': {words[-2]: {'address_family': {'': {
+            collection.BGP_ROUTE_TABLES[words[-1]][0]: {network: dict() for network in networks}}}}}}}}
+
+def test_choose_route_lookup_covered_pulls_full_table():
+    assert collection.choose_route_lookup("targeted", route_count=1, prefix_count=100_000) == "targeted"
+    assert collection.choose_route_lookup("auto", route_count=1, prefix_count=100_000) == "targeted"
+    assert collection.choose_route_lookup("targeted", route_count=1, prefix_count=100_000, route_match="covered") == "full"
+    assert collection.choose_route_lookup("auto", route_count=1, prefix_count=100_000, route_match="covered") == "full"
+
+def test_covered_match_under_targeted_lookup():
+    device = ParsingMockDevice("test0000", 0, circuits=1, neighbors=1, routes=30, latency=0, ping_interval=0)
+    neighbor_ip = neighbor_ips(0, 1)[0]
+    aggregate = route_prefixes(0, 0, 30)[3]
+    #A more specific route of one the device has, only the aggregate covering it is in the table
+    route = aggregate.replace(".0/24", ".128/25")
+    intent = NeighborIntent(neighbor_ip=neighbor_ip, route_lookup="targeted",
+                            address_families=[AddressFamilyIntent(route_match="covered", received_routes=[route])])
+    routes = collection.gather_neighbor_routes(device, neighbor_ip, vrf="default", table="routes", prefixes=[route],
+                                               mode=intent.route_lookup, prefix_count=100_000,
+                                               route_match=collection.neighbor_route_match(intent))
+    received_routes = RouteIndex(routes['address_family']['']['routes'])
+    assert received_routes.contains(route, "covered")
+    assert not received_routes.contains(route, "exact")
+
+class CountingMockDevice(MockDevice):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.commands = []
+
+    def execute(self, command: str, **kwargs) -> str:
+        self.commands.append(command)
+        return super().execute(command, **kwargs)
+
+def test_interface_outcome_without_interface_index():
+    device = CountingMockDevice("test0000", 0, circuits=2, neighbors=1, routes=1, latency=0, ping_interval=0)
+    circuits = [CircuitIntent(interface=f"GigabitEthernet{index}") for index in (1, 2)]
+    context = collection.CollectionContext(device, DeviceIntent(name=device.name, circuits=circuits))
+    assert context.outcome("GigabitEthernet1", "interface") is True
+    assert context.blocked_by(circuits[1], "bgp_routes") is None
+    #Only the status line of each gated interface, never the bulk show interfaces
+    assert device.commands == ["show interfaces GigabitEthernet1 | include line protocol",
+                               "show interfaces GigabitEthernet2 | include line protocol"]
+    context.outcome("GigabitEthernet1", "interface")
+    assert len(device.commands) == 2
+
+def test_oversized_bulk_interfaces_parse_only_used_blocks():
+    device = CountingMockDevice("test0000", 0, circuits=3, neighbors=1, routes=1, latency=0, ping_interval=0)
+    index = collection.gather_interface_index(device, ["GigabitEthernet2", "GigabitEthernet9"], mode="bulk", max_bytes=10)
+    assert device.commands == ["show interfaces"]
+    assert set(index) == {"GigabitEthernet2"}
+    assert index["GigabitEthernet2"]['line_protocol'] == "up"
+
+def test_interface_address_without_interface_index():
+    device = CountingMockDevice("test0000", 0, circuits=2, neighbors=1, routes=1, latency=0, ping_interval=0)
+    circuits = [CircuitIntent(interface="GigabitEthernet2")]
+    context = collection.CollectionContext(device, DeviceIntent(name=device.name, circuits=circuits))
+    assert context.interface_address("GigabitEthernet2") == circuit_addresses(0, 1)['prefix'].split('/')[0]
+    assert device.commands == ["show interfaces GigabitEthernet2 | include Internet address"]
@@ -0,0 +1,38 @@
+from helpers import counters
+
+
+def reading(**values):
+    return dict(dict.fromkeys(counters.COUNTERS, 0), **values)
+
+def test_delta_and_32_bit_wrap():
+    assert counters.counter_delta(100, 150) == 50
+    assert counters.counter_delta(2 ** 32 - 10, 5) == 15
+    assert counters.counter_delta(2 ** 40, 2 ** 40 + 7) == 7
+
+def test_clear_detected_when_counter_drops_low():
+    previous = reading(in_pkts=5_000_000, in_errors=400)
+    current = reading(in_pkts=1_000, in_errors=3)
+    assert counters.was_cleared(previous, current)
+    #Everything counted since the clear is the delta
+    rates = counters.counter_rates(previous, current, elapsed=60)
+    assert rates['in_errors'] == 3000.0
+
+def test_wrap_is_not_a_clear():
+    previous = reading(in_pkts=2 ** 32 - 1_000, in_errors=10)
+    current = reading(in_pkts=1_000, in_errors=12)
+    assert not counters.was_cleared(previous, current)
+    assert counters.counter_rates(previous, current, elapsed=60)['in_errors'] == 1000.0
+
+def test_rates_per_second_and_without_packets():
+    previous = reading(out_pkts=100, out_errors=0)
+    current = reading(out_pkts=100, out_errors=30)
+    assert counters.counter_rates(previous, current, elapsed=10, rate="per_second")['out_errors'] == 3.0
+    assert counters.counter_rates(previous, current, elapsed=10)['out_errors'] == float("inf")
+    assert counters.counter_rates(previous, previous, elapsed=10)['out_errors'] == 0.0
+
+def test_baseline_swap(tmp_path, monkeypatch):
+    monkeypatch.setenv(counters.COUNTER_STORE_ENV, str(tmp_path / "counters.sqlite"))
+    assert counters.swap_baseline("router1", "Gi1", reading(in_errors=1), timestamp=100.0) is None
+    previous = counters.swap_baseline("router1", "Gi1", reading(in_errors=5), timestamp=160.0)
+    assert previous['timestamp'] == 100.0 and previous['in_errors'] == 1
+    assert counters.swap_baseline("router1", "Gi1", reading(), timestamp=220.0)['in_errors'] == 5
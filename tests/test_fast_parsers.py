@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from helpers import budget, cli, fast_parsers
+from bench_parsers import compare
+from mock_device import MockDevice, circuit_addresses
+
+
+def mock_device() -> MockDevice:
+    return MockDevice("test0000", 0, circuits=3, neighbors=2, routes=30, latency=0, ping_interval=0)
+
+def ping_output(device: MockDevice, validate: bool = True) -> str:
+    addresses = circuit_addresses(0, 0)
+    return device.execute(fast_parsers.ping_command(address=addresses['remote'], count=5, source="GigabitEthernet1", validate=validate))
+
+@pytest.mark.parametrize("command", ["show interfaces", "show interface GigabitEthernet1", "show ip bgp all neighbors"])
+def test_show_parsers_match_genie(command):
+    pytest.importorskip("genie.conf.base")
+    device = mock_device()
+    output = device.execute(command)
+    fast = fast_parsers.fast_parse(command, output)
+    assert fast is not None
+    assert compare(fast, device.parse(command, output=output)) == []
+
+def test_ping_parser_matches_genie():
+    pytest.importorskip("genie.conf.base")
+    device = mock_device()
+    output = ping_output(device)
+    fast = fast_parsers.parse_ping(output, validate=True)
+    assert fast is not None
+    assert compare(fast, device.parse(f"ping {fast['ping']['address']}", output=output)) == []
+
+def test_ping_parser_requires_validation():
+    output = ping_output(mock_device()).replace("Reply data will be validated\n", "")
+    assert fast_parsers.parse_ping(output) is not None
+    assert fast_parsers.parse_ping(output, validate=True) is None
+
+@pytest.mark.parametrize("deadline, command_timeout, expected", [(None, None, 210), (None, 30, 210), (5, 30, 5), (1000, 30, 210)])
+def test_fast_ping_timeout(monkeypatch, deadline, command_timeout, expected):
+    monkeypatch.setenv(fast_parsers.PARSER_MODE_ENV, "fast")
+    device = mock_device()
+    timeouts = []
+    execute = device.execute
+    device.execute = lambda command, **kwargs: timeouts.append(kwargs.get('timeout')) or execute(command)
+    #A 100 packet ping can take 200 seconds, only the device budget may cut it shorter
+    budget.set_budget(device.name, deadline=time.time() + deadline if deadline else None, command_timeout=command_timeout)
+    try:
+        ping_args = dict(address=circuit_addresses(0, 0)['remote'], count=100, source="GigabitEthernet1", validate=True)
+        assert cli._ping(device, ping_args)['ping']['statistics']['received'] == 100
+    finally:
+        budget.set_budget(device.name)
+    assert timeouts == [expected]
+
+def test_bgp_neighbors_across_address_family_headers():
+    device = mock_device()
+    neighbor_ip = next(iter(device._neighbors()))
+    block = device.execute(f"show ip bgp neighbors {neighbor_ip}")
+    vpnv4_block = block.replace(" For address family: IPv4 Unicast", " For address family: VPNv4 Unicast")
+    output = f"For address family: IPv4 Unicast\n{block}\nFor address family: VPNv4 Unicast\n{vpnv4_block}"
+    neighbor = fast_parsers.parse_show_bgp_neighbors(output)['vrf']['default']['neighbor'][neighbor_ip]
+    assert set(neighbor['address_family']) == {"ipv4 unicast", "vpnv4 unicast"}
+    assert neighbor['bgp_session_transport']['uptime'] > 0
+    assert fast_parsers.parse_show_bgp_neighbors(device.execute("show ip bgp all neighbors")) is not None
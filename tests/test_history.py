@@ -0,0 +1,35 @@
+from helpers import history
+
+
+def test_record_flush_and_query(monkeypatch, tmp_path):
+    path = str(tmp_path / "history.db")
+    monkeypatch.setenv(history.HISTORY_DB_ENV, path)
+    monkeypatch.setattr(history, "_pending", [])
+    clock = iter([100.0, 200.0, 300.0, 400.0])
+    monkeypatch.setattr(history.time, "time", lambda: next(clock))
+    history.record("test0000", "circuit0", "GigabitEthernet1", "txload", "10")
+    history.record("test0000", "circuit0", "GigabitEthernet1", "txload", 30)
+    history.record("test0000", "circuit1", "GigabitEthernet2", "txload", 5)
+    #Values that aren't numbers never reach the history
+    history.record("test0000", "circuit0", "GigabitEthernet1", "txload", None)
+    history.record("test0000", "circuit0", "GigabitEthernet1", "txload", "n/a")
+    assert history.flush() == 3
+    assert history.flush() == 0
+    assert history.series_points(path, "txload", since=0, until=1000) == {
+        ("test0000", "circuit0", "GigabitEthernet1"): [(100.0, 10.0), (200.0, 30.0)],
+        ("test0000", "circuit1", "GigabitEthernet2"): [(300.0, 5.0)],
+    }
+    assert history.series_points(path, "txload", since=150, until=1000, circuit="circuit0") == {
+        ("test0000", "circuit0", "GigabitEthernet1"): [(200.0, 30.0)],
+    }
+    assert history.percentiles(path, "txload", since=0, until=1000, circuit="circuit0", percents=(50, 99)) == {
+        ("test0000", "circuit0", "GigabitEthernet1"): dict(count=2, p50=10.0, p99=30.0),
+    }
+    changes = history.trend(path, "txload", window=100, now=250, circuit="circuit0")
+    assert changes == [(("test0000", "circuit0", "GigabitEthernet1"), 10.0, 30.0, 200.0)]
+
+def test_record_without_history_is_ignored(monkeypatch):
+    monkeypatch.delenv(history.HISTORY_DB_ENV, raising=False)
+    monkeypatch.setattr(history, "_pending", [])
+    history.record("test0000", "circuit0", "GigabitEthernet1", "txload", 10)
+    assert history.flush() == 0
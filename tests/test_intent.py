@@ -0,0 +1,74 @@
+import pytest
+
+from dataclasses import dataclass
+from typing import List
+from helpers import intent
+
+INTENT_YAML = """config:
+  devices:
+    router1:
+      circuits:
+        - circuit: AAA1
+          interface: GigabitEthernet3
+"""
+
+
+def test_record_signature_covers_new_fields():
+    @dataclass
+    class Before:
+        name: str = None
+
+    @dataclass
+    class After:
+        name: str = None
+        collection_backend: str = "cli"
+
+    assert intent._record_signature(Before).partition("(")[2] != intent._record_signature(After).partition("(")[2]
+
+def test_cache_ignored_after_key_change(tmp_path, monkeypatch):
+    intent_file = tmp_path / "router1.yml"
+    intent_file.write_text(INTENT_YAML)
+    cache_dir = str(tmp_path / "cache")
+    compiled = intent.load_intent_fragment(str(intent_file), cache_dir=cache_dir)
+    monkeypatch.setattr(intent, "compile_devices", lambda intent_file: {'router1': "recompiled"})
+    assert intent.load_intent_fragment(str(intent_file), cache_dir=cache_dir) == compiled
+    monkeypatch.setattr(intent, "INTENT_CACHE_KEY", "changed")
+    assert intent.load_intent_fragment(str(intent_file), cache_dir=cache_dir) == {'router1': "recompiled"}
+
+def test_unreadable_intent_raises_intent_error(tmp_path):
+    with pytest.raises(intent.IntentError, match="no such intent file"):
+        intent.load_intent(str(tmp_path / "missing.yml"), ["router1"])
+    broken_file = tmp_path / "router1.yml"
+    broken_file.write_text("config: [devices\n")
+    with pytest.raises(intent.IntentError, match=f"{broken_file}: not valid yaml"):
+        intent.load_intent(str(broken_file), ["router1"])
+
+def test_duplicate_device_fragments_raise(tmp_path):
+    for site in ("site1", "site2"):
+        (tmp_path / site).mkdir()
+        (tmp_path / site / "router1.yml").write_text(INTENT_YAML)
+    with pytest.raises(intent.IntentError) as e:
+        intent.load_intent(str(tmp_path), ["router1"])
+    assert str(tmp_path / "site1" / "router1.yml") in str(e.value)
+    assert str(tmp_path / "site2" / "router1.yml") in str(e.value)
+
+def device_errors(**device_values) -> List:
+    devices = {'router1': dict(circuits=[dict(circuit="AAA1", interface="GigabitEthernet3")], **device_values)}
+    compiled = intent.compile_devices({'config': {'devices': devices}})['router1']
+    return compiled.errors if isinstance(compiled, intent.IntentError) else []
+
+@pytest.mark.parametrize("pool_size", [0, -1])
+def test_session_pool_size_must_be_positive(pool_size):
+    assert device_errors(session_pool_size=pool_size) == [f"config.devices.router1.session_pool_size: invalid value {pool_size}"]
+    assert device_errors(session_pool_size=4) == []
+
+@pytest.mark.parametrize("field, value", [("interface_bulk_max_bytes", 0), ("interface_bulk_max_bytes", -5),
+                                          ("ip_sla_port", 0), ("ip_sla_port", 65536), ("ip_sla_port", -1)])
+def test_device_sizes_and_ports_rejected(field, value):
+    assert device_errors(**{field: value}) == [f"config.devices.router1.{field}: invalid value {value}"]
+
+@pytest.mark.parametrize("ping_count", [0, -3])
+def test_ping_count_must_be_positive(ping_count):
+    circuit = dict(circuit="AAA1", interface="GigabitEthernet3", tests={'icmp': {'ping_count': ping_count}})
+    compiled = intent.compile_devices({'config': {'devices': {'router1': {'circuits': [circuit]}}}})['router1']
+    assert compiled.errors == [f"config.devices.router1.circuits[0].tests.icmp.ping_count: invalid value {ping_count}"]
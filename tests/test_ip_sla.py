@@ -0,0 +1,42 @@
+from helpers import ip_sla
+
+STATISTICS_OUTPUT = """IPSLAs Latest Operation Statistics
+
+IPSLA operation id: 61000
+Type of operation: icmp-jitter
+        Latest RTT: 2 milliseconds
+Latest operation start time: 10:00:00 UTC Mon Jan 1 2024
+Latest operation return code: OK
+RTT Values:
+        Number Of RTT: 10               RTT Min/Avg/Max: 1/2/4 milliseconds
+Latency one-way time:
+Jitter Time:
+        Number of SD Jitter Samples: 9
+        Number of DS Jitter Samples: 9
+        Source to Destination Jitter Min/Avg/Max: 0/1/3 milliseconds
+        Destination to Source Jitter Min/Avg/Max: 0/5/9 milliseconds
+Packet Loss Values:
+        Loss Source to Destination: 0
+        Source to Destination Loss Periods Number: 0
+        Loss Destination to Source: 0
+"""
+
+
+class ConfiguredDevice:
+    name = "test0000"
+
+    def __init__(self, running_config: str):
+        self.running_config = running_config
+
+    def execute(self, command: str, **kwargs) -> str:
+        return self.running_config
+
+def test_free_ids_skip_configured_probes():
+    device = ConfiguredDevice("ip sla 61000\nip sla 61002\nip sla schedule 61000 life 40 start-time now\n")
+    assert ip_sla.free_ip_sla_ids(device, 3) == [61001, 61003, 61004]
+    probes = {61001: dict(pingable_address="169.254.100.2", source_ip="169.254.100.1", ping_count=10)}
+    assert not any(line.startswith("no ip sla") for line in ip_sla.build_ip_sla_config(probes))
+
+def test_jitter_average_per_direction():
+    jitter = ip_sla.parse_ip_sla_statistics(STATISTICS_OUTPUT)[61000]['ping']['statistics']['jitter']
+    assert jitter == {'min_ms': 0, 'max_ms': 9, 'source_to_destination_avg_ms': 1, 'destination_to_source_avg_ms': 5}
@@ -0,0 +1,80 @@
+import json
+import logging
+import os
+
+from helpers import reporting
+
+
+class ReportedStep:
+    """
+    Keeps the steps a section reports, in the order they were started
+    """
+    def __init__(self, name: str = "root", log: list = None, depth: int = 0):
+        self.name = name
+        self.log = log if log is not None else []
+        self.depth = depth
+        self.result = "passed"
+
+    def start(self, name: str, continue_: bool = False) -> "ReportedStep":
+        step = ReportedStep(name, self.log, self.depth + 1)
+        self.log.append(step)
+        return step
+
+    def __enter__(self) -> "ReportedStep":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        return False
+
+    def __getattr__(self, result: str):
+        def end(reason: str = None):
+            self.result, self.reason = result, reason
+        return end
+
+
+class Section:
+    uid = "interface_tests"
+    parameters = dict()
+
+    @reporting.compact_steps
+    def test_circuits(self, steps):
+        with steps.start("circuit0 - CHECK", continue_=True) as step:
+            logging.info("circuit0 looks fine")
+        with steps.start("circuit1 - CHECK", continue_=True) as step:
+            logging.info("circuit1 counters")
+            with step.start("circuit1 - in errors", continue_=True) as substep:
+                substep.failed("in errors 5 over 0")
+            with step.start("circuit1 - out errors", continue_=True) as substep:
+                substep.skipped("No out errors test required")
+        with steps.start("circuit2 - CHECK", continue_=True) as step:
+            with step.start("circuit2 - gather") as substep:
+                substep.blocked("Device budget exceeded")
+            with step.start("circuit2 - never reached") as substep:
+                pass
+
+
+def test_compact_replays_only_failing_steps(monkeypatch, tmp_path, caplog):
+    monkeypatch.setenv(reporting.REPORT_MODE_ENV, "compact")
+    monkeypatch.setenv(reporting.RESULTS_DIR_ENV, str(tmp_path))
+    caplog.set_level(logging.INFO)
+    steps = ReportedStep()
+    Section().test_circuits(steps)
+    reported = [(step.depth, step.name, step.result) for step in steps.log]
+    assert reported == [
+        (1, "test_circuits - 1 failed, 1 blocked, 1 passed, 1 skipped", "passed"),
+        (1, "circuit1 - CHECK", "passed"),
+        (2, "circuit1 - in errors", "failed"),
+        (2, "circuit1 - out errors", "skipped"),
+        (1, "circuit2 - CHECK", "passed"),
+        (2, "circuit2 - gather", "blocked"),
+    ]
+    #Only the log lines of the replayed steps are written out again
+    assert caplog.messages == ["circuit1 counters"]
+    with open(os.path.join(tmp_path, f"results-{os.getpid()}.jsonl")) as f:
+        results = [json.loads(line) for line in f]
+    assert [(result['step'], result['result']) for result in results] == [
+        ("circuit0 - CHECK", "passed"),
+        ("circuit1 - CHECK / circuit1 - in errors", "failed"),
+        ("circuit1 - CHECK / circuit1 - out errors", "skipped"),
+        ("circuit2 - CHECK / circuit2 - gather", "blocked"),
+    ]
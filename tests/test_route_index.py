@@ -0,0 +1,36 @@
+import ipaddress
+
+import pytest
+
+from helpers.route_index import RouteIndex, natural_prefix_length
+
+
+@pytest.mark.parametrize("address, length", [("10.0.0.0", 8), ("172.16.0.0", 16), ("192.168.1.0", 24), ("224.0.0.1", 32)])
+def test_natural_prefix_length(address, length):
+    assert natural_prefix_length(ipaddress.IPv4Address(address)) == length
+
+def test_classful_network_without_mask():
+    routes = RouteIndex(["172.16.0.0", "10.0.0.0"])
+    assert routes.exact("172.16.0.0/16")
+    assert routes.exact("10.0.0.0/8")
+    assert not routes.exact("172.16.0.0/24")
+    assert routes.covered("172.16.5.0/24")
+
+def test_unknown_length_matches_address_only():
+    #Not on its classful boundary, so IOS printed it without the mask it really has
+    routes = RouteIndex(["10.1.1.0"])
+    assert routes.exact("10.1.1.0/24")
+    assert routes.exact("10.1.1.0/30")
+    assert not routes.exact("10.1.2.0/24")
+    assert routes.longest_match("10.1.1.0/24") is None
+
+def test_exact_and_covered_matches():
+    routes = RouteIndex(["10.0.0.0/16", "10.0.5.0/24", "2001:db8::/32"])
+    assert routes.contains("10.0.5.0/24", "exact")
+    assert not routes.contains("10.0.6.0/24", "exact")
+    assert routes.contains("10.0.6.0/24", "covered")
+    assert routes.longest_match("10.0.5.128/25") == ipaddress.ip_network("10.0.5.0/24")
+    assert routes.contains("2001:db8:1::/48", "covered")
+    assert not routes.contains("10.1.0.0/24", "covered")
+    with pytest.raises(ValueError):
+        routes.contains("10.0.5.0/24", "longest")
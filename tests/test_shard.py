@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from helpers import shard
+
+
+@pytest.fixture
+def served(monkeypatch):
+    monkeypatch.setenv(shard.SHARD_KEY_ENV, "test-key")
+    coordinator = shard.Coordinator("127.0.0.1:0", [["router1", "router2"]])
+    yield coordinator, f"127.0.0.1:{coordinator.listener.address[1]}"
+    coordinator.close()
+
+def test_worker_gets_devices_without_credentials(served):
+    coordinator, address = served
+    assignments = []
+
+    def worker():
+        connection, assignment = shard.join(address)
+        assignments.append(assignment)
+        shard.send_result(connection, assignment['shard'], {name: {'Device Tests': "passed"} for name in assignment['devices']})
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    results = coordinator.run(timeout=10)
+    thread.join()
+    assert assignments == [{'type': 'assignment', 'shard': 0, 'devices': ["router1", "router2"]}]
+    assert results[0]['devices'] == {'router1': {'Device Tests': "passed"}, 'router2': {'Device Tests': "passed"}}
+
+def test_wrong_key_is_rejected(served):
+    coordinator, address = served
+    errors = []
+
+    def intruder():
+        try:
+            Client(shard.parse_address(address), authkey=b"wrong")
+        except AuthenticationError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=intruder)
+    thread.start()
+    results = coordinator.run(timeout=2)
+    thread.join()
+    assert errors
+    assert results[0]['error'] == "timed out waiting for a worker"
@@ -0,0 +1,41 @@
+import glob
+import os
+
+import pytest
+
+from helpers import snapshot
+
+
+@pytest.fixture
+def snapshot_dir(tmp_path, monkeypatch):
+    for name in (snapshot.SNAPSHOT_MODE_ENV, snapshot.SNAPSHOT_DIR_ENV, snapshot.SNAPSHOT_TTL_ENV):
+        monkeypatch.delenv(name, raising=False)
+    return str(tmp_path / "snapshots")
+
+def test_record_then_replay(snapshot_dir):
+    collected = []
+    snapshot.configure_snapshots("record", directory=snapshot_dir)
+    assert snapshot.cached("router1", "show version", lambda: collected.append(1) or "IOS-XE") == "IOS-XE"
+    snapshot.configure_snapshots("replay", directory=snapshot_dir)
+    assert snapshot.cached("router1", "show version", lambda: collected.append(1) or "live") == "IOS-XE"
+    assert collected == [1]
+    with pytest.raises(snapshot.SnapshotMissError):
+        snapshot.cached("router2", "show version", lambda: "live")
+
+def test_identical_output_stored_once(snapshot_dir):
+    snapshot.configure_snapshots("record", directory=snapshot_dir)
+    for device_name in ("router1", "router2"):
+        snapshot.cached(device_name, "show clock", lambda: "10:00:00")
+    assert len(glob.glob(os.path.join(snapshot_dir, "objects", "*", "*.gz"))) == 1
+    assert len(glob.glob(os.path.join(snapshot_dir, "devices", "*", "*.json"))) == 2
+
+def test_cache_mode_ttl(snapshot_dir):
+    snapshot.configure_snapshots("cache", directory=snapshot_dir, ttl=300)
+    assert snapshot.cached("router1", "show clock", lambda: "first") == "first"
+    assert snapshot.cached("router1", "show clock", lambda: "second") == "first"
+    snapshot.configure_snapshots("cache", directory=snapshot_dir, ttl=-1)
+    assert snapshot.cached("router1", "show clock", lambda: "third") == "third"
+
+def test_unknown_mode_rejected(snapshot_dir):
+    with pytest.raises(ValueError):
+        snapshot.configure_snapshots("rewind", directory=snapshot_dir)
@@ -1,13 +1,30 @@
 import logging
 from pyats import aetest
-from pprint import pprint
-from genie.metaparser.util.exceptions import SchemaEmptyParserError
-from ntc_templates.parse import parse_output
+from helpers import history, timing
+from helpers.budget import DeadlineExceeded, expired
 from helpers.helpers import *
+from helpers.reporting import compact_steps
+from helpers.route_index import RouteIndex
+from helpers.collection import CollectionContext, neighbor_wants_routes, gather_neighbor_routes, neighbor_prefix_count, neighbor_route_match
 
 
 parameters = {}
 
+class CommonSetup(aetest.CommonSetup):
+    @aetest.subsection
+    def start_profiling(self, profile_output=None):
+        """
+        Profiles this task when happy_circuits was asked to with --profile_task
+        """
+        timing.start_profile(profile_output)
+
+    @aetest.subsection
+    def create_collection_context(self, device, device_values, deadline=None):
+        """
+        Output collected from the device is kept here and shared by every testcase of this task
+        """
+        self.parent.parameters['collection'] = CollectionContext(device=device, device_values=device_values, deadline=deadline)
+
 class BGPTests(aetest.Testcase):
     """
     Our BGP Tests are defined here
@@ -16,153 +33,208 @@ class BGPTests(aetest.Testcase):
     neighbor_received_routes = dict()
     neighbor_advertised_routes = dict()
     bgp_test_params = dict()
+    blocked = dict()
 
     @aetest.setup
+    @compact_steps
     def get_bgp_info(self, steps):
         """
         Get relevant info from our device to test against
         """
         
-        for circuit in self.parameters['device_values']['circuits']:
-            circuit_id = circuit['circuit']
+        circuits = self.parameters['device_values'].circuits
+        all_neighbors = dict()
+        with steps.start("Collecting bgp neighbor details for all peers - No fail possible", continue_=True) as substep:
+            try:
+                all_neighbors = self.parameters['collection'].bgp_neighbors()
+            except DeadlineExceeded as e:
+                substep.blocked(str(e))
+            if not all_neighbors:
+                substep.skipped("No output from the bulk neighbor parsers")
+
+        for circuit in circuits:
+            circuit_id = circuit.circuit
             with steps.start(f"{circuit_id} - Gathering required bgp details - No fail possible", continue_=True) as substep:
-                interface = circuit.get('interface')
-                self.bgp_test_params[interface] = circuit.get('tests', {}).get('bgp')
-                vrf = self.bgp_test_params[interface].get('vrf')
+                interface = circuit.interface
+                self.bgp_test_params[interface] = circuit.tests.bgp
+                vrf = self.bgp_test_params[interface].vrf
                 if not vrf:
                     logging.info("VRF not defined or is null, setting to default")
                     vrf = "default"
-                if not self.bgp_test_params.get(interface, {}).get('test_bgp'):
+                if not self.bgp_test_params[interface].test_bgp:
                     substep.skipped("No bgp test requested")
-                for neighbor in self.bgp_test_params[interface].get('neighbors'):
-                    neighbor_ip = neighbor.get('neighbor_ip')
+                #Route tables over a down or unreachable circuit are not worth pulling
+                if any(neighbor_wants_routes(neighbor, route_key) for neighbor in self.bgp_test_params[interface].neighbors
+                       for route_key in ('advertised_routes', 'received_routes')):
+                    upstream = self.parameters['collection'].blocked_by(circuit, "bgp_routes")
+                    if upstream:
+                        logging.info(f"{interface} failed the {upstream} check, not collecting its bgp routes")
+                        self.blocked[interface] = f"Blocked by the failed {upstream} check on {interface}"
+                for neighbor in self.bgp_test_params[interface].neighbors:
+                    neighbor_ip = neighbor.neighbor_ip
 
-                    #Get details for ip_bgp_neighbors
+                    #Get details for ip_bgp_neighbors from the bulk collection
                     with substep.start(f"{circuit_id}-{interface} - Getting Neighbor Details") as subsubstep:
-                        try:
-                            neighbor_details = self.parent.parameters['device'].parse(f"show ip bgp neighbor {neighbor_ip}")
-                        except SchemaEmptyParserError:
-                            subsubstep.skipped("No output from parser, invalid command or incorrect neighbor")
-                            neighbor_details = {}
-                        
-                        neighbor_details = neighbor_details.get('vrf', {}).get(vrf, {}).get('neighbor', {}).get(neighbor_ip, {})
+                        neighbor_details = all_neighbors.get(vrf, {}).get(neighbor_ip, {})
                         if neighbor_details:
                             self.ip_bgp_neighbors.setdefault(interface, {})[neighbor_ip] = neighbor_details
+                            self.record_history(circuit, neighbor, neighbor_details)
                         else:
                             subsubstep.skipped("No neighbor details found for the given vrf and neighbor id combination")
-                
-                    #Get details for neighbor_advertised_routes
-                    with substep.start(f"{circuit_id}-{interface} - Getting Neighbor Advertised Routes") as subsubstep:
-                        try:
-                            neighbor_advert = self.parent.parameters['device'].parse(f"show ip bgp neighbor {neighbor_ip} advertised-routes")
-                        except SchemaEmptyParserError:
-                            subsubstep.skipped("No output from parser, invalid command or incorrect neighbor")
-                            neighbor_advert = {}
-                        neighbor_advert = neighbor_advert.get("vrf", {}).get(vrf, {}).get('neighbor', {}).get(neighbor_ip, {})
-                        self.neighbor_advertised_routes.setdefault(interface, {})[neighbor_ip] = neighbor_advert
-
-                    #Get details for neighbor_received_routes
-                    with substep.start(f"{circuit_id}-{interface} - Getting Neighbor Received Routes") as subsubstep:
-                        try:
-                            neighbor_received = self.parent.parameters['device'].parse(f"show ip bgp neighbor {neighbor_ip} routes")
-                        except SchemaEmptyParserError:
-                            subsubstep.skipped("No output from parser, invalid command or incorrect neighbor")
-                            neighbor_received = {}
-                        neighbor_received = neighbor_received.get("vrf", {}).get(vrf, {}).get('neighbor', {}).get(neighbor_ip, {})
-                        self.neighbor_received_routes.setdefault(interface, {})[neighbor_ip] = neighbor_received
+
+                    #Get details for neighbor_advertised_routes and neighbor_received_routes, only when the intent lists routes to check
+                    for table, route_key, route_store in (("advertised-routes", 'advertised_routes', self.neighbor_advertised_routes),
+                                                          ("routes", 'received_routes', self.neighbor_received_routes)):
+                        if not neighbor_wants_routes(neighbor, route_key) or interface in self.blocked:
+                            continue
+                        with substep.start(f"{circuit_id}-{interface} - Getting Neighbor {table}") as subsubstep:
+                            prefixes = [prefix for af in neighbor.address_families for prefix in getattr(af, route_key)]
+                            af_name = neighbor.address_families[0].address_family if neighbor.address_families else None
+                            try:
+                                neighbor_routes = gather_neighbor_routes(device=self.parent.parameters['device'], neighbor_ip=neighbor_ip, vrf=vrf,
+                                                                         table=table, prefixes=prefixes, mode=neighbor.route_lookup,
+                                                                         prefix_count=neighbor_prefix_count(neighbor_details, af_name, table),
+                                                                         route_match=neighbor_route_match(neighbor))
+                            except DeadlineExceeded as e:
+                                self.blocked[interface] = str(e)
+                                subsubstep.blocked(str(e))
+                            route_store.setdefault(interface, {})[neighbor_ip] = neighbor_routes
+                            if not neighbor_routes:
+                                subsubstep.skipped("No output from parser, invalid command or incorrect neighbor")
+
+    def record_history(self, circuit, neighbor, neighbor_details):
+        """
+        Keeps the uptime and prefix counts of the neighbor in the history for trend queries
+        """
+        device_name = self.parameters['device'].name
+        uptime = neighbor_details.get('bgp_session_transport', {}).get('uptime')
+        history.record(device_name, circuit.circuit, neighbor.neighbor_ip, "bgp_uptime_days", milliseconds_to_days(uptime) if uptime else 0)
+        af_name = neighbor.address_families[0].address_family if neighbor.address_families else None
+        for table, metric in (("routes", "bgp_received_prefixes"), ("advertised-routes", "bgp_advertised_prefixes")):
+            history.record(device_name, circuit.circuit, neighbor.neighbor_ip, metric, neighbor_prefix_count(neighbor_details, af_name, table))
 
 
     @aetest.test
+    @compact_steps
     def test_bgp_neighbor_uptime(self, steps):
         """
         Tests if the required neighbor even exists. Will not be present for 
         """
-        for circuit in self.parameters['device_values']['circuits']:
-            circuit_id = circuit['circuit']
-            interface = circuit['interface']
+        for circuit in self.parameters['device_values'].circuits:
+            circuit_id = circuit.circuit
+            interface = circuit.interface
             with steps.start(f"{circuit_id} - Validating neighbor uptime", continue_=True) as substep:
                 #Check to see if this test is really needed or not
-                if not self.bgp_test_params.get(interface, {}).get('test_bgp'):
+                if not self.bgp_test_params[interface].test_bgp:
                     substep.skipped("No bgp test requested")
                 #Check to see if we even have bgp neighbor details for this peer
                 if not self.ip_bgp_neighbors.get(interface, {}):
+                    if expired(self.parameters['device'].name):
+                        substep.blocked(expired(self.parameters['device'].name))
                     substep.failed("Could not find neighbor values for this circuit")
                 for neighbor_ip, neighbor_values in self.ip_bgp_neighbors.get(interface, {}).items():
                     with substep.start(f"{circuit_id}-{interface}-{neighbor_ip} - Validating neighbor uptime", continue_=True) as subsubstep:
                         ms_uptime = neighbor_values.get('bgp_session_transport', {}).get('uptime')
                         if not ms_uptime:
                             subsubstep.failed("There doesn't appear to be an uptime, assuming neighbor is down")
+                        current_neighbor = [neighbor for neighbor in self.bgp_test_params[interface].neighbors if neighbor.neighbor_ip == neighbor_ip][0]
+                        if not current_neighbor.uptime_conform:
+                            subsubstep.skipped("No uptime_conform defined")
                         days_uptime = milliseconds_to_days(ms_uptime)
-                        current_neighbor = [neighbor for neighbor in self.bgp_test_params[interface]['neighbors'] if neighbor['neighbor_ip'] == neighbor_ip][0]
-                        logging.info(f" expected - {current_neighbor['uptime_conform']}")
+                        logging.info(f" expected - {current_neighbor.uptime_conform}")
                         logging.info(f" found - {days_uptime}")
-                        assert compare_values(days_uptime, current_neighbor['uptime_conform'])
+                        assert current_neighbor.uptime_conform(days_uptime)
 
 
     @aetest.test
+    @compact_steps
     def test_bgp_neighbor_advertised(self, steps):
         """
         Tests if bgp neighbor is being advertised our intended routes
         """
-        for circuit in self.parameters['device_values']['circuits']:
-            circuit_id = circuit['circuit']
-            interface = circuit['interface']
+        for circuit in self.parameters['device_values'].circuits:
+            circuit_id = circuit.circuit
+            interface = circuit.interface
             with steps.start(f"{circuit_id} - Validating we are advertising specified routes", continue_=True) as substep:
-                if not self.bgp_test_params.get(interface, {}).get('test_bgp'):
+                if not self.bgp_test_params[interface].test_bgp:
                     substep.skipped("No bgp test requested")
+                if not any(neighbor_wants_routes(neighbor, 'advertised_routes') for neighbor in self.bgp_test_params[interface].neighbors):
+                    substep.skipped("No advertised routes specified for this circuit")
+                if interface in self.blocked:
+                    substep.blocked(self.blocked[interface])
                 if not self.neighbor_advertised_routes.get(interface, {}):
                     substep.failed("Could not find neighbor values for this circuit")
                 for neighbor_ip, neighbor_values in self.neighbor_advertised_routes.get(interface, {}).items():
                     with substep.start(f"{circuit_id}-{interface}-{neighbor_ip} - Validating neighbor is advertised routes", continue_=True) as subsubstep:
-                        current_neighbor = [neighbor for neighbor in self.bgp_test_params[interface]['neighbors'] if neighbor['neighbor_ip'] == neighbor_ip][0]
-                        for af in current_neighbor.get('address_families', {}):
-                            af_name = af.get('address_family')
+                        current_neighbor = [neighbor for neighbor in self.bgp_test_params[interface].neighbors if neighbor.neighbor_ip == neighbor_ip][0]
+                        for af in current_neighbor.address_families:
+                            af_name = af.address_family
                             if af_name == "ipv4 unicast" or not af_name:
                                 af_name = ""
                             if af_name != "" or af_name != "vpnv4 unicast":
                                 logging.info("No known af found, reverting to default")
                                 af_name = ""
-                            if not af.get('advertised_routes'):
-                                subsubstep.skip("No advertised routes specified, skipping this test")
-                            for tested_route in af.get('advertised_routes'):
-                                advertised_routes = neighbor_values.get('address_family', {}).get(af_name, {}).get("advertised").keys()
-                                logging.info(f"Expecting to find {tested_route} in {advertised_routes}")
-                                assert tested_route in advertised_routes
+                            if not af.advertised_routes:
+                                logging.info("No advertised routes specified for this address family")
+                                continue
+                            #Index the table once per neighbor, every tested route is then a walk over its prefix length
+                            advertised_routes = RouteIndex(neighbor_values.get('address_family', {}).get(af_name, {}).get("advertised", {}).keys())
+                            for tested_route in af.advertised_routes:
+                                found = advertised_routes.contains(tested_route, af.route_match)
+                                logging.info(f"Expecting to find {tested_route} ({af.route_match} match) in {len(advertised_routes)} advertised routes - found = {found}")
+                                assert found
 
     @aetest.test
+    @compact_steps
     def test_bgp_neighbor_received(self, steps):
         """
         Tests if we are receiving the intended routes from the peer
         """
-        for circuit in self.parameters['device_values']['circuits']:
-            circuit_id = circuit['circuit']
-            interface = circuit['interface']
+        for circuit in self.parameters['device_values'].circuits:
+            circuit_id = circuit.circuit
+            interface = circuit.interface
             with steps.start(f"{circuit_id} - Validating we are receiving specified routes", continue_=True) as substep:
-                if not self.bgp_test_params.get(interface, {}).get('test_bgp'):
+                if not self.bgp_test_params[interface].test_bgp:
                     substep.skipped("No bgp test requested")
+                if not any(neighbor_wants_routes(neighbor, 'received_routes') for neighbor in self.bgp_test_params[interface].neighbors):
+                    substep.skipped("No received routes specified for this circuit")
+                if interface in self.blocked:
+                    substep.blocked(self.blocked[interface])
                 if not self.neighbor_received_routes.get(interface, {}):
                     substep.failed("Could not find neighbor values for this circuit")
                 for neighbor_ip, neighbor_values in self.neighbor_received_routes.get(interface, {}).items():
                     with substep.start(f"{circuit_id}-{interface}-{neighbor_ip} - Validating neighbor is received routes", continue_=True) as subsubstep:
-                        current_neighbor = [neighbor for neighbor in self.bgp_test_params[interface]['neighbors'] if neighbor['neighbor_ip'] == neighbor_ip][0]
-                        pprint(current_neighbor)
-                        for af in current_neighbor.get('address_families', {}):
-                            af_name = af.get('address_family')
+                        current_neighbor = [neighbor for neighbor in self.bgp_test_params[interface].neighbors if neighbor.neighbor_ip == neighbor_ip][0]
+                        logging.info(current_neighbor)
+                        for af in current_neighbor.address_families:
+                            af_name = af.address_family
                             if af_name == "ipv4 unicast" or not af_name:
                                 af_name = ""
                             if af_name != "" or af_name != "vpnv4 unicast":
                                 logging.info("No known af found, reverting to default")
                                 af_name = ""
-                            if not af.get('advertised_routes'):
-                                subsubstep.skip("No advertised routes specified, skipping this test")
-                            for tested_route in af.get('received_routes'):
-                                logging.critical("Take this test with a grain of salt, Cannot validate prefix length of the route due to Genie parser")
-                                tested_route = tested_route.split('/')[0]
-                                try:
-                                    received_routes = neighbor_values.get('address_family', {}).get(af_name, {}).get("routes").keys()
-                                except:
-                                    received_routes = ""
-                                
-                                logging.info(f"Expecting to find {tested_route} in {received_routes}")
-                                assert tested_route in received_routes
-                        
\ No newline at end of file
+                            if not af.received_routes:
+                                logging.info("No received routes specified for this address family")
+                                continue
+                            #Index the table once per neighbor, routes listed without a mask are given their classful length
+                            received_routes = RouteIndex(neighbor_values.get('address_family', {}).get(af_name, {}).get("routes", {}).keys())
+                            for tested_route in af.received_routes:
+                                found = received_routes.contains(tested_route, af.route_match)
+                                logging.info(f"Expecting to find {tested_route} ({af.route_match} match) in {len(received_routes)} received routes - found = {found}")
+                                assert found
+
+
+class CommonCleanup(aetest.CommonCleanup):
+    @aetest.subsection
+    def stop_profiling(self, profile_output=None):
+        """
+        Writes the profile for this task, if one was started
+        """
+        timing.stop_profile(profile_output)
+
+    @aetest.subsection
+    def flush_history(self):
+        """
+        Writes the values measured by this task to the history database, if one is configured
+        """
+        history.flush()
@@ -0,0 +1,47 @@
+from pyats import aetest
+from helpers import history, timing
+from helpers.collection import CollectionContext
+from testscripts import interface_tests, icmp_tests, bgp_tests
+
+parameters = {}
+
+class CommonSetup(aetest.CommonSetup):
+    @aetest.subsection
+    def start_profiling(self, profile_output=None):
+        """
+        Profiles this task when happy_circuits was asked to with --profile_task
+        """
+        timing.start_profile(profile_output)
+
+    @aetest.subsection
+    def create_collection_context(self, device, device_values, deadline=None):
+        """
+        One context for all three testcases, so each show command is only collected once per device
+        """
+        self.parent.parameters['collection'] = CollectionContext(device=device, device_values=device_values, deadline=deadline)
+
+#The testcases are reused as is, they run in this order against the shared collection context
+class InterfaceTests(interface_tests.InterfaceTests):
+    pass
+
+class ICMPTest(icmp_tests.ICMPTest):
+    pass
+
+class BGPTests(bgp_tests.BGPTests):
+    pass
+
+
+class CommonCleanup(aetest.CommonCleanup):
+    @aetest.subsection
+    def stop_profiling(self, profile_output=None):
+        """
+        Writes the profile for this task, if one was started
+        """
+        timing.stop_profile(profile_output)
+
+    @aetest.subsection
+    def flush_history(self):
+        """
+        Writes the values measured by all three testcases to the history database in one transaction
+        """
+        history.flush()
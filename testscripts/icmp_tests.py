@@ -1,119 +1,272 @@
 import logging
 from pyats import aetest
+from concurrent.futures import ThreadPoolExecutor
+from helpers import history, timing
+from helpers.budget import DeadlineExceeded
 from helpers.helpers import *
+from helpers.collection import CollectionContext, ping_circuit
+from helpers.reporting import compact_steps
+from helpers.ip_sla import free_ip_sla_ids, start_ip_sla_probes, collect_ip_sla_probes, remove_ip_sla_probes
 
 parameters = {}
 
+class CommonSetup(aetest.CommonSetup):
+    @aetest.subsection
+    def start_profiling(self, profile_output=None):
+        """
+        Profiles this task when happy_circuits was asked to with --profile_task
+        """
+        timing.start_profile(profile_output)
+
+    @aetest.subsection
+    def create_collection_context(self, device, device_values, deadline=None):
+        """
+        Output collected from the device is kept here and shared by every testcase of this task
+        """
+        self.parent.parameters['collection'] = CollectionContext(device=device, device_values=device_values, deadline=deadline)
+
 class ICMPTest(aetest.Testcase):
     """
     Our ICMP tests are defined here. 
     """
     icmp_test = dict()
     ping_results = dict()
+    blocked = dict()
 
     @aetest.setup
+    @compact_steps
     def icmp_setup(self, steps):
         """
         Attempts to conduct the specified ping and stores the results in the ping_results dict
         """
-        for circuit in self.parameters['device_values']['circuits']:
-            with steps.start(f"{circuit['circuit']} - Gathering required icmp details"):
+        circuits = self.parameters['device_values'].circuits
+        for circuit in circuits:
+            with steps.start(f"{circuit.circuit} - Gathering required icmp details"):
                 #Get the icmp test parameters from the input yaml
-                self.icmp_test[circuit['interface']] = circuit.get('tests').get('icmp')
+                self.icmp_test[circuit.interface] = circuit.tests.icmp
+                #Pings over a circuit whose interface is down can only time out, don't send them
+                upstream = self.parameters['collection'].blocked_by(circuit, "icmp") if circuit.tests.icmp.test_icmp else None
+                if upstream:
+                    logging.info(f"{circuit.interface} failed the {upstream} check, not pinging over it")
+                    self.blocked[circuit.interface] = f"Blocked by the failed {upstream} check on {circuit.interface}"
 
-            with steps.start(f"{circuit['circuit']} - INITIATE PING {self.icmp_test.get(circuit['interface'], {}).get('pingable_address')} (no fail possible)") as substep:
-                if not self.icmp_test[circuit['interface']].get('test_icmp'):
-                    substep.skipped("No ICMP Test Requested")
-                pingable_address = self.icmp_test.get(circuit['interface'], {}).get('pingable_address')
-                source_vrf = self.icmp_test.get(circuit['interface'], {}).get('vrf')
-                count = self.icmp_test.get(circuit['interface'], {}).get('ping_count')
-                source_address = circuit['interface']
-                
-                #Any VRF input provided when the global vrf should be used results in "Invalid command has been executed"
-                if source_vrf:
-                    #Wake on LAN behavior, ensure arp entry exists
-                    self.parameters['device'].api.ping(address=pingable_address, vrf=source_vrf, source=source_address, count=1, validate=True)
-                    #Actual test
-                    self.ping_results = self.parameters['device'].api.ping(address=pingable_address, source=source_address, vrf=source_vrf, count=count, validate=True)
-                else:
-                    #Wake on LAN behavior, ensure arp entry exists
-                    self.parameters['device'].api.ping(address=pingable_address, source=source_address, count=1, validate=True)
-                    #Actual test
-                    self.ping_results[circuit['interface']] = self.parameters['device'].api.ping(address=pingable_address, source=source_address, count=count, validate=True)
-                #logging.warning(self.ping_results)
+        if self.parameters['device_values'].icmp_probe_backend == "ip_sla":
+            self.run_ip_sla_probes(steps, circuits)
+        else:
+            self.run_pings(steps, circuits)
+        #Let the BGP testcase know which circuits did not answer a single ping
+        for circuit in circuits:
+            success_rate = self.ping_results.get(circuit.interface, {}).get('ping', {}).get('statistics', {}).get('success_rate_percent')
+            if success_rate is not None:
+                self.parameters['collection'].record_outcome(circuit.interface, "icmp", bool(success_rate))
+                self.record_history(circuit)
+
+    def record_history(self, circuit):
+        """
+        Keeps the round trip times, success rate and jitter of the circuit in the history for trend queries
+        """
+        device_name = self.parameters['device'].name
+        statistics = self.ping_results[circuit.interface]['ping']['statistics']
+        round_trip = statistics.get('round_trip') or {}
+        for measure in ('min_ms', 'avg_ms', 'max_ms'):
+            history.record(device_name, circuit.circuit, circuit.interface, f"rtt_{measure}", round_trip.get(measure))
+        history.record(device_name, circuit.circuit, circuit.interface, "success_rate_percent", statistics.get('success_rate_percent'))
+        if statistics.get('jitter'):
+            history.record(device_name, circuit.circuit, circuit.interface, "jitter_ms", statistics['jitter'].get('max_ms'))
+        elif round_trip.get('max_ms') is not None and round_trip.get('min_ms') is not None:
+            history.record(device_name, circuit.circuit, circuit.interface, "jitter_ms", round_trip['max_ms'] - round_trip['min_ms'])
+        if statistics.get('adaptive'):
+            history.record(device_name, circuit.circuit, circuit.interface, "ping_samples", statistics['adaptive']['samples'])
+
+    def run_pings(self, steps, circuits):
+        """
+        Pings every circuit with the ping api, results are stored in ping_results
+        """
+        #Pings for different circuits run side by side, one per session in the device connection pool
+        pool_size = self.parameters['device_values'].session_pool_size
+        with ThreadPoolExecutor(max_workers=pool_size) as executor:
+            pings = {
+                circuit.interface: executor.submit(ping_circuit, device=self.parameters['device'], icmp_test=self.icmp_test[circuit.interface], interface=circuit.interface)
+                for circuit in circuits if self.icmp_test[circuit.interface].test_icmp and circuit.interface not in self.blocked
+            }
+            for circuit in circuits:
+                with steps.start(f"{circuit.circuit} - INITIATE PING {self.icmp_test[circuit.interface].pingable_address} (no fail possible)", continue_=True) as substep:
+                    if not self.icmp_test[circuit.interface].test_icmp:
+                        substep.skipped("No ICMP Test Requested")
+                    if circuit.interface in self.blocked:
+                        substep.blocked(self.blocked[circuit.interface])
+                    try:
+                        self.ping_results[circuit.interface] = pings[circuit.interface].result()
+                    except DeadlineExceeded as e:
+                        #The device budget ran out, everything still waiting on this ping is reported as timed out
+                        self.blocked[circuit.interface] = str(e)
+                        substep.blocked(str(e))
+                    except Exception as e:
+                        #A ping to a dead far end can time out, only that circuit fails its icmp checks
+                        self.ping_results[circuit.interface] = dict()
+                        substep.failed(f"Ping did not complete - {e}")
+
+    def run_ip_sla_probes(self, steps, circuits):
+        """
+        Runs every ICMP probe on the device at once as temporary ip sla operations
+        Results are stored in ping_results in the same shape as the ping api results
+        """
+        device = self.parameters['device']
+        probes = list()
+        probe_interfaces = list()
+        for circuit in circuits:
+            if not self.icmp_test[circuit.interface].test_icmp or circuit.interface in self.blocked:
+                continue
+            icmp_test = self.icmp_test[circuit.interface]
+            #Source from the intent address, or the address the device has on the interface
+            if circuit.tests.interface.ipv4:
+                source_ip = circuit.tests.interface.ipv4.split('/')[0]
+            else:
+                try:
+                    source_ip = self.parameters['collection'].interface_address(circuit.interface)
+                except DeadlineExceeded as e:
+                    self.blocked[circuit.interface] = str(e)
+                    continue
+            if not source_ip:
+                logging.warning(f"No ipv4 address to source the ip sla probe from on {circuit.interface}")
+                self.ping_results[circuit.interface] = dict()
+                continue
+            probes.append(dict(pingable_address=icmp_test.pingable_address, ping_count=icmp_test.ping_count,
+                               vrf=icmp_test.vrf, source_ip=source_ip))
+            probe_interfaces.append(circuit.interface)
+        if not probes:
+            return
+
+        with steps.start(f"Running {len(probes)} ip sla probes (no fail possible)") as substep:
+            try:
+                #Ids are picked per run from the ones free on the device, so probes of a concurrent job are never touched
+                sla_ids = free_ip_sla_ids(device=device, count=len(probes))
+            except DeadlineExceeded as e:
+                for interface in probe_interfaces:
+                    self.blocked[interface] = str(e)
+                substep.blocked(str(e))
+            probes = dict(zip(sla_ids, probes))
+            probe_interfaces = dict(zip(sla_ids, probe_interfaces))
+            try:
+                start_ip_sla_probes(device=device, probes=probes,
+                                    operation=self.parameters['device_values'].ip_sla_operation,
+                                    port=self.parameters['device_values'].ip_sla_port)
+                results = collect_ip_sla_probes(device=device, probes=probes)
+            except DeadlineExceeded as e:
+                #The device budget ran out while waiting on the probes, every probed circuit is reported as timed out
+                for interface in probe_interfaces.values():
+                    self.blocked[interface] = str(e)
+                substep.blocked(str(e))
+            finally:
+                remove_ip_sla_probes(device=device, probes=probes)
+            for sla_id, interface in probe_interfaces.items():
+                self.ping_results[interface] = results.get(sla_id)
 
         
     @aetest.test
+    @compact_steps
     def icmp_response_exists(self, steps):
         """
         Simple check to see if the pings even sent successfully
         """
-        for circuit in self.parameters['device_values']['circuits']:
-            with steps.start(f"{circuit['circuit']}-{circuit['interface']} - VALIDATE RESPONSE", continue_=True) as substep:
-                if not self.icmp_test[circuit['interface']].get('test_icmp'):
+        for circuit in self.parameters['device_values'].circuits:
+            with steps.start(f"{circuit.circuit}-{circuit.interface} - VALIDATE RESPONSE", continue_=True) as substep:
+                if not self.icmp_test[circuit.interface].test_icmp:
                     substep.skipped("No ICMP Test Requested")
+                if circuit.interface in self.blocked:
+                    substep.blocked(self.blocked[circuit.interface])
                 logging.info(f" expected - Non empty dictionary")
-                logging.info(f" found - {self.ping_results.get(circuit['interface'])}")
-                assert self.ping_results.get(circuit['interface'])
+                logging.info(f" found - {self.ping_results.get(circuit.interface)}")
+                assert self.ping_results.get(circuit.interface)
     
     @aetest.test
+    @compact_steps
     def test_response_percentage(self, steps):
         """
         Validate that we recieved our desired amount of ICMP responses
         """
-        for circuit in self.parameters['device_values']['circuits']:
-            with steps.start(f"{circuit['circuit']}-{circuit['interface']} - REPLY COUNT CHECK", continue_=True) as substep:
-                if not self.icmp_test[circuit['interface']].get('test_icmp'):
+        for circuit in self.parameters['device_values'].circuits:
+            with steps.start(f"{circuit.circuit}-{circuit.interface} - REPLY COUNT CHECK", continue_=True) as substep:
+                if not self.icmp_test[circuit.interface].test_icmp:
                     substep.skipped("No ICMP Test Requested")
-                ping_statistics = self.ping_results[circuit['interface']].get('ping', {}).get('statistics')
-                interface_test = self.icmp_test.get(circuit['interface'])
-                if not interface_test.get('success_rate_percent_conform'):
+                if circuit.interface in self.blocked:
+                    substep.blocked(self.blocked[circuit.interface])
+                ping_statistics = self.ping_results[circuit.interface].get('ping', {}).get('statistics')
+                interface_test = self.icmp_test[circuit.interface]
+                if not interface_test.success_rate_percent_conform:
                     substep.skipped("No success_rate_percent_conform defined")
                 if not ping_statistics:
                     substep.failed("Failed to find icmp statistics")
-                logging.info(f" expected - {interface_test.get('success_rate_percent_conform')}")
+                logging.info(f" expected - {interface_test.success_rate_percent_conform}")
                 logging.info(f" found - {ping_statistics.get('success_rate_percent')}")
-                assert compare_values(ping_statistics.get('success_rate_percent'), interface_test.get('success_rate_percent_conform'))
+                assert interface_test.success_rate_percent_conform(ping_statistics.get('success_rate_percent'))
 
     @aetest.test
+    @compact_steps
     def test_max_ms(self, steps):
         """
         Validate that no pings exceeded our max expected latency
         """
-        for circuit in self.parameters['device_values']['circuits']:
-            with steps.start(f"{circuit['circuit']}-{circuit['interface']} - SINGLE PING LATENCY CHECK", continue_=True) as substep:
-                if not self.icmp_test[circuit['interface']].get('test_icmp'):
+        for circuit in self.parameters['device_values'].circuits:
+            with steps.start(f"{circuit.circuit}-{circuit.interface} - SINGLE PING LATENCY CHECK", continue_=True) as substep:
+                if not self.icmp_test[circuit.interface].test_icmp:
                     substep.skipped("No ICMP Test Requested")
-                round_trip = self.ping_results[circuit['interface']].get('ping', {}).get('statistics', {}).get('round_trip')
-                interface_test = self.icmp_test.get(circuit['interface'])
-                if not interface_test.get('max_ms_conform'):
+                if circuit.interface in self.blocked:
+                    substep.blocked(self.blocked[circuit.interface])
+                round_trip = self.ping_results[circuit.interface].get('ping', {}).get('statistics', {}).get('round_trip')
+                interface_test = self.icmp_test[circuit.interface]
+                if not interface_test.max_ms_conform:
                     substep.skipped("No max ms conform defined")
                 if not round_trip:
                     substep.failed("Failed to find icmp statistics")
-                logging.info(f" expected - {interface_test.get('max_ms_conform')}")
+                logging.info(f" expected - {interface_test.max_ms_conform}")
                 logging.info(f" found - {round_trip.get('max_ms')}")
-                assert compare_values(round_trip.get('max_ms'), interface_test.get('max_ms_conform'))
+                assert interface_test.max_ms_conform(round_trip.get('max_ms'))
 
     @aetest.test
+    @compact_steps
     def test_jitter(self, steps):
         """
         Very simple jitter check (max_ms - min_ms). Certainly better tools to check jitter
         If DSCP is not EF, you may get varying results under congestion
         """
-        for circuit in self.parameters['device_values']['circuits']:
-            with steps.start(f"{circuit['circuit']}-{circuit['interface']} - BASIC JITTER TEST EXPECTED = ", continue_=True) as substep:
-                if not self.icmp_test[circuit['interface']].get('test_icmp'):
+        for circuit in self.parameters['device_values'].circuits:
+            with steps.start(f"{circuit.circuit}-{circuit.interface} - BASIC JITTER TEST EXPECTED = ", continue_=True) as substep:
+                if not self.icmp_test[circuit.interface].test_icmp:
                     substep.skipped("No ICMP Test Requested")
-                round_trip = self.ping_results[circuit['interface']].get('ping', {}).get('statistics', {}).get('round_trip')
-                interface_test = self.icmp_test.get(circuit['interface'])
-                if not interface_test.get('jitter_conform'):
+                if circuit.interface in self.blocked:
+                    substep.blocked(self.blocked[circuit.interface])
+                round_trip = self.ping_results[circuit.interface].get('ping', {}).get('statistics', {}).get('round_trip')
+                interface_test = self.icmp_test[circuit.interface]
+                if not interface_test.jitter_conform:
                     substep.skipped("No jitter conform defined")
                 if not round_trip:
                     substep.failed("Failed to find icmp statistics")
-                try:
-                    basic_jitter = int(round_trip.get('max_ms')) - int(round_trip.get('min_ms'))
-                except ValueError:
-                    substep.fail("unable to convert max_ms or min_ms")
-                logging.info(f" expected - {interface_test.get('jitter_conform')}")
+                #ip sla probes measure real per packet jitter, plain pings only give us max_ms - min_ms
+                measured_jitter = self.ping_results[circuit.interface].get('ping', {}).get('statistics', {}).get('jitter')
+                if measured_jitter:
+                    basic_jitter = measured_jitter.get('max_ms')
+                else:
+                    try:
+                        basic_jitter = int(round_trip.get('max_ms')) - int(round_trip.get('min_ms'))
+                    except (TypeError, ValueError):
+                        substep.failed("unable to convert max_ms or min_ms")
+                logging.info(f" expected - {interface_test.jitter_conform}")
                 logging.info(f" found - {basic_jitter}")
-                assert compare_values(basic_jitter, interface_test.get('jitter_conform'))
+                assert interface_test.jitter_conform(basic_jitter)
+
+
+class CommonCleanup(aetest.CommonCleanup):
+    @aetest.subsection
+    def stop_profiling(self, profile_output=None):
+        """
+        Writes the profile for this task, if one was started
+        """
+        timing.stop_profile(profile_output)
+
+    @aetest.subsection
+    def flush_history(self):
+        """
+        Writes the values measured by this task to the history database, if one is configured
+        """
+        history.flush()
@@ -1,9 +1,28 @@
 import logging
 from pyats import aetest
+from helpers import history, timing
+from helpers.budget import DeadlineExceeded
 from helpers.helpers import *
+from helpers.collection import CollectionContext
+from helpers.reporting import compact_steps
 
 parameters = {}
 
+class CommonSetup(aetest.CommonSetup):
+    @aetest.subsection
+    def start_profiling(self, profile_output=None):
+        """
+        Profiles this task when happy_circuits was asked to with --profile_task
+        """
+        timing.start_profile(profile_output)
+
+    @aetest.subsection
+    def create_collection_context(self, device, device_values, deadline=None):
+        """
+        Output collected from the device is kept here and shared by every testcase of this task
+        """
+        self.parent.parameters['collection'] = CollectionContext(device=device, device_values=device_values, deadline=deadline)
+
 class InterfaceTests(aetest.Testcase):
     """
     Test for common interface issues 
@@ -13,46 +32,86 @@ class InterfaceTests(aetest.Testcase):
     interface_details = dict()
 
     @aetest.setup
+    @compact_steps
     def gather_interface_details(self, steps):
         """
         Get all the values we care about out of show interface for future tests along with the test params
         """
 
-        #Get the data show interface
+        #Get the data show interface, once for every circuit on the device
         logging.info(self.parent.parameters['device_values'])
-        for circuit in self.parameters['device_values']['circuits']:
-            with steps.start(f"{circuit['circuit']} - Gathering required interface details"):
+        circuits = self.parameters['device_values'].circuits
+        with steps.start(f"Collecting show interfaces output for {len(circuits)} circuits") as substep:
+            try:
+                interface_index = self.parameters['collection'].interface_index()
+            except DeadlineExceeded as e:
+                #The device budget ran out, every check of this testcase is reported as blocked
+                substep.blocked(str(e))
+        for circuit in circuits:
+            with steps.start(f"{circuit.circuit} - Gathering required interface details", continue_=True) as substep:
                 #Get the interface test parameters from the input yaml
-                self.interface_test[circuit['interface']] = circuit.get('tests').get('interface')
+                self.interface_test[circuit.interface] = circuit.tests.interface
                 #Specific logic to handle subinterfaces, we want to get physical and logical interface counters
-                if circuit.get('is_subinterface'):
+                if circuit.is_subinterface:
                     #Parent interface will be the interface that the parent is built on
-                    parent_interface = split_subintf(circuit['interface'])
-                    logging.info(f"This is a subinterface on {split_subintf(circuit['interface'])}")
-                    interface_log_counters = self.parameters['device'].parse(f"show interface {circuit['interface']}")
-                    interface_phy_counters = self.parameters['device'].parse(f"show interface {parent_interface}")
-                    
+                    parent_interface = split_subintf(circuit.interface)
+                    logging.info(f"This is a subinterface on {parent_interface}")
                 else:
-                    interface_phy_counters = self.parameters['device'].parse(f"show interface {circuit['interface']}")
-                    interface_log_counters = interface_phy_counters
-                    parent_interface = circuit['interface']
+                    parent_interface = circuit.interface
+                for interface in {circuit.interface, parent_interface}:
+                    if interface not in interface_index:
+                        substep.failed(f"{interface} interface not found on device")
 
                 #Get the physical counters from parent interface
-                self.interface_details[circuit['interface']] = dict()
-                self.interface_details[circuit['interface']]['circuit'] = circuit['circuit']
-                self.interface_details[circuit['interface']]['duplex_mode'] = interface_phy_counters.get(parent_interface, {}).get('duplex_mode')
-                self.interface_details[circuit['interface']]['enabled'] = interface_phy_counters.get(parent_interface, {}).get('enabled')
-                self.interface_details[circuit['interface']]['line_protocol'] = interface_phy_counters.get(parent_interface, {}).get('line_protocol')
-                self.interface_details[circuit['interface']]['out_errors'] = interface_phy_counters.get(parent_interface, {}).get('counters', {}).get('out_errors')
-                self.interface_details[circuit['interface']]['out_collision'] = interface_phy_counters.get(parent_interface, {}).get('counters', {}).get('out_collision')
-                self.interface_details[circuit['interface']]['in_errors'] = interface_phy_counters.get(parent_interface, {}).get('counters', {}).get('in_errors')
-                self.interface_details[circuit['interface']]['in_crc_errors'] = interface_phy_counters.get(parent_interface, {}).get('counters', {}).get('in_crc_errors')
+                self.interface_details[circuit.interface] = dict()
+                self.interface_details[circuit.interface]['circuit'] = circuit.circuit
+                self.interface_details[circuit.interface]['duplex_mode'] = interface_index.get(parent_interface, {}).get('duplex_mode')
+                self.interface_details[circuit.interface]['enabled'] = interface_index.get(parent_interface, {}).get('enabled')
+                self.interface_details[circuit.interface]['line_protocol'] = interface_index.get(parent_interface, {}).get('line_protocol')
+                self.interface_details[circuit.interface]['out_errors'] = interface_index.get(parent_interface, {}).get('counters', {}).get('out_errors')
+                self.interface_details[circuit.interface]['out_collision'] = interface_index.get(parent_interface, {}).get('counters', {}).get('out_collision')
+                self.interface_details[circuit.interface]['in_errors'] = interface_index.get(parent_interface, {}).get('counters', {}).get('in_errors')
+                self.interface_details[circuit.interface]['in_crc_errors'] = interface_index.get(parent_interface, {}).get('counters', {}).get('in_crc_errors')
                 #Now we get the logical counters on the parent interface, or subinterface if specified
-                self.interface_details[circuit['interface']]['txload'] = interface_log_counters.get(circuit['interface'], {}).get('txload')
-                self.interface_details[circuit['interface']]['rxload'] = interface_log_counters.get(circuit['interface'], {}).get('rxload')
-                self.interface_details[circuit['interface']]['ipv4'] = interface_log_counters.get(circuit['interface'], {}).get('ipv4', {})
+                self.interface_details[circuit.interface]['txload'] = interface_index.get(circuit.interface, {}).get('txload')
+                self.interface_details[circuit.interface]['rxload'] = interface_index.get(circuit.interface, {}).get('rxload')
+                self.interface_details[circuit.interface]['ipv4'] = interface_index.get(circuit.interface, {}).get('ipv4', {})
+                #In delta mode the error _conform values are tested against rates since the previous run, not lifetime counters
+                if self.interface_test[circuit.interface].counter_mode == "delta":
+                    rates = self.parameters['collection'].counter_rates(parent_interface, self.interface_test[circuit.interface].counter_rate)
+                    if not interface_index.get(parent_interface, {}).get('counters'):
+                        self.interface_details[circuit.interface]['counter_skip'] = f"No error counters found on {parent_interface}, there is no rate to test"
+                    elif rates is None:
+                        self.interface_details[circuit.interface]['counter_skip'] = "Counter baseline recorded, error rates are tested from the next run"
+                    #Only rates are tested in delta mode, a lifetime counter never stands in for a missing rate
+                    for counter in ('in_errors', 'in_crc_errors', 'out_errors', 'out_collision'):
+                        self.interface_details[circuit.interface].pop(counter, None)
+                    self.interface_details[circuit.interface].update(rates or {})
+                self.record_history(circuit, self.interface_details[circuit.interface])
+
+    def missing_rate(self, interface, interface_values, counter):
+        """
+        In delta mode a counter without a rate since the previous run has nothing to test
+        """
+        return self.interface_test[interface].counter_mode == "delta" and counter not in interface_values
+
+    def record_history(self, circuit, interface_values):
+        """
+        Keeps the load and error counters of the circuit in the history for trend queries
+        """
+        device_name = self.parameters['device'].name
+        for load in ('txload', 'rxload'):
+            try:
+                history.record(device_name, circuit.circuit, circuit.interface, load, split_load(interface_values.get(load) or ""))
+            except ValueError:
+                pass
+        #Delta mode values are rates, they are kept apart from the lifetime counters
+        suffix = f"_{circuit.tests.interface.counter_rate}" if circuit.tests.interface.counter_mode == "delta" else ""
+        for counter in ('in_errors', 'in_crc_errors', 'out_errors', 'out_collision'):
+            history.record(device_name, circuit.circuit, circuit.interface, f"{counter}{suffix}", interface_values.get(counter))
 
     @aetest.test
+    @compact_steps
     def test_interface_status(self, steps):
         """
         Test the line protocol of the interface
@@ -60,30 +119,31 @@ class InterfaceTests(aetest.Testcase):
         """
         for interface, interface_values in self.interface_details.items():
             with steps.start(f"{interface_values['circuit']}-{interface} - STATUS CHECK") as substep:
-                if not self.interface_test[interface].get('test_interface'):
+                if not self.interface_test[interface].test_interface:
                     substep.skipped(f"interface tests disabled for interface - {interface}")
                 #Ensure we have the right values in the dictionary
                 if 'line_protocol' in interface_values and 'enabled' in interface_values:
                     
                     #Now create a step to test Line protocol of the interface, continue if AssertionError
-                    with substep.start(f"{interface_values['circuit']}-{interface} - Line protocol test EXPECTED =  {self.interface_test[interface].get('line_protocol')}", continue_=True) as subsubstep:
-                        if not self.interface_test[interface].get('line_protocol'):
+                    with substep.start(f"{interface_values['circuit']}-{interface} - Line protocol test EXPECTED =  {self.interface_test[interface].line_protocol}", continue_=True) as subsubstep:
+                        if not self.interface_test[interface].line_protocol:
                             subsubstep.skipped("No line protocol test required")
-                        logging.info(f" expected - {self.interface_test[interface].get('line_protocol').lower()}")
+                        logging.info(f" expected - {self.interface_test[interface].line_protocol.lower()}")
                         logging.info(f" found - {interface_values.get('line_protocol').lower()}")
-                        assert interface_values.get('line_protocol').lower() == self.interface_test[interface].get('line_protocol').lower()
+                        assert interface_values.get('line_protocol').lower() == self.interface_test[interface].line_protocol.lower()
                     #Now create a step to test enablement of the interface, continue if AssertionError
-                    with substep.start(f"{interface_values['circuit']}-{interface} - Interface enabled check EXPECTED =  {self.interface_test[interface].get('enabled')}", continue_=True):   
-                        if not self.interface_test[interface].get('enabled'):
+                    with substep.start(f"{interface_values['circuit']}-{interface} - Interface enabled check EXPECTED =  {self.interface_test[interface].enabled}", continue_=True):   
+                        if not self.interface_test[interface].enabled:
                             subsubstep.skipped("No enabled test required")
-                        logging.info(f" expected - {self.interface_test[interface].get('enabled')}")
+                        logging.info(f" expected - {self.interface_test[interface].enabled}")
                         logging.info(f" found - {interface_values.get('enabled')}")
-                        assert interface_values.get('enabled') == self.interface_test[interface].get('enabled')
+                        assert interface_values.get('enabled') == self.interface_test[interface].enabled
 
                 else:
                     self.failed("Test did not find the required line protocol and enabled keys")
 
     @aetest.test
+    @compact_steps
     def test_interface_input_errors(self, steps):
         """
         Test for crc/in errors
@@ -91,26 +151,33 @@ class InterfaceTests(aetest.Testcase):
         """
         for interface, interface_values in self.interface_details.items():
             with steps.start(f"{interface_values['circuit']}-{interface} - INPUT ERROR CHECK") as substep:
-                if not self.interface_test[interface].get('test_interface'):
+                if not self.interface_test[interface].test_interface:
                     substep.skipped(f"interface tests disabled for interface - {interface}")
-                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface input errors EXPECTED {self.interface_test[interface].get('in_errors_conform')}", continue_=True) as subsubstep:
-                    if not self.interface_test[interface].get('in_errors_conform'):
+                if interface_values.get('counter_skip'):
+                    substep.skipped(interface_values['counter_skip'])
+                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface input errors EXPECTED {self.interface_test[interface].in_errors_conform}", continue_=True) as subsubstep:
+                    if not self.interface_test[interface].in_errors_conform:
                         subsubstep.skipped("No in errors test required")
+                    if self.missing_rate(interface, interface_values, 'in_errors'):
+                        subsubstep.skipped("No in_errors rate since the previous run")
                     #Ensure we have the right values in the dictionary
                     if 'in_errors' in interface_values:
-                        logging.info(f" expected - {self.interface_test[interface].get('in_errors_conform')}")
+                        logging.info(f" expected - {self.interface_test[interface].in_errors_conform}")
                         logging.info(f" found - {interface_values.get('in_errors')}")
-                        assert compare_values(interface_values.get('in_errors'), self.interface_test[interface].get('in_errors_conform'))
-                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface input crc errors EXPECTED =  {self.interface_test[interface].get('in_crc_errors_conform')}", continue_=True) as subsubstep:
-                    if not self.interface_test[interface].get('in_crc_errors_conform'):
+                        assert self.interface_test[interface].in_errors_conform(interface_values.get('in_errors'))
+                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface input crc errors EXPECTED =  {self.interface_test[interface].in_crc_errors_conform}", continue_=True) as subsubstep:
+                    if not self.interface_test[interface].in_crc_errors_conform:
                         subsubstep.skipped("No in crc errors test required")
+                    if self.missing_rate(interface, interface_values, 'in_crc_errors'):
+                        subsubstep.skipped("No in_crc_errors rate since the previous run")
                     #Ensure we have the right values in the dictionary
                     if 'in_crc_errors' in interface_values:
-                        logging.info(f" expected - {self.interface_test[interface].get('in_crc_errors_conform')}")
+                        logging.info(f" expected - {self.interface_test[interface].in_crc_errors_conform}")
                         logging.info(f" found - {interface_values.get('in_crc_errors')}")
-                        assert compare_values(interface_values.get('in_crc_errors'), self.interface_test[interface].get('in_crc_errors_conform'))
+                        assert self.interface_test[interface].in_crc_errors_conform(interface_values.get('in_crc_errors'))
                 
     @aetest.test
+    @compact_steps
     def test_interface_output_errors(self, steps):
         """
         Test for output errors + collisions
@@ -118,26 +185,33 @@ class InterfaceTests(aetest.Testcase):
         """
         for interface, interface_values in self.interface_details.items():
             with steps.start(f"{interface_values['circuit']}-{interface} - OUTBOUND ERROR CHECK") as substep:
-                if not self.interface_test[interface].get('test_interface'):
+                if not self.interface_test[interface].test_interface:
                     substep.skipped(f"interface tests disabled for interface - {interface}")
-                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface output errors EXPECTED = {self.interface_test[interface].get('out_errors_conform')}", continue_=True) as subsubstep:
-                    if not self.interface_test[interface].get('out_errors_conform'):
+                if interface_values.get('counter_skip'):
+                    substep.skipped(interface_values['counter_skip'])
+                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface output errors EXPECTED = {self.interface_test[interface].out_errors_conform}", continue_=True) as subsubstep:
+                    if not self.interface_test[interface].out_errors_conform:
                         subsubstep.skipped("no test for out_errors conform requested")
+                    if self.missing_rate(interface, interface_values, 'out_errors'):
+                        subsubstep.skipped("No out_errors rate since the previous run")
                     #Ensure we have the right values in the dictionary
                     if 'out_errors' in interface_values:
-                        logging.info(f" expected - {self.interface_test[interface].get('out_errors_conform')}")
+                        logging.info(f" expected - {self.interface_test[interface].out_errors_conform}")
                         logging.info(f" found - {interface_values.get('out_errors')}")
-                        assert compare_values(interface_values.get('out_errors'), self.interface_test[interface].get('out_errors_conform'))
-                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface output collisions EXPECTED = {self.interface_test[interface].get('out_collision_conform')}", continue_=True) as subsubstep:
-                    if not self.interface_test[interface].get('out_collision_conform'):
+                        assert self.interface_test[interface].out_errors_conform(interface_values.get('out_errors'))
+                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface output collisions EXPECTED = {self.interface_test[interface].out_collision_conform}", continue_=True) as subsubstep:
+                    if not self.interface_test[interface].out_collision_conform:
                         subsubstep.skipped("no test for out_collision conform requested")
+                    if self.missing_rate(interface, interface_values, 'out_collision'):
+                        subsubstep.skipped("No out_collision rate since the previous run")
                     #Ensure we have the right values in the dictionary
                     if 'out_collision' in interface_values:
-                        logging.info(f" expected - {self.interface_test[interface].get('out_collision_conform')}")
+                        logging.info(f" expected - {self.interface_test[interface].out_collision_conform}")
                         logging.info(f" found - {interface_values.get('out_collision')}")
-                        assert compare_values(interface_values.get('out_collision'), self.interface_test[interface].get('out_collision_conform'))
+                        assert self.interface_test[interface].out_collision_conform(interface_values.get('out_collision'))
 
     @aetest.test
+    @compact_steps
     def test_interface_load(self, steps):
         """
         Test for interface load, inbound and outbound 
@@ -145,26 +219,27 @@ class InterfaceTests(aetest.Testcase):
         """
         for interface, interface_values in self.interface_details.items():
             with steps.start(f"{interface_values['circuit']}-{interface} - LOAD TEST") as substep:
-                if not self.interface_test[interface].get('test_interface'):
+                if not self.interface_test[interface].test_interface:
                     substep.skipped(f"interface tests disabled for interface - {interface}")
-                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface excessive tx load EXPECTED = {self.interface_test[interface].get('txload_conform')}", continue_=True) as subsubstep:
-                    if not self.interface_test[interface].get('txload_conform'):
+                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface excessive tx load EXPECTED = {self.interface_test[interface].txload_conform}", continue_=True) as subsubstep:
+                    if not self.interface_test[interface].txload_conform:
                         subsubstep.skipped("No test required for txload")
                     #Ensure we have the right values in the dictionary
                     if 'txload' in interface_values:
-                        logging.info(f" expected - {self.interface_test[interface].get('txload_conform')}")
+                        logging.info(f" expected - {self.interface_test[interface].txload_conform}")
                         logging.info(f" found - {split_load(interface_values.get('txload'))}")
-                        assert compare_values(split_load(interface_values.get('txload')), self.interface_test[interface].get('txload_conform'))
-                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface excessive rx load EXPECTED = {self.interface_test[interface].get('rxload_conform')}", continue_=True) as subsubstep:
-                    if not self.interface_test[interface].get('rxload_conform'):
+                        assert self.interface_test[interface].txload_conform(split_load(interface_values.get('txload')))
+                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface excessive rx load EXPECTED = {self.interface_test[interface].rxload_conform}", continue_=True) as subsubstep:
+                    if not self.interface_test[interface].rxload_conform:
                         subsubstep.skipped("No test required for rxload")
                     #Ensure we have the right values in the dictionary
                     if 'rxload' in interface_values:
-                        logging.info(f" expected - {self.interface_test[interface].get('rxload_conform')}")
+                        logging.info(f" expected - {self.interface_test[interface].rxload_conform}")
                         logging.info(f" found - {split_load(interface_values.get('rxload'))}")
-                        assert compare_values(split_load(interface_values.get('rxload')), self.interface_test[interface].get('rxload_conform'))
+                        assert self.interface_test[interface].rxload_conform(split_load(interface_values.get('rxload')))
 
     @aetest.test
+    @compact_steps
     def test_interface_duplex(self, steps):
         """
         Test for interface load, inbound and outbound 
@@ -172,29 +247,46 @@ class InterfaceTests(aetest.Testcase):
         """
         for interface, interface_values in self.interface_details.items():
             with steps.start(f"{interface_values['circuit']}-{interface} - DUPLEX TEST") as substep:
-                if not self.interface_test[interface].get('test_interface'):
+                if not self.interface_test[interface].test_interface:
                     substep.skipped(f"interface tests disabled for interface - {interface}")
-                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface correct duplex = {self.interface_test[interface].get('duplex')}", continue_=True) as subsubstep:
-                    if not self.interface_test[interface].get('duplex'):
+                with substep.start(f"{interface_values['circuit']}-{interface} - Test for interface correct duplex = {self.interface_test[interface].duplex}", continue_=True) as subsubstep:
+                    if not self.interface_test[interface].duplex:
                         subsubstep.skipped("No test required for duplex")
                     #Ensure we have the right values in the dictionary
                     if 'duplex' in interface_values:
-                        logging.info(f" expected - {self.interface_test[interface].get('duplex').lower()}")
+                        logging.info(f" expected - {self.interface_test[interface].duplex.lower()}")
                         logging.info(f" found - {interface_values.get('duplex').lower()}")
-                        assert interface_values.get('duplex').lower() == self.interface_test[interface].get('duplex').lower()
+                        assert interface_values.get('duplex').lower() == self.interface_test[interface].duplex.lower()
 
 
     @aetest.test
+    @compact_steps
     def test_interface_ip(self, steps):
         """
         Ensure the interface is configured with our desired IP
         """
         for interface, interface_values in self.interface_details.items():
-            with steps.start(f"{interface_values['circuit']}-{interface} - IP ADDRESS CHECK EXPECTED = {self.interface_test[interface].get('ipv4')}", continue_=True) as substep:
-                if not self.interface_test[interface].get('ipv4'):
+            with steps.start(f"{interface_values['circuit']}-{interface} - IP ADDRESS CHECK EXPECTED = {self.interface_test[interface].ipv4}", continue_=True) as substep:
+                if not self.interface_test[interface].ipv4:
                     substep.skipped("No test required for ipv4")
-                if not self.interface_test[interface].get('test_interface'):
+                if not self.interface_test[interface].test_interface:
                     substep.skipped(f"interface tests disabled for interface - {interface}")
-                logging.info(f" expected - {self.interface_test[interface].get('ipv4')}")
+                logging.info(f" expected - {self.interface_test[interface].ipv4}")
                 logging.info(f" found - {interface_values.get('ipv4').keys()}")
-                assert self.interface_test[interface].get('ipv4') in interface_values.get('ipv4').keys()
\ No newline at end of file
+                assert self.interface_test[interface].ipv4 in interface_values.get('ipv4').keys()
+
+
+class CommonCleanup(aetest.CommonCleanup):
+    @aetest.subsection
+    def stop_profiling(self, profile_output=None):
+        """
+        Writes the profile for this task, if one was started
+        """
+        timing.stop_profile(profile_output)
+
+    @aetest.subsection
+    def flush_history(self):
+        """
+        Writes the values measured by this task to the history database, if one is configured
+        """
+        history.flush()